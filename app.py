@@ -1,69 +1,155 @@
-from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, send_from_directory, g
 from werkzeug.utils import secure_filename
 import os
-import subprocess
-from backend.video_generator import generate_video, stream_generate_video
-from backend.model_trainer import train_model
-from backend.chat_engine import chat_response
+import zipfile
+import uuid
+import json
+import threading
+import time
+from backend.video_generator import generate_video
+from backend.model_trainer import train_model, parse_epochs
+from backend.chat_engine import chat_response, FIXED_PHRASES
+from backend.job_queue import video_jobs, JobQueueFull, JOB_SUCCEEDED, FINISHED_STATES
+from backend.result_cache import result_cache
+from backend.batch_renderer import stream_generate_batch
+from backend.chat_pipeline import ChatPipeline
+from backend.chat_session import sessions, SESSION_COOKIE, SESSION_TTL
+from backend.tts_cache import tts_cache
+from backend.train_scheduler import train_scheduler, stream_train_log, TrainQueueFull, TRAIN_FINISHED_STATES
+from backend.model_registry import model_registry
+from backend.video_stream import stream_job_events
+from backend.progressive_output import progressive_renderer, live_dir, PLAYLIST_NAME
+from backend import tracing
+from backend.device_scheduler import device_scheduler
+from backend.speech_stream import speech_streams
+from backend.audio_features import audio_features
+from backend.chat_renderer import ChatRenderer, idle_loops, resolve_chat_model, stitch_clips
+from backend.upload_store import upload_store, UploadOffsetMismatch, AUDIO_EXTS, VIDEO_EXTS
+from backend.admission import (
+    admission, admit, rejection_response, CLASS_CHAT, CLASS_RENDER, CLASS_BATCH, CLASS_TRAINING,
+)
+
+BATCH_AUDIO_EXTS = {'.wav', '.mp3', '.m4a'}
+# 压缩包内的音频数量与解压后总大小上限，防止 zip 炸弹
+BATCH_ZIP_MAX_MEMBERS = int(os.getenv('BATCH_ZIP_MAX_MEMBERS', 200))
+BATCH_ZIP_MAX_BYTES = int(os.getenv('BATCH_ZIP_MAX_BYTES', 2 * 1024 ** 3))
 
 app = Flask(__name__)
-
-# 简单的GPU参数映射（前端到脚本）
-def _map_gpu_choice(gpu_choice: str) -> str:
-    if not gpu_choice:
-        return "GPU0"
-    val = str(gpu_choice).upper()
-    if val in ("GPU0", "GPU1", "CPU"):
-        return val
-    # 前端的 auto / multi 统一回退到 GPU0
-    return "GPU0"
+# 部署在 nginx 等反向代理之后时，由代理直接 sendfile 视频文件
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE') == '1'
 
 
+@tracing.traced("audio_convert")
 def _maybe_convert_audio_to_wav(path: str) -> str:
-    """Convert mp3/m4a to wav so SyncTalk pipeline can consume it reliably."""
-    ext = os.path.splitext(path)[1].lower()
-    if ext == '.wav':
-        return path
-
-    if ext not in {'.mp3', '.m4a'}:
-        return path
-
-    wav_path = os.path.splitext(path)[0] + '.wav'
-
+    """Convert uploads to 16 kHz mono wav so SyncTalk pipeline can consume it reliably."""
     try:
-        subprocess.run(
-            ['ffmpeg', '-y', '-i', path, wav_path],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        return wav_path
+        # 已经是 16 kHz 单声道 WAV 时直接返回，不启动 ffmpeg；存储中的同一段音频只转换一次
+        return upload_store.ensure_wav(path)
     except Exception as exc:
         raise ValueError(f"音频格式转换失败，请确认 ffmpeg 可用: {exc}")
 
 
+def _save_uploaded_audio(audio_file):
+    # 按内容去重保存，相同的音频只占一份空间、只转换一次
+    upload = upload_store.ingest(audio_file.stream, audio_file.filename, AUDIO_EXTS)
+    return _maybe_convert_audio_to_wav(upload.path)
+
+
 def _prepare_video_request(req):
     """Normalize request payload and persist uploaded audio."""
-    os.makedirs('./static/audios', exist_ok=True)
     saved_audio_path = None
     if 'audio_file' in req.files:
         audio_file = req.files['audio_file']
         if audio_file and audio_file.filename:
-            filename = secure_filename(audio_file.filename)
-            name, ext = os.path.splitext(filename)
-            filename = f"{int(__import__('time').time())}_{name}{ext}"
-            save_path = os.path.join('static', 'audios', filename)
-            audio_file.save(save_path)
-            saved_audio_path = _maybe_convert_audio_to_wav(save_path)
+            saved_audio_path = _save_uploaded_audio(audio_file)
+    ref_audio = saved_audio_path or req.form.get('ref_audio')
+    # 直接引用已上传的内容（分块上传返回的路径）时也算一次使用
+    upload_store.touch(ref_audio)
 
     return {
         "model_name": req.form.get('model_name'),
         "model_param": req.form.get('model_param'),
-        "ref_audio": saved_audio_path or req.form.get('ref_audio'),
-        "gpu_choice": _map_gpu_choice(req.form.get('gpu_choice')),
+        "ref_audio": ref_audio,
+        "gpu_choice": device_scheduler.normalize(req.form.get('gpu_choice')),
         "target_text": req.form.get('target_text'),
     }
 
+def _extract_audio_zip(zip_file):
+    """解压上传的音频压缩包，只保留音频文件，并丢弃压缩包内的目录结构。"""
+    paths = []
+    with zipfile.ZipFile(zip_file) as archive:
+        members = []
+        for info in sorted(archive.infolist(), key=lambda i: i.filename):
+            if info.is_dir():
+                continue
+            filename = secure_filename(os.path.basename(info.filename))
+            if os.path.splitext(filename)[1].lower() in BATCH_AUDIO_EXTS:
+                members.append((info, filename))
+        # 解压前按压缩包目录检查；ZipExtFile 最多只读出 file_size 字节，声明的大小就是上限
+        if len(members) > BATCH_ZIP_MAX_MEMBERS:
+            raise ValueError(f"压缩包内音频过多: {len(members)} 个，最多 {BATCH_ZIP_MAX_MEMBERS} 个")
+        total_size = sum(info.file_size for info, _ in members)
+        if total_size > BATCH_ZIP_MAX_BYTES:
+            raise ValueError(f"压缩包解压后过大: {total_size} 字节，最多 {BATCH_ZIP_MAX_BYTES} 字节")
+        for info, filename in members:
+            # 逐个成员流式写入上传存储，不落地中间文件
+            with archive.open(info) as src:
+                upload = upload_store.ingest(src, filename, BATCH_AUDIO_EXTS)
+            paths.append(_maybe_convert_audio_to_wav(upload.path))
+    return paths
+
+
+def _prepare_batch_request(req):
+    """Collect the shared model params plus every uploaded (or zipped) audio clip."""
+    data = _prepare_video_request(req)
+    audio_paths = []
+    for audio_file in req.files.getlist('audio_files'):
+        if audio_file and audio_file.filename:
+            audio_paths.append(_save_uploaded_audio(audio_file))
+
+    audio_zip = req.files.get('audio_zip')
+    if audio_zip and audio_zip.filename:
+        audio_paths.extend(_extract_audio_zip(audio_zip))
+
+    # 也允许直接传入服务器上已有的音频路径
+    audio_paths.extend(p for p in req.form.getlist('ref_audios') if p)
+    if not audio_paths and data.get('ref_audio'):
+        audio_paths.append(data['ref_audio'])
+    return data, audio_paths
+
+@app.before_request
+def _begin_trace():
+    g.trace_started = time.perf_counter()
+    g.request_id = tracing.begin_request(request.headers.get('X-Request-Id'))
+
+
+@app.after_request
+def _end_trace(response):
+    spans = tracing.end_request()
+    tracing.observe_request(request.endpoint, request.method, response.status_code,
+                            time.perf_counter() - g.get('trace_started', time.perf_counter()))
+    response.headers['X-Request-Id'] = g.get('request_id', '')
+    if spans:
+        response.headers['Server-Timing'] = ", ".join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans
+        )
+    # ?timing=1 或 X-Timing: 1 时在 JSON 响应中附上各阶段耗时（毫秒）
+    wants_timing = request.args.get('timing') == '1' or request.headers.get('X-Timing') == '1'
+    if wants_timing and response.is_json and not response.is_streamed:
+        payload = response.get_json(silent=True)
+        if isinstance(payload, dict):
+            payload['timings'] = [{'stage': name, 'ms': round(seconds * 1000, 1)} for name, seconds in spans]
+            payload['request_id'] = g.get('request_id')
+            response.set_data(json.dumps(payload, ensure_ascii=False))
+    return response
+
+
+# Prometheus 指标：各阶段与各路由的耗时直方图
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(tracing.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
 # 首页
 @app.route('/')
 def index():
@@ -71,11 +157,17 @@ def index():
 
 # 视频生成界面
 @app.route('/video_generation', methods=['GET', 'POST'])
+@admit(CLASS_RENDER)
 def video_generation():
     if request.method == 'POST':
-        data = _prepare_video_request(request)
-
-        video_path = generate_video(data)
+        try:
+            data = _prepare_video_request(request)
+        except ValueError as exc:
+            return jsonify({'status': 'error', 'message': str(exc)}), 400
+
+        # 同步渲染不经过任务队列，渲染期间登记输入音频，避免被上传存储清理
+        with upload_store.using(data.get('ref_audio')):
+            video_path = generate_video(data)
         # 前端使用的路径统一加前缀"/"并规范分隔符
         if isinstance(video_path, str):
             video_path = "/" + video_path.replace("\\", "/")
@@ -86,21 +178,18 @@ def video_generation():
 
 # 模型训练界面
 @app.route('/model_training', methods=['GET', 'POST'])
+@admit(CLASS_TRAINING)
 def model_training():
     if request.method == 'POST':
-        # 是否生成训练日志
-        generate_log = bool(request.form.get('generate_log'))
-
-        data = {
-            "model_choice": request.form.get('model_choice'),
-            "ref_video": request.form.get('ref_video'),
-            "gpu_choice": _map_gpu_choice(request.form.get('gpu_choice')),
-            "epoch": request.form.get('epoch'),
-            "custom_params": request.form.get('custom_params'),
-            "generate_log": generate_log,
-        }
-
-        video_path = train_model(data)
+        try:
+            data = _training_request_data(request)
+        except ValueError as exc:
+            return jsonify({'status': 'error', 'message': str(exc)}), 400
+        # 是否生成训练日志；任务接口总是生成
+        data["generate_log"] = bool(request.form.get('generate_log'))
+
+        with upload_store.using(data['ref_video']):
+            video_path = train_model(data)
         video_path = "/" + video_path.replace("\\", "/")
 
         return jsonify({'status': 'success', 'video_path': video_path})
@@ -108,8 +197,94 @@ def model_training():
     return render_template('model_training.html')
 
 
+def _training_ref_video(req):
+    """训练视频：随表单上传的文件存入上传存储；否则是分块上传返回的路径或服务器上已有的视频。"""
+    video_file = req.files.get('ref_video_file')
+    if video_file and video_file.filename:
+        return upload_store.ingest(video_file.stream, video_file.filename, VIDEO_EXTS).path
+    ref_video = req.form.get('ref_video')
+    upload_store.touch(ref_video)
+    return ref_video
+
+
+def _training_request_data(req):
+    return {
+        "model_choice": req.form.get('model_choice'),
+        "ref_video": _training_ref_video(req),
+        "gpu_choice": device_scheduler.normalize(req.form.get('gpu_choice')),
+        "epoch": parse_epochs(req.form.get('epoch')),
+        "train_mode": req.form.get('train_mode'),
+        "custom_params": req.form.get('custom_params'),
+        "generate_log": True,
+    }
+
+
+def _train_job_not_found(job_id):
+    return jsonify({'status': 'error', 'message': f'训练任务不存在: {job_id}'}), 404
+
+
+# 训练任务调度：提交后立即返回，按 GPU 槽位排队执行
+@app.route('/model_training/jobs', methods=['GET', 'POST'])
+@admit(CLASS_TRAINING)
+def model_training_jobs():
+    if request.method == 'GET':
+        return jsonify({'status': 'success', 'jobs': [j.to_dict() for j in train_scheduler.list()]})
+
+    try:
+        job = train_scheduler.submit(_training_request_data(request))
+    except ValueError as exc:
+        return jsonify({'status': 'error', 'message': str(exc)}), 400
+    except TrainQueueFull as exc:
+        return rejection_response(str(exc), admission.retry_after(CLASS_TRAINING))
+    return jsonify({'status': 'success', 'job_id': job.id, 'job': job.to_dict()}), 202
+
+
+@app.route('/model_training/jobs/<job_id>', methods=['GET'])
+def model_training_job_status(job_id):
+    job = train_scheduler.lookup(job_id)
+    if job is None:
+        return _train_job_not_found(job_id)
+    return jsonify({'status': 'success', 'job': job.to_dict(), 'recent_logs': list(job.recent_logs)})
+
+
+@app.route('/model_training/jobs/<job_id>/stream', methods=['GET'])
+def model_training_job_stream(job_id):
+    job = train_scheduler.lookup(job_id)
+    if job is None:
+        return _train_job_not_found(job_id)
+    offset = request.args.get('offset', default=0, type=int)
+
+    def _event_stream():
+        yield from stream_train_log(job, offset)
+
+    return Response(stream_with_context(_event_stream()), mimetype='text/plain')
+
+
+@app.route('/model_training/jobs/<job_id>/cancel', methods=['POST'])
+def model_training_job_cancel(job_id):
+    job = train_scheduler.cancel(job_id)
+    if job is None:
+        return _train_job_not_found(job_id)
+    return jsonify({'status': 'success', 'job': job.to_dict()})
+
+
+@app.route('/model_training/jobs/<job_id>/resume', methods=['POST'])
+@admit(CLASS_TRAINING)
+def model_training_job_resume(job_id):
+    try:
+        job = train_scheduler.resume(job_id)
+    except ValueError as exc:
+        return jsonify({'status': 'error', 'message': str(exc)}), 409
+    except TrainQueueFull as exc:
+        return rejection_response(str(exc), admission.retry_after(CLASS_TRAINING))
+    if job is None:
+        return _train_job_not_found(job_id)
+    return jsonify({'status': 'success', 'job_id': job.id, 'job': job.to_dict()}), 202
+
+
 # 实时对话系统界面
 @app.route('/chat_system', methods=['GET', 'POST'])
+@admit(CLASS_CHAT)
 def chat_system():
     if request.method == 'POST':
         data = {
@@ -119,14 +294,119 @@ def chat_system():
             "api_choice": request.form.get('api_choice'),
         }
 
-        video_path = chat_response(data)
+        # 录音时流式识别已经得到的文字；有则跳过整段录音的二次识别
+        transcript = (request.form.get('transcript') or '').strip() or None
+
+        session = sessions.from_request(request)
+        with session.lock:
+            video_path = chat_response(data, session.dir, transcript)
         video_path = "/" + video_path.replace("\\", "/")
 
-        return jsonify({'status': 'success', 'video_path': video_path})
+        response = jsonify({'status': 'success', 'video_path': video_path, 'session_id': session.id})
+        return _with_session_cookie(response, session)
 
     return render_template('chat_system.html')
 
+
+# 对话视频的待机/聆听循环：还没有缓存时在后台渲染，返回 video_path 为 null
+@app.route('/chat_system/idle', methods=['GET'])
+def chat_system_idle():
+    try:
+        model_param, gpu_choice = resolve_chat_model(request.args.to_dict())
+    except ValueError as exc:
+        return jsonify({'status': 'error', 'message': str(exc)}), 400
+    path = idle_loops.get(model_param, gpu_choice)
+    video_path = "/" + path.replace("\\", "/") if path else None
+    return jsonify({'status': 'success', 'video_path': video_path, 'ready': path is not None})
+
+
+def _with_session_cookie(response, session):
+    response.set_cookie(SESSION_COOKIE, session.id, max_age=SESSION_TTL, httponly=True, samesite='Lax')
+    return response
+
+# 流水线式对话：逐句返回文本与音频（NDJSON），首段音频无需等待完整回复
+@app.route('/chat_system/stream', methods=['POST'])
+@admit(CLASS_CHAT)
+def chat_system_stream():
+    session = sessions.from_request(request)
+    audio_path = None
+    audio_file = request.files.get('audio')
+    if audio_file and audio_file.filename:
+        audio_path = session.path(f"stream_input_{uuid.uuid4().hex[:8]}.wav")
+        audio_file.save(audio_path)
+    text = request.form.get('text')
+    if not audio_path and not text:
+        return jsonify({'status': 'error', 'message': '没有音频或文本输入'}), 400
+
+    # 带模型参数时逐句渲染数字人视频，渲染期间先播放该模型的待机循环
+    renderer = None
+    if request.form.get('model_param'):
+        try:
+            renderer = ChatRenderer.from_request_data(request.form.to_dict())
+        except ValueError as exc:
+            return jsonify({'status': 'error', 'message': str(exc)}), 400
+    pipeline = ChatPipeline(
+        output_root=session.path('stream'),
+        conversation_id=session.id,
+        renderer=renderer,
+        stitch=stitch_clips if renderer else None,
+    )
+
+    def _events():
+        if renderer is not None:
+            yield {'type': 'idle', 'path': renderer.idle_loop()}
+        yield from pipeline.run(audio_path=audio_path, text=text)
+
+    def _event_stream():
+        # 同一会话的轮次串行执行，不同会话互不阻塞
+        with session.lock:
+            for event in _events():
+                if event.get('path'):
+                    event['path'] = "/" + event['path'].replace("\\", "/")
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+            session.touch()
+
+    response = Response(stream_with_context(_event_stream()), mimetype='application/x-ndjson')
+    return _with_session_cookie(response, session)
+
+
+def _asr_stream_not_found(stream_id):
+    return jsonify({'status': 'error', 'message': f'语音流不存在: {stream_id}'}), 404
+
+
+# 流式语音输入：录音时分块上传 16 bit 单声道 PCM，VAD 判断一句话结束后立即识别
+@app.route('/chat_system/asr', methods=['POST'])
+@admit(CLASS_CHAT)
+def chat_system_asr_start():
+    sample_rate = request.values.get('sample_rate', default=16000, type=int)
+    lang = request.values.get('lang') or 'zh-CN'
+    try:
+        stream = speech_streams.create(sample_rate, lang)
+    except ValueError as exc:
+        return jsonify({'status': 'error', 'message': str(exc)}), 400
+    return jsonify({'status': 'success', 'stream_id': stream.id, 'sample_rate': stream.sample_rate})
+
+
+@app.route('/chat_system/asr/<stream_id>/chunk', methods=['POST'])
+def chat_system_asr_chunk(stream_id):
+    stream = speech_streams.get(stream_id)
+    if stream is None:
+        return _asr_stream_not_found(stream_id)
+    chunk = request.files.get('audio')
+    pcm = chunk.read() if chunk else request.get_data()
+    return jsonify(dict(speech_streams.feed(stream, pcm), status='success'))
+
+
+@app.route('/chat_system/asr/<stream_id>/end', methods=['POST'])
+def chat_system_asr_end(stream_id):
+    state = speech_streams.close(stream_id)
+    if state is None:
+        return _asr_stream_not_found(stream_id)
+    return jsonify(dict(state, status='success'))
+
+
 @app.route('/save_audio', methods=['POST'])
+@admit(CLASS_CHAT)
 def save_audio():
     if 'audio' not in request.files:
         return jsonify({'status': 'error', 'message': '没有音频文件'})
@@ -135,27 +415,304 @@ def save_audio():
     if audio_file.filename == '':
         return jsonify({'status': 'error', 'message': '没有选择文件'})
     
-    # 确保目录存在
-    os.makedirs('./static/audios', exist_ok=True)
-    
-    # 保存文件
-    audio_file.save('./static/audios/input.wav')
+    # 每个会话写入自己的工作目录，避免并发用户互相覆盖 input.wav
+    session = sessions.from_request(request)
+    with session.lock:
+        # 保存文件
+        audio_file.save(session.path('input.wav'))
+
+        # Trigger backend chat processing after audio upload
+        chat_response({}, session.dir)
+
+    response = jsonify({'status': 'success', 'message': '音频保存成功', 'session_id': session.id})
+    return _with_session_cookie(response, session)
+
 
-    # Trigger backend chat processing after audio upload
-    chat_response({})
+def _upload_not_found(upload_id):
+    return jsonify({'status': 'error', 'message': f'上传会话不存在或已过期: {upload_id}'}), 404
 
-    return jsonify({'status': 'success', 'message': '音频保存成功'})
 
+def _upload_references():
+    """未结束的推理/训练任务（所有 worker）仍在使用的输入文件，上传存储不会清理它们。"""
+    paths = [job.ref_audio for job in video_jobs.records.list() if job.status not in FINISHED_STATES]
+    paths.extend(job.ref_video for job in train_scheduler.list() if job.status not in TRAIN_FINISHED_STATES)
+    paths.extend(job.ref_audio for job in progressive_renderer.list() if job.finished_at is None)
+    return paths
 
+
+upload_store.register_reference_source(_upload_references)
+
+
+# 分块上传：大文件（训练视频）分块传输，中断后查询 offset 从断点继续
+@app.route('/uploads', methods=['POST'])
+def upload_begin():
+    payload = request.get_json(silent=True) or request.form
+    try:
+        state = upload_store.begin(payload.get('filename'), payload.get('size') or 0, payload.get('sha256'))
+    except (TypeError, ValueError) as exc:
+        return jsonify({'status': 'error', 'message': str(exc)}), 400
+    return jsonify(dict(state, status='success'))
+
+
+@app.route('/uploads/stats', methods=['GET'])
+def upload_stats():
+    return jsonify({'status': 'success', 'uploads': upload_store.stats()})
+
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    state = upload_store.status(upload_id)
+    if state is None:
+        return _upload_not_found(upload_id)
+    return jsonify(dict(state, status='success'))
+
+
+@app.route('/uploads/<upload_id>/chunk', methods=['POST'])
+def upload_chunk(upload_id):
+    # 请求体就是分块的原始字节，直接从 request.stream 读取，不经过表单解析
+    offset = request.args.get('offset', default=None, type=int)
+    if offset is None:
+        offset = request.headers.get('Upload-Offset', default=-1, type=int)
+    try:
+        state = upload_store.append(upload_id, offset, request.stream)
+    except KeyError:
+        return _upload_not_found(upload_id)
+    except UploadOffsetMismatch as exc:
+        return jsonify({'status': 'error', 'message': str(exc), 'offset': exc.expected}), 409
+    except ValueError as exc:
+        return jsonify({'status': 'error', 'message': str(exc)}), 400
+    return jsonify(dict(state, status='success'))
+
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def upload_complete(upload_id):
+    try:
+        upload = upload_store.complete(upload_id)
+    except KeyError:
+        return _upload_not_found(upload_id)
+    except UploadOffsetMismatch as exc:
+        return jsonify({'status': 'error', 'message': str(exc), 'offset': exc.expected}), 409
+    except ValueError as exc:
+        return jsonify({'status': 'error', 'message': str(exc)}), 400
+    return jsonify(dict(upload.to_dict(), status='success'))
+
+
+@app.route('/uploads/<upload_id>/cancel', methods=['POST'])
+def upload_cancel(upload_id):
+    if not upload_store.abort(upload_id):
+        return _upload_not_found(upload_id)
+    return jsonify({'status': 'success'})
+
+
+def _sse_response(job, offset=0):
+    response = Response(stream_with_context(stream_job_events(job, offset)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['X-Job-Id'] = job.id
+    return response
+
+
+# SSE 流：提交推理任务并推送日志/进度，断线后可用 /video_generation/stream/<job_id> 续接
 @app.route('/video_generation/stream', methods=['POST'])
+@admit(CLASS_RENDER)
 def video_generation_stream():
-    data = _prepare_video_request(request)
+    try:
+        data = _prepare_video_request(request)
+        job = video_jobs.submit(data, cancel_on_disconnect=True)
+    except ValueError as exc:
+        return jsonify({'status': 'error', 'message': str(exc)}), 400
+    except JobQueueFull as exc:
+        return rejection_response(str(exc), admission.retry_after(CLASS_RENDER))
+    return _sse_response(job)
+
+
+@app.route('/video_generation/stream/<job_id>', methods=['GET'])
+def video_generation_stream_resume(job_id):
+    job = video_jobs.lookup(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    # EventSource 自动重连时带 Last-Event-ID，手动重连时用 ?offset=
+    raw_offset = request.headers.get('Last-Event-ID') or request.args.get('offset') or 0
+    try:
+        offset = int(raw_offset)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': f'无效的偏移: {raw_offset}'}), 400
+    return _sse_response(job, offset)
+
+
+# 批量渲染：同一模型、多个音频，逐段流式返回进度与结果
+@app.route('/video_generation/batch', methods=['POST'])
+@admit(CLASS_BATCH)
+def video_generation_batch():
+    try:
+        data, audio_paths = _prepare_batch_request(request)
+    except (ValueError, zipfile.BadZipFile) as exc:
+        return jsonify({'status': 'error', 'message': str(exc)}), 400
 
     def _event_stream():
-        yield from stream_generate_video(data)
+        # 批量渲染在请求线程里流式执行，输出结束前登记所有输入音频
+        with upload_store.using(*audio_paths):
+            yield from stream_generate_batch(data, audio_paths)
 
     return Response(stream_with_context(_event_stream()), mimetype='text/plain')
 
 
+def _job_not_found(job_id):
+    return jsonify({'status': 'error', 'message': f'任务不存在: {job_id}'}), 404
+
+
+# 异步视频生成任务：提交后立即返回 job_id，由后台设备队列执行
+@app.route('/video_generation/jobs', methods=['POST'])
+@admit(CLASS_RENDER)
+def video_generation_submit():
+    try:
+        data = _prepare_video_request(request)
+        job = video_jobs.submit(data)
+    except ValueError as exc:
+        return jsonify({'status': 'error', 'message': str(exc)}), 400
+    except JobQueueFull as exc:
+        return rejection_response(str(exc), admission.retry_after(CLASS_RENDER))
+
+    return jsonify({'status': 'success', 'job_id': job.id, 'job': job.to_dict()}), 202
+
+
+@app.route('/video_generation/jobs/<job_id>', methods=['GET'])
+def video_generation_job_status(job_id):
+    job = video_jobs.lookup(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    return jsonify({'status': 'success', 'job': job.to_dict()})
+
+
+@app.route('/video_generation/jobs/<job_id>/result', methods=['GET'])
+def video_generation_job_result(job_id):
+    job = video_jobs.lookup(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    if job.status != JOB_SUCCEEDED:
+        return jsonify({'status': 'error', 'message': f'任务尚未完成: {job.status}', 'job': job.to_dict()}), 409
+
+    video_path = "/" + job.video_path.replace("\\", "/")
+    return jsonify({'status': 'success', 'video_path': video_path})
+
+
+@app.route('/video_generation/jobs/<job_id>/cancel', methods=['POST'])
+def video_generation_job_cancel(job_id):
+    job = video_jobs.cancel(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    return jsonify({'status': 'success', 'job': job.to_dict()})
+
+
+# 渐进式输出：边推理边切 HLS 分片，返回的播放列表可以立即开始播放
+@app.route('/video_generation/progressive', methods=['POST'])
+@admit(CLASS_RENDER)
+def video_generation_progressive():
+    try:
+        data = _prepare_video_request(request)
+        job = progressive_renderer.start(data)
+    except ValueError as exc:
+        return jsonify({'status': 'error', 'message': str(exc)}), 400
+    except JobQueueFull as exc:
+        return rejection_response(str(exc), admission.retry_after(CLASS_RENDER))
+    return jsonify({'status': 'success', 'job_id': job.id, 'playlist': job.playlist_url, 'job': job.to_dict()}), 202
+
+
+@app.route('/video_generation/progressive/<job_id>', methods=['GET'])
+def video_generation_progressive_status(job_id):
+    job = progressive_renderer.lookup(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    return jsonify({'status': 'success', 'job': job.to_dict()})
+
+
+@app.route('/video_generation/progressive/<job_id>/cancel', methods=['POST'])
+def video_generation_progressive_cancel(job_id):
+    job = progressive_renderer.cancel(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    return jsonify({'status': 'success', 'job': job.to_dict()})
+
+
+@app.route('/video_generation/live/<job_id>/<path:filename>', methods=['GET'])
+def video_generation_live_file(job_id, filename):
+    job = progressive_renderer.lookup(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    # conditional=True 时支持 Range 请求，播放器可以按字节区间读取分片；
+    # 其他 worker 的任务也从同一台机器上的分片目录读取
+    response = send_from_directory(os.path.abspath(live_dir(job.id)), filename, conditional=True, max_age=0)
+    if filename == PLAYLIST_NAME:
+        # 播放列表在渲染过程中不断追加，不能被缓存
+        response.headers['Cache-Control'] = 'no-cache'
+        response.mimetype = 'application/vnd.apple.mpegurl'
+    elif filename.endswith('.m4s'):
+        response.mimetype = 'video/iso.segment'
+    return response
+
+
+# 视频文件专用出口：覆盖 /static/videos/ 下的默认静态路由，支持 Range、ETag 与条件请求，
+# 拖动进度条时只读取需要的字节区间，未修改的文件直接返回 304
+@app.route('/static/videos/<path:filename>', methods=['GET', 'HEAD'])
+def serve_video(filename):
+    response = send_from_directory(
+        os.path.abspath(os.path.join('static', 'videos')),
+        filename,
+        conditional=True,
+        etag=True,
+        max_age=0,
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    # 同名文件（如 out.mp4）会被重新生成，浏览器每次用 ETag 重新验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# 模型列表：供前端模型选择器使用，数据来自内存索引而不是扫描磁盘
+@app.route('/models', methods=['GET'])
+def list_models():
+    entries = model_registry.list(request.args.get('q'))
+    return jsonify({'status': 'success', 'models': [e.to_dict() for e in entries]})
+
+
+@app.route('/models/<name>', methods=['GET'])
+def get_model(name):
+    entry = model_registry.get(name)
+    if entry is None or not entry.valid:
+        return jsonify({'status': 'error', 'message': f'模型不存在: {name}'}), 404
+    return jsonify({'status': 'success', 'model': entry.to_dict()})
+
+
+@app.route('/devices', methods=['GET'])
+def device_stats():
+    return jsonify({'status': 'success', 'devices': device_scheduler.stats()})
+
+
+@app.route('/admission', methods=['GET'])
+def admission_stats():
+    return jsonify({'status': 'success', 'admission': admission.stats()})
+
+
+@app.route('/video_generation/cache', methods=['GET'])
+def video_generation_cache_stats():
+    return jsonify({'status': 'success', 'cache': result_cache.stats()})
+
+
+@app.route('/video_generation/audio_features', methods=['GET'])
+def video_generation_audio_feature_stats():
+    return jsonify({'status': 'success', 'cache': audio_features.stats()})
+
+
+@app.route('/chat_system/tts_cache', methods=['GET'])
+def chat_system_tts_cache_stats():
+    return jsonify({'status': 'success', 'cache': tts_cache.stats()})
+
+
+def _presynthesize_fixed_phrases():
+    # 后台预合成固定回复，不阻塞启动（gTTS 需要联网）
+    threading.Thread(target=tts_cache.presynthesize, args=(FIXED_PHRASES,), daemon=True).start()
+
+
 if __name__ == '__main__':
+    _presynthesize_fixed_phrases()
     app.run(debug=True, port = 5001)
@@ -0,0 +1,350 @@
+"""准入控制：按客户端限流、按优先级分配并发，过载时快速返回 429/503 而不是让请求超时。
+
+请求分为四个优先级（数字越小越优先）：
+
+* ``chat``：实时对话（``/chat_system``、``/save_audio``、流式对话与语音输入）；
+* ``render``：单个视频生成；
+* ``batch``：批量渲染；
+* ``training``：模型训练。
+
+每个客户端（IP）在每个类别上有一个令牌桶（``ADMISSION_RATES``，如 ``chat=1/10`` 表示
+每秒 1 个、最多攒 10 个），用完后返回 429。通过限流的请求再申请本进程的处理槽位：
+总数为 ``ADMISSION_CAPACITY``，每个类别的上限限制的是它和所有更低优先级类别合计占用的槽位
+（render 的 6 个包括 batch、training 在用的），因此非对话请求加起来最多占 6 个，始终给对话
+留出 2 个；槽位释放时先唤醒优先级最高的等待者。每个类别的等待队列有上限
+（``ADMISSION_QUEUES``），队列已满或等待超时返回 503。两种拒绝都带 ``Retry-After``。
+
+令牌桶和槽位按 worker 进程计数；``ADMISSION=0`` 关闭。
+"""
+import functools
+import math
+import os
+import threading
+import time
+
+from flask import jsonify, make_response, request
+
+from backend.tracing import span
+
+
+CLASS_CHAT = "chat"
+CLASS_RENDER = "render"
+CLASS_BATCH = "batch"
+CLASS_TRAINING = "training"
+
+DEFAULT_CAPACITY = 8
+# 类别 -> (优先级, 该类别及更低优先级类别合计可占用的槽位比例, 等待队列上限, 最长等待秒数)
+DEFAULT_CLASSES = {
+    CLASS_CHAT: (0, 1.0, 16, 10.0),
+    CLASS_RENDER: (1, 0.75, 8, 30.0),
+    CLASS_BATCH: (2, 0.5, 4, 5.0),
+    CLASS_TRAINING: (3, 0.25, 4, 5.0),
+}
+# 类别 -> (每秒令牌数, 桶容量)
+DEFAULT_RATES = {
+    CLASS_CHAT: (1.0, 10),
+    CLASS_RENDER: (0.2, 5),
+    CLASS_BATCH: (0.05, 2),
+    CLASS_TRAINING: (0.02, 3),
+}
+# 闲置超过该时间（秒）的令牌桶已经攒满，可以丢弃
+BUCKET_IDLE_TTL = 3600
+MIN_RETRY_AFTER = 1
+
+
+def enabled():
+    return os.getenv("ADMISSION", "1") != "0"
+
+
+class Rejected(Exception):
+    """Request refused by admission control; carries the HTTP status and Retry-After hint."""
+
+    def __init__(self, status_code, message, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self):
+        """取一个令牌；没有时返回还需等待的秒数，成功时返回 0。"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else BUCKET_IDLE_TTL
+
+    def refund(self):
+        """退还一个令牌（请求被 503 拒绝时），不超过桶容量。"""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class PriorityClass:
+    def __init__(self, name, priority, share, max_queue, max_wait, rate, burst, capacity):
+        self.name = name
+        self.priority = priority
+        self.limit = max(1, int(math.ceil(capacity * share)))
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.rate = rate
+        self.burst = burst
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rate_limited = 0
+        self.shed = 0
+        # 占用槽位时长的滑动平均（秒），用来估算 Retry-After
+        self.avg_hold = 1.0
+
+    def to_dict(self):
+        return {
+            "priority": self.priority,
+            "limit": self.limit,
+            "running": self.running,
+            "waiting": self.waiting,
+            "max_queue": self.max_queue,
+            "rate": self.rate,
+            "burst": self.burst,
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "shed": self.shed,
+            "avg_hold_seconds": round(self.avg_hold, 3),
+        }
+
+
+class Ticket:
+    """A held processing slot; release() exactly once when the work is done."""
+
+    def __init__(self, controller, klass):
+        self._controller = controller
+        self._klass = klass
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self._klass, time.monotonic() - self._started)
+
+
+class AdmissionController:
+    """Per-client token buckets plus priority-ordered slots shared by all request classes."""
+
+    def __init__(self, capacity=None, classes=None, rates=None):
+        self.capacity = capacity or int(os.getenv("ADMISSION_CAPACITY", DEFAULT_CAPACITY))
+        classes = classes or _parse_queues(os.getenv("ADMISSION_QUEUES"))
+        rates = rates or _parse_rates(os.getenv("ADMISSION_RATES"))
+        self.classes = {
+            name: PriorityClass(name, *settings, *rates[name], capacity=self.capacity)
+            for name, settings in classes.items()
+        }
+        self.running = 0
+        self._buckets = {}
+        self._waiters = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._last_sweep = time.monotonic()
+
+    def acquire(self, class_name, client):
+        """限流并申请槽位，成功返回 Ticket，被拒绝时抛出 Rejected。"""
+        klass = self.classes[class_name]
+        with self._cond:
+            self._check_rate_locked(klass, client)
+            if self._can_run_locked(klass, None):
+                return self._admit_locked(klass)
+            if klass.waiting >= klass.max_queue:
+                klass.shed += 1
+                self._refund_locked(klass, client)
+                raise Rejected(503, f"{class_name} 请求排队已满，请稍后再试", self.retry_after(class_name))
+
+            self._seq += 1
+            waiter = (klass.priority, self._seq)
+            self._waiters.append(waiter)
+            klass.waiting += 1
+            deadline = time.monotonic() + klass.max_wait
+            try:
+                with span("admission_wait"):
+                    while not self._can_run_locked(klass, waiter):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            klass.shed += 1
+                            self._refund_locked(klass, client)
+                            raise Rejected(503, f"{class_name} 请求等待超时，请稍后再试", self.retry_after(class_name))
+                        self._cond.wait(remaining)
+                    return self._admit_locked(klass)
+            finally:
+                self._waiters.remove(waiter)
+                klass.waiting -= 1
+                # 自己离开队列后，排在后面的等待者可能可以运行了
+                self._cond.notify_all()
+
+    def retry_after(self, class_name):
+        """估算多久之后有空位：排在前面的请求数 × 平均占用时长 / 可用槽位数。"""
+        klass = self.classes[class_name]
+        ahead = klass.waiting + max(0, self._running_from(klass.priority) - klass.limit + 1)
+        return max(MIN_RETRY_AFTER, klass.avg_hold * (ahead + 1) / klass.limit)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "enabled": enabled(),
+                "capacity": self.capacity,
+                "running": self.running,
+                "classes": {name: klass.to_dict() for name, klass in self.classes.items()},
+            }
+
+    def _check_rate_locked(self, klass, client):
+        now = time.monotonic()
+        if now - self._last_sweep > BUCKET_IDLE_TTL:
+            self._last_sweep = now
+            self._buckets = {
+                key: bucket for key, bucket in self._buckets.items()
+                if now - bucket.updated_at < BUCKET_IDLE_TTL
+            }
+        key = (klass.name, client)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(klass.rate, klass.burst)
+        wait = bucket.take()
+        if wait > 0:
+            klass.rate_limited += 1
+            raise Rejected(429, f"{klass.name} 请求过于频繁，请稍后再试", wait)
+
+    def _running_from(self, priority):
+        """优先级不高于 priority 的类别（含自身）合计占用的槽位。"""
+        return sum(k.running for k in self.classes.values() if k.priority >= priority)
+
+    def _has_room_locked(self, klass):
+        # 占用一个槽位会计入所有优先级不低于 klass 的类别的合计，每一级都不能超过上限
+        if self.running >= self.capacity:
+            return False
+        return all(
+            self._running_from(other.priority) < other.limit
+            for other in self.classes.values() if other.priority <= klass.priority
+        )
+
+    def _refund_locked(self, klass, client):
+        # 因为过载被拒绝的请求不消耗客户端的限流额度，否则过载时的重试会变成 429
+        bucket = self._buckets.get((klass.name, client))
+        if bucket is not None:
+            bucket.refund()
+
+    def _can_run_locked(self, klass, waiter):
+        if not self._has_room_locked(klass):
+            return False
+        # 有更优先（或同优先级但更早）且同样能运行的等待者时让它先走
+        for other in self._waiters:
+            if other == waiter or (waiter is not None and other > waiter):
+                continue
+            if self._has_room_locked(self._class_for_priority(other[0])):
+                return False
+        return True
+
+    def _class_for_priority(self, priority):
+        for klass in self.classes.values():
+            if klass.priority == priority:
+                return klass
+        raise KeyError(priority)
+
+    def _admit_locked(self, klass):
+        self.running += 1
+        klass.running += 1
+        klass.admitted += 1
+        return Ticket(self, klass)
+
+    def _release(self, klass, held):
+        with self._cond:
+            self.running -= 1
+            klass.running -= 1
+            klass.avg_hold = 0.8 * klass.avg_hold + 0.2 * held
+            self._cond.notify_all()
+
+
+def client_id(req):
+    """限流按客户端 IP；部署在反向代理之后时设置 ADMISSION_TRUST_PROXY=1 使用 X-Forwarded-For。"""
+    if os.getenv("ADMISSION_TRUST_PROXY") == "1" and req.access_route:
+        return req.access_route[0]
+    return req.remote_addr or "unknown"
+
+
+def rejection_response(message, retry_after, status_code=503):
+    """过载响应：JSON 错误信息加上 Retry-After（整数秒）。"""
+    retry_after = max(MIN_RETRY_AFTER, int(math.ceil(retry_after)))
+    response = make_response(
+        jsonify({'status': 'error', 'message': message, 'retry_after': retry_after}), status_code
+    )
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def admit(class_name, methods=('POST',)):
+    """路由装饰器：请求处理（包括流式响应的整个输出过程）期间占用 class_name 的一个槽位。"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not enabled() or request.method not in methods:
+                return view(*args, **kwargs)
+            try:
+                ticket = admission.acquire(class_name, client_id(request))
+            except Rejected as exc:
+                return rejection_response(str(exc), exc.retry_after, exc.status_code)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                ticket.release()
+                raise
+            if response.is_streamed:
+                # 流式响应在输出结束、连接关闭时才释放
+                response.call_on_close(ticket.release)
+            else:
+                ticket.release()
+            return response
+        return wrapper
+    return decorator
+
+
+def _parse_queues(raw):
+    """ADMISSION_QUEUES，如 "chat=16,training=2"，只覆盖等待队列上限。"""
+    classes = dict(DEFAULT_CLASSES)
+    for name, value in _parse_pairs(raw):
+        try:
+            priority, share, _, max_wait = classes[name]
+            classes[name] = (priority, share, max(0, int(value)), max_wait)
+        except (KeyError, ValueError):
+            print(f"[backend.admission] 忽略无效的队列配置: {name}={value}")
+    return classes
+
+
+def _parse_rates(raw):
+    """ADMISSION_RATES，如 "chat=2/20,training=0.01/1"（每秒令牌数/桶容量）。"""
+    rates = dict(DEFAULT_RATES)
+    for name, value in _parse_pairs(raw):
+        try:
+            rate, _, burst = value.partition("/")
+            rates[name] = (float(rate), max(1, int(burst or rates[name][1])))
+        except (KeyError, ValueError):
+            print(f"[backend.admission] 忽略无效的限流配置: {name}={value}")
+    return rates
+
+
+def _parse_pairs(raw):
+    if not raw:
+        return []
+    pairs = []
+    for item in raw.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            pairs.append((name.strip().lower(), value.strip()))
+    return pairs
+
+
+admission = AdmissionController()
@@ -0,0 +1,218 @@
+"""音频特征缓存：每段音频（按内容哈希）只提取一次特征，存为 ``.npy`` 供后续推理直接复用。
+
+SyncTalk 每次 ``infer`` 都会先从 wav 提取音频特征（AVE / DeepSpeech / HuBERT），
+同一段音频反复渲染（例如训练后预览固定使用的 ``SyncTalk/audio/aud.wav``、批量渲染中
+重复的音频）时这一步完全是重复计算。这里把提取单独作为一个预处理阶段：
+
+* ``AUDIO_FEATURE_CMD`` 是提取命令模板，可用 ``{audio_path}`` ``{output_path}`` ``{asr_model}``
+  ``{gpu}``（调度器分配给本次推理的设备），命令必须把特征写成 ``.npy``；``python -m backend.audio_features --stub`` 是不需要 GPU 的替身；
+* 结果保存在 ``static/audio_features/<asr_model>/<sha256>.npy``，读取时用内存映射（mmap），
+  ``_build_cmd`` 通过 ``--audio_features`` 把文件交给推理，常驻 worker 则在请求里带上路径；
+  超过总大小上限时按最近使用时间淘汰，``EVICT_GRACE`` 秒内用过的文件可能还在推理中，不淘汰；
+* 需要 SyncTalk 支持 ``features`` 子命令和 ``--audio_features`` 参数，默认关闭，``AUDIO_FEATURES=1`` 开启；
+  提取失败时不影响推理，SyncTalk 会自己从 wav 提取。
+"""
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # 没有 numpy 时无法校验特征文件，缓存整体关闭
+    np = None
+
+from backend.result_cache import file_sha256
+from backend.tracing import span
+
+
+CACHE_DIR = os.path.join("static", "audio_features")
+DEFAULT_ASR_MODEL = "ave"
+DEFAULT_FEATURE_CMD = (
+    "./SyncTalk/run_synctalk.sh features --audio_path {audio_path} "
+    "--output {output_path} --asr_model {asr_model} --gpu {gpu}"
+)
+# 特征文件总大小上限（字节），超过后按最近使用时间淘汰
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+EXTRACT_TIMEOUT = 600
+# 最近这么久（秒）内交给过推理的特征文件不淘汰，避免删掉进行中的 SyncTalk 正在读取的文件
+EVICT_GRACE = 600
+# 调用方没有指定设备时使用的默认设备
+DEFAULT_DEVICE = "GPU0"
+# 提取失败后，同一段音频在这段时间（秒）内不再重试
+FAILURE_BACKOFF = 600
+
+
+def enabled():
+    return np is not None and os.getenv("AUDIO_FEATURES", "0") == "1"
+
+
+def load_features(path):
+    """以只读内存映射打开特征文件，不把整个数组读入内存。"""
+    return np.load(path, mmap_mode='r')
+
+
+class AudioFeatureCache:
+    """Content-addressed cache of extracted audio features."""
+
+    def __init__(self, cache_dir=CACHE_DIR, asr_model=None, cmd_template=None, max_bytes=None):
+        self.asr_model = asr_model or os.getenv("SYNCTALK_ASR_MODEL", DEFAULT_ASR_MODEL)
+        self.cache_dir = os.path.join(cache_dir, self.asr_model)
+        self.cmd_template = cmd_template or os.getenv("AUDIO_FEATURE_CMD", DEFAULT_FEATURE_CMD)
+        self.max_bytes = max_bytes or int(os.getenv("AUDIO_FEATURE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        # 同一段音频并发请求时只提取一次
+        self._key_locks = {}
+        self._failed = {}
+        # (路径, 大小, mtime) -> 内容哈希，避免每次都重新读取音频
+        self._hashes = {}
+
+    def key_for(self, audio_path):
+        stat = os.stat(audio_path)
+        ident = (os.path.abspath(audio_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._hashes.get(ident)
+        if digest is None:
+            digest = file_sha256(audio_path)
+            with self._lock:
+                self._hashes[ident] = digest
+        return digest
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def ensure(self, audio_path, device=None):
+        """返回 audio_path 对应的特征文件路径，需要时在 device 上先提取；不可用时返回 None。"""
+        if not enabled() or not audio_path or not os.path.isfile(audio_path):
+            return None
+        try:
+            key = self.key_for(audio_path)
+        except OSError as exc:
+            print(f"[backend.audio_features] 无法读取音频: {exc}")
+            return None
+        path = self.path_for(key)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            try:
+                # 记录最近使用时间，淘汰时优先保留常用的音频；其他进程刚好淘汰了它时按未命中处理
+                os.utime(path, None)
+            except OSError:
+                pass
+            else:
+                with self._lock:
+                    self.hits += 1
+                return path
+            failed_at = self._failed.get(key)
+            if failed_at is not None and time.time() - failed_at < FAILURE_BACKOFF:
+                return None
+            with self._lock:
+                self.misses += 1
+            with span("audio_features"):
+                ok = self._extract(audio_path, path, device or DEFAULT_DEVICE)
+            if not ok:
+                self._failed[key] = time.time()
+                with self._lock:
+                    self.failures += 1
+                return None
+        self._evict()
+        return path
+
+    def _extract(self, audio_path, path, device):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path[:-4]}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+        cmd = [
+            part.format(audio_path=audio_path, output_path=tmp_path, asr_model=self.asr_model, gpu=device)
+            for part in shlex.split(self.cmd_template)
+        ]
+        print(f"[backend.audio_features] 提取音频特征: {' '.join(cmd)}")
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=EXTRACT_TIMEOUT)
+            if result.returncode != 0:
+                print(f"[backend.audio_features] 特征提取失败，退出码 {result.returncode}: {result.stderr.strip()[-500:]}")
+                return False
+            # 只接受能以 mmap 打开、且至少有一帧的数组
+            features = load_features(tmp_path)
+            if features.ndim == 0 or features.shape[0] == 0:
+                print(f"[backend.audio_features] 特征文件为空: {tmp_path}")
+                return False
+            del features
+            os.replace(tmp_path, path)
+            return True
+        except (OSError, ValueError, subprocess.TimeoutExpired) as exc:
+            print(f"[backend.audio_features] 特征提取失败: {exc}")
+            return False
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _evict(self):
+        try:
+            entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith(".npy") and ".tmp" not in e.name]
+        except OSError:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in entries)
+        cutoff = time.time() - EVICT_GRACE
+        # 至少保留最近使用的一个；最近用过的可能正被推理读取，即使超出上限也不淘汰
+        while total > self.max_bytes and len(entries) > 1 and entries[0].stat().st_mtime < cutoff:
+            entry = entries.pop(0)
+            total -= entry.stat().st_size
+            try:
+                os.remove(entry.path)
+                print(f"[backend.audio_features] 淘汰音频特征: {entry.path}")
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "asr_model": self.asr_model,
+                "enabled": enabled(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "failures": self.failures,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def _stub_main(args):
+    """替身提取器：每 40ms 一帧，输出 16 个频带的对数能量，形状 (帧数, 16)。"""
+    from backend.audio_ingest import load_pcm
+    samples = load_pcm(args.audio_path).samples().astype(np.float32) / 32768.0
+    hop = 640  # 16 kHz 下 40ms，对应 25fps 的视频帧
+    frames = max(1, len(samples) // hop)
+    padded = np.zeros(frames * hop, dtype=np.float32)
+    padded[:min(len(samples), frames * hop)] = samples[:frames * hop]
+    spectrum = np.abs(np.fft.rfft(padded.reshape(frames, hop), axis=1))
+    bands = np.array_split(spectrum, 16, axis=1)
+    features = np.log1p(np.stack([b.mean(axis=1) for b in bands], axis=1)).astype(np.float32)
+    if args.delay:
+        time.sleep(args.delay)
+    np.save(args.output, features)
+    sys.stderr.write(f"[stub] features {features.shape} -> {args.output}\n")
+
+
+audio_features = AudioFeatureCache()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="SyncTalk audio feature extractor (stub)")
+    parser.add_argument("--stub", action="store_true", help="compute synthetic band-energy features")
+    parser.add_argument("--audio_path", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--asr_model", default=DEFAULT_ASR_MODEL)
+    parser.add_argument("--gpu", default=DEFAULT_DEVICE, help="accepted for parity with the real extractor")
+    parser.add_argument("--delay", type=float, default=0.0, help="simulate extraction time (seconds)")
+    cli_args = parser.parse_args()
+    if not cli_args.stub:
+        parser.error("only --stub mode is implemented here; the real extractor lives in SyncTalk")
+    _stub_main(cli_args)
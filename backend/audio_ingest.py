@@ -0,0 +1,168 @@
+"""音频接入层：一次解码为内存中的 16 kHz 单声道 PCM，供语音识别和 SyncTalk 输入准备复用。
+
+* 已经是 16 kHz / 单声道 / 16 bit 的 WAV 直接读取帧数据，不做任何转换；
+* 其他 WAV 在内存中用 numpy 向量化地混音、重采样（频域截断，带抗混叠）；
+* mp3/m4a/webm 等压缩格式通过一次 ffmpeg 管道解码到内存，不落地中间文件。
+"""
+import io
+import os
+import subprocess
+import wave
+
+try:
+    import numpy as np
+except ImportError:  # numpy 不可用时，非目标格式的 WAV 也交给 ffmpeg 处理
+    np = None
+
+
+TARGET_RATE = 16000
+TARGET_CHANNELS = 1
+SAMPLE_WIDTH = 2
+
+
+class PcmAudio:
+    """16-bit little-endian PCM held in memory."""
+
+    def __init__(self, data, sample_rate=TARGET_RATE, channels=TARGET_CHANNELS):
+        self.data = data
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    @property
+    def duration(self):
+        frames = len(self.data) // (SAMPLE_WIDTH * self.channels)
+        return frames / float(self.sample_rate) if self.sample_rate else 0.0
+
+    def samples(self):
+        if np is None:
+            raise RuntimeError("需要 numpy 才能访问采样数组")
+        return np.frombuffer(self.data, dtype='<i2')
+
+    def to_wav_bytes(self):
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wf:
+            wf.setnchannels(self.channels)
+            wf.setsampwidth(SAMPLE_WIDTH)
+            wf.setframerate(self.sample_rate)
+            wf.writeframes(self.data)
+        return buffer.getvalue()
+
+    def save_wav(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.to_wav_bytes())
+        os.replace(tmp_path, path)
+        return path
+
+
+def wav_format(path):
+    """返回 WAV 的 (采样率, 声道数, 采样位宽)；不是可解析的 PCM WAV 时返回 None。"""
+    try:
+        with wave.open(path, 'rb') as wf:
+            return wf.getframerate(), wf.getnchannels(), wf.getsampwidth()
+    except (wave.Error, EOFError, OSError):
+        return None
+
+
+def is_target_wav(path):
+    return wav_format(path) == (TARGET_RATE, TARGET_CHANNELS, SAMPLE_WIDTH)
+
+
+def resample(samples, src_rate, dst_rate=TARGET_RATE):
+    """Band-limited FFT resampling of a mono float/int array.
+
+    在频域截断（降采样）或补零（升采样）：高于目标奈奎斯特频率的分量被直接去掉，
+    44.1/48 kHz 降到 16 kHz 时不会像直接线性插值那样产生混叠。
+    """
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+    dst_len = max(1, int(round(len(samples) * dst_rate / float(src_rate))))
+    spectrum = np.fft.rfft(samples)
+    bins = dst_len // 2 + 1
+    if bins <= len(spectrum):
+        spectrum = spectrum[:bins]
+    else:
+        spectrum = np.concatenate([spectrum, np.zeros(bins - len(spectrum), dtype=spectrum.dtype)])
+    return np.fft.irfft(spectrum, n=dst_len) * (dst_len / float(len(samples)))
+
+
+def _decode_wav(path):
+    with wave.open(path, 'rb') as wf:
+        rate, channels, width = wf.getframerate(), wf.getnchannels(), wf.getsampwidth()
+        raw = wf.readframes(wf.getnframes())
+
+    if (rate, channels, width) == (TARGET_RATE, TARGET_CHANNELS, SAMPLE_WIDTH):
+        return PcmAudio(raw)
+    if np is None or width not in (1, 2, 4):
+        return None
+
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) * 256.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype='<i2').astype(np.float32)
+    else:
+        samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 65536.0
+
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    samples = resample(samples, rate)
+    pcm = np.clip(np.round(samples), -32768, 32767).astype('<i2')
+    return PcmAudio(pcm.tobytes())
+
+
+def _decode_ffmpeg(source):
+    """通过 ffmpeg 管道一次性解码为 16 kHz 单声道 s16le，source 可以是路径或 bytes。"""
+    cmd = [
+        'ffmpeg', '-nostdin', '-loglevel', 'error',
+        '-i', 'pipe:0' if isinstance(source, bytes) else source,
+        '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-ac', str(TARGET_CHANNELS), '-ar', str(TARGET_RATE),
+        'pipe:1',
+    ]
+    try:
+        result = subprocess.run(
+            cmd,
+            input=source if isinstance(source, bytes) else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+        )
+    except FileNotFoundError:
+        raise ValueError("音频解码失败，请确认 ffmpeg 可用")
+    except subprocess.CalledProcessError as exc:
+        raise ValueError(f"音频解码失败: {exc.stderr.decode('utf-8', 'ignore').strip()}")
+    return PcmAudio(result.stdout)
+
+
+def load_pcm(source):
+    """Decode a file path or raw bytes into 16 kHz mono PCM, converting only when needed."""
+    if isinstance(source, (bytes, bytearray)):
+        source = bytes(source)
+        if source[:4] == b'RIFF':
+            try:
+                with wave.open(io.BytesIO(source), 'rb') as wf:
+                    if (wf.getframerate(), wf.getnchannels(), wf.getsampwidth()) == (
+                        TARGET_RATE, TARGET_CHANNELS, SAMPLE_WIDTH
+                    ):
+                        return PcmAudio(wf.readframes(wf.getnframes()))
+            except (wave.Error, EOFError):
+                pass
+        return _decode_ffmpeg(source)
+
+    if not os.path.isfile(source):
+        raise FileNotFoundError(source)
+    if wav_format(source) is not None:
+        pcm = _decode_wav(source)
+        if pcm is not None:
+            return pcm
+    return _decode_ffmpeg(source)
+
+
+def ensure_wav(path):
+    """Return a 16 kHz mono WAV path for SyncTalk, reusing the input when it already qualifies."""
+    if is_target_wav(path):
+        return path
+    pcm = load_pcm(path)
+    base, ext = os.path.splitext(path)
+    wav_path = base + ('_16k.wav' if ext.lower() == '.wav' else '.wav')
+    return pcm.save_wav(wav_path)
@@ -0,0 +1,161 @@
+import json
+import os
+import subprocess
+import time
+
+from backend.result_cache import result_cache
+from backend.inference_worker import worker_pool, warm_worker_enabled
+from backend.video_generator import _validate_inputs, _build_cmd, _publish_output, _worker_output_path, infer_slot
+from backend.device_scheduler import device_scheduler
+
+
+def batch_warm_worker_enabled():
+    """批量渲染使用常驻推理进程（整个批次只加载一次模型）：SYNCTALK_WARM_WORKER=1 或只对批量开启的 BATCH_WARM_WORKER=1。
+
+    需要 run_synctalk.sh 支持 serve，因此与 SYNCTALK_WARM_WORKER 一样默认关闭。
+    """
+    return warm_worker_enabled() or os.getenv("BATCH_WARM_WORKER") == "1"
+
+
+def _marker(name, payload):
+    return f"__{name}__ {json.dumps(payload, ensure_ascii=False)}\n"
+
+
+def _validate_batch(data, audio_paths):
+    """模型目录只校验一次，音频逐个检查存在性。"""
+    if not audio_paths:
+        raise ValueError("批量任务没有音频文件")
+    model_param, _, gpu_choice = _validate_inputs(dict(data, ref_audio=audio_paths[0]))
+    missing = [p for p in audio_paths if not p or not os.path.isfile(p)]
+    if missing:
+        raise ValueError(f"音频文件不存在: {', '.join(map(str, missing))}")
+    return model_param, gpu_choice
+
+
+def stream_generate_batch(data, audio_paths):
+    """Render many clips against one model and stream per-clip progress.
+
+    命中缓存的片段立即返回；其余片段开启常驻进程时共用同一个已加载模型的 worker，
+    否则按顺序逐个调用 run_synctalk.sh。每个片段渲染期间占用设备的推理槽位。
+    """
+    started = time.time()
+    try:
+        model_param, gpu_choice = _validate_batch(data, audio_paths)
+    except Exception as exc:
+        yield f"__ERROR__ {exc}\n"
+        return
+
+    total = len(audio_paths)
+    yield f"[backend.batch_renderer] 解析模型目录: {model_param}，共 {total} 个音频\n"
+
+    pending = []
+    results = []
+    for index, ref_audio in enumerate(audio_paths):
+        cache_key = result_cache.key_for(model_param, ref_audio)
+        cached_path = result_cache.lookup(cache_key)
+        if cached_path:
+            result = {"index": index, "audio": ref_audio, "video_path": cached_path, "cached": True}
+            results.append(result)
+            yield _marker("CLIP_RESULT", result)
+        else:
+            pending.append((index, ref_audio, cache_key))
+
+    if pending:
+        # 整个批次占用同一个设备，auto 时由调度器选择负载最低的设备
+        device = device_scheduler.assign(gpu_choice)
+        try:
+            completed = yield from _render_pending(model_param, device, pending, total, results)
+        finally:
+            device_scheduler.release(device)
+        if not completed:
+            return
+
+    summary = {
+        "total": total,
+        "succeeded": len(results),
+        "failed": total - len(results),
+        "cached": sum(1 for r in results if r["cached"]),
+        "seconds": round(time.time() - started, 3),
+        "results": sorted(results, key=lambda r: r["index"]),
+    }
+    yield _marker("BATCH_DONE", summary)
+
+
+def _render_pending(model_param, device, pending, total, results):
+    """渲染未命中缓存的片段；常驻进程启动失败时返回 False，调用方直接结束批次。"""
+    use_worker = batch_warm_worker_enabled()
+    worker = None
+    if use_worker:
+        yield f"[backend.batch_renderer] 使用常驻推理进程渲染 {len(pending)} 个片段: {device}\n"
+        try:
+            worker = worker_pool.acquire(model_param, device)
+        except Exception as exc:
+            yield f"__ERROR__ {exc}\n"
+            return False
+
+    rendered = {}
+    try:
+        for index, ref_audio, cache_key in pending:
+            # 同一批次内内容相同的音频只渲染一次
+            if cache_key in rendered:
+                result = {"index": index, "audio": ref_audio, "video_path": rendered[cache_key], "cached": True}
+                results.append(result)
+                yield _marker("CLIP_RESULT", result)
+                continue
+
+            yield _marker("CLIP_START", {"index": index, "audio": ref_audio, "total": total})
+            clip_started = time.time()
+            try:
+                # 与排队任务、对话渲染共用设备的推理并发上限
+                with infer_slot(device):
+                    if use_worker:
+                        if not worker.alive():
+                            # 常驻进程中途退出：归还旧的，向进程池重新申请（池会重新拉起该模型）
+                            yield f"[backend.batch_renderer] 常驻推理进程已退出，重新启动: {device}\n"
+                            worker_pool.release(worker)
+                            worker = None
+                            worker = worker_pool.acquire(model_param, device)
+                        output_path = _worker_output_path(model_param, ref_audio)
+                        for line in worker.stream_infer(ref_audio, output_path):
+                            yield line.rstrip('\n') + "\n"
+                        return_code = 0
+                    else:
+                        return_code = yield from _run_clip(model_param, ref_audio, device)
+
+                if return_code != 0:
+                    raise RuntimeError(f"SyncTalk 推理失败，退出码: {return_code}")
+                # 找不到这段音频的输出时片段失败，不发布兜底视频
+                video_path = _publish_output(model_param, ref_audio, cache_key, strict=True)
+                rendered[cache_key] = video_path
+                result = {
+                    "index": index,
+                    "audio": ref_audio,
+                    "video_path": video_path,
+                    "cached": False,
+                    "seconds": round(time.time() - clip_started, 3),
+                }
+                results.append(result)
+                yield _marker("CLIP_RESULT", result)
+            except Exception as exc:
+                yield _marker("CLIP_ERROR", {"index": index, "audio": ref_audio, "message": str(exc)})
+    finally:
+        if worker is not None:
+            # 批次结束前一直占用该 worker，期间不会被其他模型淘汰
+            worker_pool.release(worker)
+    return True
+
+
+def _run_clip(model_param, ref_audio, gpu_choice):
+    cmd = _build_cmd(model_param, ref_audio, gpu_choice)
+    yield f"[backend.batch_renderer] 执行命令: {' '.join(cmd)}\n"
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1
+    )
+    if process.stdout:
+        for line in process.stdout:
+            yield line.rstrip('\n') + "\n"
+    return process.wait()
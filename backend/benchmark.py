@@ -0,0 +1,441 @@
+"""生成 / 训练 / 对话链路的基准测试。
+
+在临时工作目录中放置 ``run_synctalk.sh``、大模型、ASR、TTS 的替身（延迟和输出大小可配），
+用真实 HTTP 请求按指定并发压测 Flask 路由，统计 p50/p95/p99 延迟、吞吐、
+流式接口的首字节时间以及峰值 RSS，结果写成 JSON，便于不同版本之间对比::
+
+    python -m backend.benchmark --scenarios generate,stream,chat_stream --concurrency 4 --requests 20
+    python -m backend.benchmark --compare benchmark_results/old.json benchmark_results/new.json
+"""
+import argparse
+import contextlib
+import json
+import logging
+import math
+import os
+import platform
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+try:
+    import resource
+except ImportError:  # Windows 上没有 resource，峰值 RSS 记为 None
+    resource = None
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("generate", "stream", "train", "chat", "chat_stream")
+BENCH_MODEL = "bench"
+
+_STUB_SYNCTALK = '''#!{python}
+"""benchmark 用的 run_synctalk.sh 替身"""
+import os, sys, time
+args = sys.argv[1:]
+opts = dict()
+rest = args[1:]
+while rest:
+    # --skip_preprocess 之类的开关不带值
+    if len(rest) > 1 and not rest[1].startswith("--"):
+        opts[rest[0]], rest = rest[1], rest[2:]
+    else:
+        opts[rest[0]], rest = "", rest[1:]
+steps = int(os.getenv("BENCH_STEPS", "10"))
+if args and args[0] == "preprocess":
+    time.sleep(float(os.getenv("BENCH_PREPROCESS_DELAY", "0.5")))
+    os.makedirs(opts["--data_dir"], exist_ok=True)
+    open(os.path.join(opts["--data_dir"], "transforms_train.json"), "w").write("{{}}")
+    sys.exit(0)
+if args and args[0] == "train":
+    epochs = int(opts.get("--epochs", "1"))
+    start = int(opts.get("--start_epoch", "0"))
+    delay = float(os.getenv("BENCH_TRAIN_DELAY", "1.0"))
+    for epoch in range(start + 1, epochs + 1):
+        time.sleep(delay / epochs)
+        print(f"==> Start Training Epoch {{epoch}}/{{epochs}}, loss={{1.0 / epoch:.4f}}", flush=True)
+    name = os.path.splitext(os.path.basename(opts["--video_path"]))[0] + f"_ep{{epochs}}"
+    os.makedirs(os.path.join("SyncTalk", "model", name, "checkpoints"), exist_ok=True)
+    open(os.path.join("SyncTalk", "model", name, "checkpoints", f"ngp_ep{{epochs:04d}}.pth"), "wb").close()
+    sys.exit(0)
+delay = float(os.getenv("BENCH_INFER_DELAY", "1.0"))
+for step in range(1, steps + 1):
+    time.sleep(delay / steps)
+    print(f"{{100 * step // steps}}%|#| {{step}}/{{steps}} [00:00<00:00, 10.0it/s]", flush=True)
+model_dir = opts["--model_dir"].rstrip("/")
+audio = os.path.splitext(os.path.basename(opts["--audio_path"]))[0]
+results = os.path.join(model_dir, "results")
+os.makedirs(results, exist_ok=True)
+remaining = int(os.getenv("BENCH_OUTPUT_BYTES", str(1024 * 1024)))
+with open(os.path.join(results, os.path.basename(model_dir) + "_" + audio + ".mp4"), "wb") as f:
+    chunk = b"\\0" * (1024 * 1024)
+    while remaining > 0:
+        f.write(chunk[:remaining])
+        remaining -= len(chunk)
+'''
+
+
+def percentile(values, pct):
+    """线性插值的百分位数；空列表返回 None。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "mean": round(sum(values) / len(values), 4),
+        "max": round(max(values), 4),
+    }
+
+
+def peak_rss_kb():
+    if resource is None:
+        return {"server": None, "children": None}
+    # Linux 上 ru_maxrss 的单位是 KB；子进程部分是所有已回收 SyncTalk 替身中的最大值
+    return {
+        "server": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def write_wav(path, seconds, seed=0):
+    """写一段 16 kHz 单声道正弦波，seed 不同则内容不同（避免命中结果缓存）。"""
+    rate = 16000
+    freq = 220 + seed % 500
+    # 开头两个采样直接写入 seed，保证不同 seed 的文件内容一定不同
+    frames = struct.pack("<I", seed & 0xFFFFFFFF) + b"".join(
+        struct.pack("<h", int(8000 * math.sin(2 * math.pi * freq * i / rate)))
+        for i in range(2, int(rate * seconds))
+    )
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(frames)
+
+
+class _FakeLLMHandler(BaseHTTPRequestHandler):
+    """最小的 chat-completions 替身，支持普通和 stream=true 两种返回。"""
+
+    delay = 0.3
+    reply = "这是基准测试的模拟回复。它有两句话。"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.delay)
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for piece in self.reply.split("。"):
+                if not piece:
+                    continue
+                chunk = {"id": "bench", "created": int(time.time()), "model": body.get("model"),
+                         "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece + "。"}}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+        payload = json.dumps({
+            "id": "bench", "created": int(time.time()), "model": body.get("model"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": self.reply}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class BenchmarkEnv:
+    """Temporary workspace with stubbed SyncTalk, LLM, ASR and TTS plus the app on a real port."""
+
+    def __init__(self, args):
+        self.args = args
+        self.root = args.workdir or tempfile.mkdtemp(prefix="tfg_bench_")
+        self.base_url = None
+        self._llm_server = None
+        self._app_server = None
+        self._asr_calls = 0
+        self._asr_lock = threading.Lock()
+
+    def __enter__(self):
+        args = self.args
+        os.makedirs(os.path.join(self.root, "SyncTalk", "audio"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "SyncTalk", "model", BENCH_MODEL, "checkpoints"), exist_ok=True)
+        open(os.path.join(self.root, "SyncTalk", "model", BENCH_MODEL, "checkpoints", "ngp.pth"), "wb").close()
+        for sub in ("audios", "videos", "logs"):
+            os.makedirs(os.path.join(self.root, "static", sub), exist_ok=True)
+        script = os.path.join(self.root, "SyncTalk", "run_synctalk.sh")
+        with open(script, "w", encoding="utf-8") as f:
+            f.write(_STUB_SYNCTALK.format(python=sys.executable))
+        os.chmod(script, 0o755)
+        write_wav(os.path.join(self.root, "SyncTalk", "audio", "aud.wav"), 0.5)
+
+        _FakeLLMHandler.delay = args.llm_delay
+        self._llm_server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeLLMHandler)
+        threading.Thread(target=self._llm_server.serve_forever, daemon=True).start()
+
+        os.environ.update({
+            "BENCH_INFER_DELAY": str(args.infer_delay),
+            "BENCH_TRAIN_DELAY": str(args.train_delay),
+            "BENCH_OUTPUT_BYTES": str(int(args.output_mb * 1024 * 1024)),
+            "ZHIPU_BASE_URL": f"http://127.0.0.1:{self._llm_server.server_port}/",
+            "ZHIPU_API_KEY": "bench.benchsecret",
+            "TTS_ENGINE": "bench",
+        })
+        if args.job_limits:
+            os.environ["VIDEO_JOB_LIMITS"] = args.job_limits
+        # 所有请求都来自同一个客户端，默认关闭准入控制，测的是后端本身的吞吐
+        if not args.admission:
+            os.environ["ADMISSION"] = "0"
+
+        # 后端的单例都使用相对路径，必须先切换到工作目录再导入 app
+        os.chdir(self.root)
+        sys.path.insert(0, REPO_ROOT)
+        self._install_stubs()
+        import app as flask_app
+        from werkzeug.serving import make_server
+
+        if not args.verbose:
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self._app_server = make_server("127.0.0.1", 0, flask_app.app, threaded=True)
+        threading.Thread(target=self._app_server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self._app_server.server_port}"
+        return self
+
+    def _install_stubs(self):
+        import speech_recognition as sr
+        from backend.tts_cache import register_engine
+
+        def _fake_asr(recognizer, audio_data, *a, **kw):
+            time.sleep(self.args.asr_delay)
+            with self._asr_lock:
+                self._asr_calls += 1
+                # 每次返回不同的文本，避免大模型回复缓存让结果偏乐观
+                return f"基准测试问题 {self._asr_calls}"
+
+        def _fake_tts(text, voice, lang, output_path):
+            time.sleep(self.args.tts_delay)
+            write_wav(output_path, min(2.0, 0.05 * len(text)), seed=len(text))
+            return output_path
+
+        sr.Recognizer.recognize_google = _fake_asr
+        register_engine("bench", _fake_tts, ".wav")
+
+    def __exit__(self, *exc):
+        for server in (self._app_server, self._llm_server):
+            if server is not None:
+                server.shutdown()
+
+
+def _timed_request(client, method, url, stream_ok=None, **kwargs):
+    """返回 (总耗时, 首字节时间, 是否成功)。"""
+    started = time.perf_counter()
+    ttfb = None
+    body = b""
+    with client.stream(method, url, **kwargs) as response:
+        for chunk in response.iter_raw():
+            if ttfb is None:
+                ttfb = time.perf_counter() - started
+            body += chunk
+        ok = response.status_code < 400
+    elapsed = time.perf_counter() - started
+    if stream_ok is not None:
+        ok = ok and stream_ok.encode() in body
+    return elapsed, ttfb, ok
+
+
+def _scenario_request(env, client, name, index):
+    args = env.args
+    seed = 0 if args.reuse_audio else zlib.crc32(f"{name}:{index}".encode())
+    audio_path = os.path.join("static", "audios", f"bench_{name}_{seed}.wav")
+    if not os.path.exists(audio_path):
+        write_wav(audio_path, args.audio_seconds, seed)
+    form = {"model_name": "SyncTalk", "model_param": BENCH_MODEL, "ref_audio": audio_path, "gpu_choice": args.gpu}
+
+    if name == "generate":
+        return _timed_request(client, "POST", "/video_generation", data=form)
+    if name == "stream":
+        return _timed_request(client, "POST", "/video_generation/stream", stream_ok="event: done", data=form)
+    if name == "train":
+        ref_video = os.path.join("static", "videos", f"bench_ref_{index}.mp4")
+        with open(ref_video, "wb") as f:
+            f.write(b"\0" * 1024)
+        return _timed_request(client, "POST", "/model_training", data={
+            "model_choice": "SyncTalk", "ref_video": ref_video, "gpu_choice": args.gpu, "epoch": args.epochs,
+        })
+    with open(audio_path, "rb") as f:
+        audio = f.read()
+    files = {"audio": ("input.wav", audio, "audio/wav")}
+    if name == "chat":
+        return _timed_request(client, "POST", "/save_audio", files=files)
+    return _timed_request(client, "POST", "/chat_system/stream", stream_ok='"type": "done"', files=files)
+
+
+def run_scenario(env, name):
+    args = env.args
+    latencies, ttfbs, errors = [], [], 0
+
+    def _one(index):
+        # 每个请求使用独立的客户端，不共享会话 cookie，模拟不同用户
+        with httpx.Client(base_url=env.base_url, timeout=args.timeout) as client:
+            return _scenario_request(env, client, name, index)
+
+    for i in range(args.warmup):
+        _one(-1 - i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(_one, i) for i in range(args.requests)]
+        for future in futures:
+            try:
+                elapsed, ttfb, ok = future.result()
+            except Exception as exc:
+                errors += 1
+                print(f"[backend.benchmark] {name} 请求异常: {exc}", file=sys.stderr)
+                continue
+            latencies.append(elapsed)
+            if ttfb is not None:
+                ttfbs.append(ttfb)
+            if not ok:
+                errors += 1
+    wall = time.perf_counter() - started
+
+    result = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "wall_seconds": round(wall, 4),
+        "throughput_rps": round(args.requests / wall, 4) if wall else None,
+        "latency": summarize(latencies),
+    }
+    if name in ("stream", "chat_stream"):
+        result["ttfb"] = summarize(ttfbs)
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"未知场景: {', '.join(sorted(unknown))}，可选: {', '.join(SCENARIOS)}")
+
+    out_path = os.path.abspath(args.out or os.path.join(
+        "benchmark_results", f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    ))
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "scenarios": {},
+    }
+
+    with BenchmarkEnv(args) as env:
+        for name in scenarios:
+            print(f"[backend.benchmark] 运行场景 {name} ...", file=sys.stderr)
+            # 后端各处都有 print，压测时默认丢弃，避免终端输出影响计时
+            with open(os.devnull, "w") as devnull:
+                with contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                    report["scenarios"][name] = run_scenario(env, name)
+            print(f"[backend.benchmark] {name}: {json.dumps(report['scenarios'][name])}", file=sys.stderr)
+        report["peak_rss_kb"] = peak_rss_kb()
+        report["meta"]["workdir"] = env.root
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[backend.benchmark] 结果已写入 {out_path}", file=sys.stderr)
+    return report
+
+
+def compare(old_path, new_path):
+    """打印两次结果中每个场景的 p50/p95/吞吐变化（新/旧 - 1）。"""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    for name, result in new["scenarios"].items():
+        before = old["scenarios"].get(name)
+        if not before:
+            continue
+        rows = [
+            ("p50", before["latency"]["p50"], result["latency"]["p50"]),
+            ("p95", before["latency"]["p95"], result["latency"]["p95"]),
+            ("rps", before["throughput_rps"], result["throughput_rps"]),
+        ]
+        if result.get("ttfb") and before.get("ttfb"):
+            rows.append(("ttfb_p50", before["ttfb"]["p50"], result["ttfb"]["p50"]))
+        changes = ", ".join(
+            f"{label} {a:.3f} -> {b:.3f} ({(b / a - 1) * 100:+.1f}%)" for label, a, b in rows if a and b is not None
+        )
+        print(f"{name}: {changes}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generate/train/chat routes against stubs")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma separated: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=20, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed requests per scenario")
+    parser.add_argument("--gpu", default="CPU")
+    parser.add_argument("--job-limits", default=None, help="VIDEO_JOB_LIMITS override, e.g. CPU=4")
+    parser.add_argument("--infer-delay", type=float, default=1.0, help="stub SyncTalk inference seconds")
+    parser.add_argument("--train-delay", type=float, default=1.0, help="stub SyncTalk training seconds")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--output-mb", type=float, default=1.0, help="size of each stub output video")
+    parser.add_argument("--llm-delay", type=float, default=0.3)
+    parser.add_argument("--asr-delay", type=float, default=0.2)
+    parser.add_argument("--tts-delay", type=float, default=0.2)
+    parser.add_argument("--audio-seconds", type=float, default=2.0)
+    parser.add_argument("--admission", action="store_true", help="keep admission control (rate limits, 429/503) enabled")
+    parser.add_argument("--reuse-audio", action="store_true", help="send the same audio every time (cache hits)")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--workdir", default=None, help="workspace directory (default: a new temp dir)")
+    parser.add_argument("--out", default=None, help="result JSON path")
+    parser.add_argument("--verbose", action="store_true", help="keep backend print output")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
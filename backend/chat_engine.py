@@ -1,104 +1,146 @@
 import os
-import speech_recognition as sr
-from zhipuai import ZhipuAI
-from pydub import AudioSegment
-from gtts import gTTS
-
-
-def chat_response(data):
+from backend.llm_client import llm_client
+from backend.audio_ingest import load_pcm
+from backend.tts_cache import tts_cache
+from backend.tracing import traced
+from backend.speech_stream import recognize, RecognizerError
+from backend.chat_renderer import ChatRenderer
+
+
+# 固定回复会在启动时预先合成（见 FIXED_PHRASES），命中 TTS 缓存后无需等待合成
+NOT_HEARD_REPLY = "对不起，我没有听清楚，可以再说一遍吗？"
+LLM_UNAVAILABLE_REPLY = "我现在暂时无法连接大模型，但我已经收到你的话了。"
+FIXED_PHRASES = (NOT_HEARD_REPLY, LLM_UNAVAILABLE_REPLY)
+
+
+def _turn_paths(workdir):
+    """一轮对话用到的文件路径；workdir 为空时沿用单用户模式的固定路径。"""
+    if not workdir:
+        os.makedirs("./static/text", exist_ok=True)
+        return {
+            "input_audio": "./static/audios/input.wav",
+            "input_text": "./static/text/input.txt",
+            "output_text": "./static/text/output.txt",
+            "output_audio": "./static/audios/output.wav",
+        }
+    os.makedirs(workdir, exist_ok=True)
+    return {
+        "input_audio": os.path.join(workdir, "input.wav"),
+        "input_text": os.path.join(workdir, "input.txt"),
+        "output_text": os.path.join(workdir, "output.txt"),
+        "output_audio": os.path.join(workdir, "output.wav"),
+    }
+
+
+def chat_response(data, workdir=None, transcript=None):
     """
     模拟实时对话系统视频生成逻辑。
+
+    workdir 为会话私有目录时，本轮的输入输出文件都写在该目录下，多个会话可以并发。
+    transcript 为录音时流式识别得到的文字，给出时直接使用，不再对整段录音重复识别。
     """
     print("[backend.chat_engine] 收到数据：")
     for k, v in data.items():
         print(f"  {k}: {v}")
 
-    # 语音转文字
-    # input_audio = "./static/audios/input.wav"
-    input_audio = "./static/audios/input.wav"
-    input_text = "./static/text/input.txt"
-
-    os.makedirs("./static/text", exist_ok=True)
+    paths = _turn_paths(workdir)
 
-    text = audio_to_text(input_audio, input_text)
+    # 语音转文字
+    input_audio = paths["input_audio"]
+    input_text = paths["input_text"]
+
+    if transcript:
+        with open(input_text, 'w', encoding='utf-8') as f:
+            f.write(transcript)
+        text = transcript
+    else:
+        text = audio_to_text(input_audio, input_text)
     if not text:
         return os.path.join("static", "videos", "chat_response.mp4")
 
     # 大模型回答
-    output_text = "./static/text/output.txt"
+    output_text = paths["output_text"]
 
     # set to "31af4e1567ad48f49b6d7b914b4145fb.MDVLvMiePGYLRJ7M"
     api_key = os.getenv("ZHIPU_API_KEY")
     model = "glm-4-plus"
 
-    get_ai_response(input_text, output_text, api_key, model)
+    # 会话目录名即会话 id，用于保留多轮对话历史
+    conversation_id = os.path.basename(os.path.normpath(workdir)) if workdir else None
+    get_ai_response(input_text, output_text, api_key, model, conversation_id)
 
     # Text to speech
-    audio_output_path = "./static/audios/output.wav"
+    audio_output_path = paths["output_audio"]
     text_to_speech(output_text, audio_output_path)
 
-    
-    video_path = os.path.join("static", "videos", "chat_response.mp4")
+    # 用所选模型把回复音频渲染成数字人视频
+    video_path = render_reply(data, audio_output_path)
     print(f"[backend.chat_engine] 生成视频路径：{video_path}")
     return video_path
 
+
+def render_reply(data, audio_path):
+    """渲染回复视频；模型不可用或渲染失败时退回该模型的待机循环，再退回默认视频。"""
+    default_video = os.path.join("static", "videos", "chat_response.mp4")
+    try:
+        renderer = ChatRenderer.from_request_data(data)
+    except ValueError as e:
+        print(f"[backend.chat_engine] 跳过回复视频渲染: {e}")
+        return default_video
+    if os.path.isfile(audio_path):
+        try:
+            return renderer(audio_path, 0)
+        except Exception as e:
+            print(f"[backend.chat_engine] 回复视频渲染失败: {e}")
+    return renderer.idle_loop() or default_video
+
+@traced("asr")
 def audio_to_text(input_audio, input_text):
 
-    # Convert audio to PCM WAV format if needed
+    # 一次解码为内存中的 16 kHz 单声道 PCM；已经是目标格式的 WAV 不做转换
     try:
-        audio = AudioSegment.from_file(input_audio)
-        audio = audio.set_channels(1).set_frame_rate(16000)
-        audio.export(input_audio, format="wav")
+        pcm = load_pcm(input_audio)
+    except FileNotFoundError:
+        print(f"音频文件不存在: {input_audio}")
+        return None
     except Exception as e:
         print(f"音频格式转换失败: {e}")
         return None
 
     try:
-        # 初始化识别器
-        recognizer = sr.Recognizer()
-        
-        # 加载音频文件
-        with sr.AudioFile(input_audio) as source:
-            # 调整环境噪声
-            recognizer.adjust_for_ambient_noise(source)
-            # 读取音频数据
-            audio_data = recognizer.record(source)
-            
-            print("正在识别语音...")
-            
-            # 使用Google语音识别
-            text = recognizer.recognize_google(audio_data, language='zh-CN')
-            
-            # 将结果写入文件
+        print("正在识别语音...")
+
+        # 直接使用内存中的音频数据；引擎由 ASR_ENGINE 选择（默认 Google 语音识别）
+        text = recognize(pcm.data, pcm.sample_rate, 'zh-CN')
+        if not text:
+            print("无法识别音频内容")
+            return None
+
+        # 将结果写入文件
+        if input_text:
             with open(input_text, 'w', encoding='utf-8') as f:
                 f.write(text)
-                
-            print(f"语音识别完成！结果已保存到: {input_text}")
-            print(f"识别结果: {text}")
-            
-            return text
-            
-    except sr.UnknownValueError:
-        print("无法识别音频内容")
-    except sr.RequestError as e:
-        print(f"语音识别服务错误: {e}")
-    except FileNotFoundError:
-        print(f"音频文件不存在: {input_audio}")
+
+        print(f"语音识别完成！结果已保存到: {input_text}")
+        print(f"识别结果: {text}")
+
+        return text
+
+    except RecognizerError as e:
+        print(e)
     except Exception as e:
         print(f"发生错误: {e}")
 
-def get_ai_response(input_text, output_text, api_key, model):
-    client = ZhipuAI(api_key = api_key)
+@traced("llm")
+def get_ai_response(input_text, output_text, api_key, model, conversation_id=None):
     with open(input_text, 'r', encoding='utf-8') as file:
         content = file.read().strip()
 
         # protection from null input
         if not content:
-            output = "对不起，我没有听清楚，可以再说一遍吗？"
+            output = NOT_HEARD_REPLY
             with open(output_text, 'w', encoding='utf-8') as file:
                 file.write(output)
-                audio_output_path = "./static/audios/output.wav"
-                text_to_speech(output_text, audio_output_path)
             return output
 
         # some logs
@@ -107,14 +149,10 @@ def get_ai_response(input_text, output_text, api_key, model):
 
     # if unable to connect the model because there are no tokens left
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": content}]
-        )
-        output = response.choices[0].message.content
+        output = llm_client.chat(content, api_key, model, conversation_id)
     except Exception as e:
         print("[LLM] Error:", e)
-        output = "我现在暂时无法连接大模型，但我已经收到你的话了。"
+        output = LLM_UNAVAILABLE_REPLY
 
     with open(output_text, 'w', encoding='utf-8') as file:
         file.write(output)
@@ -126,20 +164,49 @@ def get_ai_response(input_text, output_text, api_key, model):
     print(f"答复已保存到: {output_text}")
     return output
 
-def text_to_speech(input_text_path, output_audio_path):
-    # Read text
-    with open(input_text_path, "r", encoding="utf-8") as f:
-        text = f.read().strip()
+def stream_ai_response(content, api_key, model, conversation_id=None):
+    """Yield the LLM reply incrementally; falls back to the canned reply on errors."""
+    if not content:
+        yield NOT_HEARD_REPLY
+        return
+
+    print("[LLM] User input (stream):")
+    print(content)
+
+    produced = False
+    try:
+        for delta in llm_client.stream_chat(content, api_key, model, conversation_id):
+            produced = True
+            yield delta
+    except Exception as e:
+        print("[LLM] Error:", e)
+        if not produced:
+            yield LLM_UNAVAILABLE_REPLY
 
+
+@traced("tts")
+def synthesize_speech(text, output_audio_path):
+    """Synthesize text directly (no intermediate text file); returns the audio path or None."""
+    text = (text or "").strip()
     if not text:
         print("[TTS] Empty text, skip TTS")
-        return
+        return None
 
     try:
-        tts = gTTS(text=text, lang="zh")
-        tts.save(output_audio_path)
+        # 相同文本命中 TTS 缓存时直接链接已合成的音频
+        tts_cache.synthesize(text, output_audio_path)
         print(f"[TTS] Audio saved to: {output_audio_path}")
+        return output_audio_path
     except Exception as e:
         print("[TTS] Error:", e)
+        return None
+
+
+def text_to_speech(input_text_path, output_audio_path):
+    # Read text
+    with open(input_text_path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+
+    return synthesize_speech(text, output_audio_path)
 
 
@@ -0,0 +1,179 @@
+"""流水线式实时对话：ASR → 流式 LLM → 分句 TTS（→ 视频渲染）。
+
+LLM 的回复以 token 流的形式被消费，每凑满一句就交给 TTS，
+后面的句子仍在生成时前面的句子已经可以播放，首段音频的等待时间只取决于第一句话。
+各阶段都是普通可调用对象，测试时可替换为本地替身。
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+
+from backend.chat_engine import audio_to_text, stream_ai_response, synthesize_speech
+
+
+# 句末标点：遇到这些字符就切出一句交给 TTS
+SENTENCE_ENDINGS = "。！？!?；;\n"
+# 过短的片段与下一句合并，避免 TTS 为一两个字单独发请求
+MIN_SENTENCE_CHARS = 4
+DEFAULT_MODEL = "glm-4-plus"
+
+_STOP = object()
+
+
+def split_sentences(tokens, min_chars=MIN_SENTENCE_CHARS):
+    """Group a token stream into sentences as soon as each one is complete."""
+    buffer = ""
+    for token in tokens:
+        buffer += token
+        start = 0
+        for i, ch in enumerate(buffer):
+            if ch in SENTENCE_ENDINGS and len(buffer[start:i + 1].strip()) >= min_chars:
+                yield buffer[start:i + 1].strip()
+                start = i + 1
+        buffer = buffer[start:]
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def default_asr(audio_path):
+    return audio_to_text(audio_path, None)
+
+
+def default_llm(text, conversation_id=None):
+    return stream_ai_response(
+        text, os.getenv("ZHIPU_API_KEY"), os.getenv("ZHIPU_MODEL", DEFAULT_MODEL), conversation_id
+    )
+
+
+def default_tts(text, output_path):
+    return synthesize_speech(text, output_path)
+
+
+class ChatPipeline:
+    """Run one chat turn with overlapping LLM and TTS stages.
+
+    ``asr(audio_path) -> text``、``llm(text) -> iterable[str]``、
+    ``tts(text, output_path) -> path`` 以及可选的 ``renderer(audio_path, index) -> video_path``
+    均可替换。渲染在单独的线程中进行，不阻塞后续句子的 TTS；提供
+    ``stitch(video_paths, output_path) -> path`` 时，回复结束后把各句片段拼成完整视频。
+    """
+
+    def __init__(self, asr=None, llm=None, tts=None, renderer=None, output_root=None, conversation_id=None,
+                 stitch=None):
+        self.asr = asr or default_asr
+        self.llm = llm or (lambda text: default_llm(text, conversation_id))
+        self.tts = tts or default_tts
+        self.renderer = renderer
+        self.stitch = stitch
+        self.output_root = output_root or os.path.join("static", "audios", "chat_stream")
+
+    def run(self, audio_path=None, text=None, turn_id=None):
+        """逐个产出事件字典：transcript / sentence / audio / video / reply_video / error / done。"""
+        turn_id = turn_id or uuid.uuid4().hex[:12]
+        turn_dir = os.path.join(self.output_root, turn_id)
+        os.makedirs(turn_dir, exist_ok=True)
+        started = time.time()
+        timings = {}
+
+        if text is None:
+            text = self.asr(audio_path) if audio_path else None
+            timings["asr"] = round(time.time() - started, 3)
+        yield {"type": "transcript", "turn_id": turn_id, "text": text or ""}
+
+        events = queue.Queue()
+        sentences = queue.Queue()
+        clips = queue.Queue()
+        # 客户端断开（生成器被关闭）后通知各阶段尽快停止，不再继续调用 LLM / TTS / 渲染
+        stop = threading.Event()
+
+        def _produce():
+            try:
+                for index, sentence in enumerate(split_sentences(self.llm(text or ""))):
+                    if stop.is_set():
+                        break
+                    if index == 0:
+                        timings["first_sentence"] = round(time.time() - started, 3)
+                    events.put({"type": "sentence", "index": index, "text": sentence})
+                    sentences.put((index, sentence))
+            except Exception as exc:
+                events.put({"type": "error", "stage": "llm", "message": str(exc)})
+            finally:
+                sentences.put(_STOP)
+
+        def _synthesize():
+            try:
+                while True:
+                    item = sentences.get()
+                    if item is _STOP or stop.is_set():
+                        break
+                    index, sentence = item
+                    output_path = os.path.join(turn_dir, f"sentence_{index:03d}.mp3")
+                    audio = self.tts(sentence, output_path)
+                    if not audio:
+                        events.put({"type": "error", "stage": "tts", "index": index, "message": "TTS 失败"})
+                        continue
+                    if "first_audio" not in timings:
+                        timings["first_audio"] = round(time.time() - started, 3)
+                    events.put({"type": "audio", "index": index, "path": audio})
+                    if self.renderer is not None:
+                        clips.put((index, audio))
+            except Exception as exc:
+                events.put({"type": "error", "stage": "tts", "message": str(exc)})
+            finally:
+                if self.renderer is not None:
+                    clips.put(_STOP)
+                else:
+                    events.put(_STOP)
+
+        def _render():
+            try:
+                while True:
+                    item = clips.get()
+                    if item is _STOP or stop.is_set():
+                        break
+                    index, audio = item
+                    try:
+                        video = self.renderer(audio, index)
+                    except Exception as exc:
+                        events.put({"type": "error", "stage": "render", "index": index, "message": str(exc)})
+                        continue
+                    if video:
+                        if "first_video" not in timings:
+                            timings["first_video"] = round(time.time() - started, 3)
+                        events.put({"type": "video", "index": index, "path": video})
+            finally:
+                events.put(_STOP)
+
+        producer = threading.Thread(target=_produce, name=f"chat-llm-{turn_id}", daemon=True)
+        consumer = threading.Thread(target=_synthesize, name=f"chat-tts-{turn_id}", daemon=True)
+        producer.start()
+        consumer.start()
+        if self.renderer is not None:
+            threading.Thread(target=_render, name=f"chat-render-{turn_id}", daemon=True).start()
+
+        reply = []
+        videos = []
+        try:
+            while True:
+                event = events.get()
+                if event is _STOP:
+                    break
+                if event["type"] == "sentence":
+                    reply.append(event["text"])
+                elif event["type"] == "video":
+                    videos.append(event["path"])
+                yield event
+        finally:
+            stop.set()
+
+        if self.stitch is not None and videos:
+            try:
+                path = self.stitch(videos, os.path.join(turn_dir, "reply.mp4"))
+                yield {"type": "reply_video", "turn_id": turn_id, "path": path}
+            except Exception as exc:
+                yield {"type": "error", "stage": "stitch", "message": str(exc)}
+
+        timings["total"] = round(time.time() - started, 3)
+        yield {"type": "done", "turn_id": turn_id, "text": "".join(reply), "timings": timings}
@@ -0,0 +1,150 @@
+"""对话回复的数字人视频：把 TTS 输出交给 SyncTalk 渲染，渲染期间播放预先生成的待机循环。
+
+* 待机/聆听循环：用一段静音驱动所选模型渲染 ``CHAT_IDLE_SECONDS`` 秒视频（嘴部闭合），
+  按模型 checkpoint 指纹缓存在 ``static/videos/idle``，模型重新训练后自动失效重建；
+* ``ChatRenderer`` 是 ``ChatPipeline`` 的 renderer：每句 TTS 音频单独渲染成短片段，
+  第一句话的视频不必等整段回复合成完；
+* ``stitch_clips`` 用 ffmpeg concat 把各句片段拼成完整的回复视频。
+"""
+import os
+import subprocess
+import threading
+
+from backend.audio_ingest import PcmAudio, TARGET_RATE, SAMPLE_WIDTH, ensure_wav
+from backend.device_scheduler import AUTO
+from backend.file_publish import publish_file
+from backend.result_cache import checkpoint_fingerprint, file_sha256
+from backend.video_generator import _validate_inputs, render_video
+
+
+IDLE_ROOT = os.path.join("static", "videos", "idle")
+IDLE_SECONDS = float(os.getenv("CHAT_IDLE_SECONDS", 4))
+SILENCE_DIR = os.path.join("static", "audios", "idle")
+STITCH_TIMEOUT = 120
+
+
+def silence_wav(seconds=IDLE_SECONDS):
+    """返回一段静音 WAV（16 kHz 单声道），同一时长只生成一次。"""
+    path = os.path.join(SILENCE_DIR, f"silence_{seconds:g}s.wav")
+    if not os.path.isfile(path):
+        os.makedirs(SILENCE_DIR, exist_ok=True)
+        PcmAudio(b"\0" * int(seconds * TARGET_RATE) * SAMPLE_WIDTH).save_wav(path)
+    return path
+
+
+def resolve_chat_model(data):
+    """按 model_name / model_param 解析模型目录与设备；不是可渲染的 SyncTalk 模型时抛出 ValueError。"""
+    if data.get('model_name') != "SyncTalk":
+        raise ValueError(f"不支持的对话模型: {data.get('model_name')}")
+    model_param, _, gpu_choice = _validate_inputs(dict(data, ref_audio=silence_wav()))
+    return model_param, gpu_choice
+
+
+class IdleLoopCache:
+    """Per-model idle/listening loop, rendered once in the background."""
+
+    def __init__(self, root=IDLE_ROOT, seconds=IDLE_SECONDS):
+        self.root = root
+        self.seconds = seconds
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def path_for(self, model_param):
+        fingerprint = checkpoint_fingerprint(model_param)[:16]
+        model_name = os.path.basename(os.path.normpath(model_param))
+        return os.path.join(self.root, f"{model_name}_{fingerprint}.mp4")
+
+    def get(self, model_param, gpu_choice=AUTO, wait=False):
+        """返回已缓存的待机循环；还没有时在后台开始渲染并返回 None（wait=True 时等待渲染完成）。"""
+        path = self.path_for(model_param)
+        if os.path.isfile(path):
+            return path
+        with self._lock:
+            if path in self._pending:
+                return None
+            self._pending.add(path)
+        if wait:
+            return self._render(model_param, gpu_choice, path)
+        threading.Thread(
+            target=self._render,
+            args=(model_param, gpu_choice, path),
+            name="chat-idle-loop",
+            daemon=True,
+        ).start()
+        return None
+
+    def _render(self, model_param, gpu_choice, path):
+        try:
+            print(f"[backend.chat_renderer] 渲染待机循环: {model_param}")
+            rendered = render_video(model_param, silence_wav(self.seconds), gpu_choice)
+            # 结果缓存中的文件不会被原地覆盖，可以硬链接
+            publish_file(rendered, path, ("link", "reflink", "copy"))
+            print(f"[backend.chat_renderer] 待机循环就绪: {path}")
+            return path
+        except Exception as exc:
+            print(f"[backend.chat_renderer] 待机循环渲染失败: {exc}")
+            return None
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+
+
+class ChatRenderer:
+    """Render each synthesized sentence into a short talking-head clip.
+
+    作为 ``ChatPipeline(renderer=...)`` 使用：``renderer(audio_path, index) -> video_path``。
+    """
+
+    def __init__(self, model_param, gpu_choice=AUTO):
+        self.model_param = model_param
+        self.gpu_choice = gpu_choice
+
+    @classmethod
+    def from_request_data(cls, data):
+        return cls(*resolve_chat_model(data))
+
+    def idle_loop(self):
+        return idle_loops.get(self.model_param, self.gpu_choice)
+
+    def __call__(self, audio_path, index):
+        # TTS 输出可能是 mp3，SyncTalk 需要 16 kHz WAV
+        wav_path = ensure_wav(audio_path)
+        return render_video(self.model_param, _unique_audio_name(wav_path), self.gpu_choice)
+
+
+def _unique_audio_name(wav_path):
+    """SyncTalk 按音频文件名命名输出（<model>_<audio>.mp4），各会话的句子都叫 sentence_000 / output，
+    并发时会互相覆盖；改用内容哈希命名的副本，放在同一目录下随会话一起清理。
+    output.wav 每轮会被原地重写，不能用硬链接。"""
+    path = os.path.join(os.path.dirname(wav_path), f"{file_sha256(wav_path)}.wav")
+    if not os.path.isfile(path):
+        publish_file(wav_path, path, ("reflink", "copy"))
+    return path
+
+
+def stitch_clips(clips, output_path):
+    """把若干片段按顺序拼接成一个视频；只有一个片段时直接发布该片段。"""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    if len(clips) == 1:
+        publish_file(clips[0], output_path, ("link", "reflink", "copy"))
+        return output_path
+
+    list_path = output_path + ".txt"
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for clip in clips:
+            escaped = os.path.abspath(clip).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    base = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+    try:
+        # 同一模型渲染的片段编码参数一致，通常可以直接拷贝码流；不行再重新编码
+        for codec_args in (['-c', 'copy'], ['-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'aac']):
+            result = subprocess.run(base + codec_args + [output_path], capture_output=True, timeout=STITCH_TIMEOUT)
+            if result.returncode == 0:
+                return output_path
+        raise RuntimeError(f"视频拼接失败: {result.stderr.decode('utf-8', 'ignore').strip()[-300:]}")
+    finally:
+        if os.path.exists(list_path):
+            os.remove(list_path)
+
+
+idle_loops = IdleLoopCache()
@@ -0,0 +1,114 @@
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+from backend.shared_state import shared_store
+
+
+SESSION_ROOT = os.path.join("static", "sessions")
+SESSION_COOKIE = "chat_session"
+# 会话闲置超过该时间（秒）后，其工作目录会被清理
+SESSION_TTL = 30 * 60
+CLEANUP_INTERVAL = 60
+
+STATE_NAMESPACE = "chat_sessions"
+
+_SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class ChatSession:
+    """A chat conversation's private working directory.
+
+    每个会话拥有独立的 input.wav / input.txt / output.txt / output.wav，
+    同一会话内的轮次通过 lock 串行，不同会话之间互不影响。
+    """
+
+    def __init__(self, session_id, root):
+        self.id = session_id
+        self.dir = os.path.join(root, session_id)
+        self.lock = threading.Lock()
+        self.last_access = time.time()
+        os.makedirs(self.dir, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def touch(self):
+        self.last_access = time.time()
+
+
+class SessionManager:
+    def __init__(self, root=SESSION_ROOT, ttl=SESSION_TTL, state_store=None):
+        self.root = root
+        self.ttl = ttl
+        # 多 worker 部署时同一会话的请求可能落到不同 worker，最近访问时间记在共享存储里，
+        # 任何一个 worker 清理目录前都会先确认会话在其他 worker 上也已过期
+        self.state_store = state_store or shared_store
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+
+    def get(self, session_id=None):
+        """返回已有会话；id 缺失或非法时创建新会话。"""
+        self._maybe_cleanup()
+        if not session_id or not _SESSION_ID_RE.match(session_id):
+            session_id = uuid.uuid4().hex
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = ChatSession(session_id, self.root)
+                self._sessions[session_id] = session
+        session.touch()
+        if self.state_store.shared:
+            self.state_store.set(STATE_NAMESPACE, session_id, {"last_access": session.last_access}, ttl=self.ttl)
+        return session
+
+    def from_request(self, req):
+        session_id = (
+            req.form.get('session_id')
+            or req.headers.get('X-Chat-Session')
+            or req.cookies.get(SESSION_COOKIE)
+        )
+        return self.get(session_id)
+
+    def cleanup(self, now=None):
+        """删除过期会话的内存记录和工作目录（包括进程重启前遗留的目录）。"""
+        now = now or time.time()
+        with self._lock:
+            expired = [
+                sid for sid, s in self._sessions.items()
+                if now - s.last_access > self.ttl and not s.lock.locked()
+            ]
+            for sid in expired:
+                del self._sessions[sid]
+            active = set(self._sessions)
+
+        removed = 0
+        if os.path.isdir(self.root):
+            for entry in os.scandir(self.root):
+                if not entry.is_dir() or entry.name in active:
+                    continue
+                if self.state_store.shared and self.state_store.get(STATE_NAMESPACE, entry.name) is not None:
+                    continue
+                if now - entry.stat().st_mtime > self.ttl or entry.name in expired:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+        if removed:
+            print(f"[backend.chat_session] 清理过期会话目录: {removed} 个")
+        return removed
+
+    def _maybe_cleanup(self):
+        now = time.time()
+        if now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        try:
+            self.cleanup(now)
+        except OSError as exc:
+            print(f"[backend.chat_session] 清理会话失败: {exc}")
+
+
+sessions = SessionManager()
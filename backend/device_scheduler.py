@@ -0,0 +1,168 @@
+"""设备调度：记录每个设备上进行中的训练/推理任务，把 ``auto`` 请求放到负载最低的设备。
+
+设备清单由 ``DEVICE_INVENTORY`` 配置，例如 ``GPU0=1,GPU1=1,CPU=1``（值为设备容量，
+即同时运行的任务数），测试时可以配置任意虚拟设备。负载按 (进行中任务数 / 容量) 计算，
+所有 GPU 都满载时推理任务溢出到 ``CPU``；CPU 也满时（以及训练任务）仍选负载最低的 GPU 排队。
+
+共享后端下每个 worker 把自己的进行中任务数发布到共享存储（按 worker 一条记录，定期续期），
+``auto`` 放置时把其他 worker 的负载一起算上；worker 退出后它的记录随 TTL 过期。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from backend.shared_state import shared_store, worker_id, HEARTBEAT_INTERVAL
+
+
+DEFAULT_INVENTORY = {"GPU0": 1, "GPU1": 1, "CPU": 1}
+OVERFLOW_DEVICE = "CPU"
+# 前端的“自动选择 / 多 GPU”统一交给调度器决定
+AUTO_CHOICES = ("", "AUTO", "MULTI")
+AUTO = "auto"
+
+KIND_INFER = "infer"
+KIND_TRAIN = "train"
+
+LOAD_NAMESPACE = "device_load"
+# 负载记录的 TTL（秒）：心跳间隔的 3 倍，worker 异常退出后它的负载最多滞留这么久
+LOAD_TTL = HEARTBEAT_INTERVAL * 3
+
+
+def _parse_inventory(raw):
+    if not raw:
+        return dict(DEFAULT_INVENTORY)
+    inventory = {}
+    for item in raw.split(","):
+        if not item.strip():
+            continue
+        device, _, capacity = item.partition("=")
+        try:
+            inventory[device.strip().upper()] = max(1, int(capacity or 1))
+        except ValueError:
+            print(f"[backend.device_scheduler] 忽略无效的设备配置: {item}")
+    return inventory or dict(DEFAULT_INVENTORY)
+
+
+class DeviceScheduler:
+    def __init__(self, inventory=None, overflow=OVERFLOW_DEVICE, store=None):
+        self.inventory = inventory or _parse_inventory(os.getenv("DEVICE_INVENTORY"))
+        self.overflow = overflow if overflow in self.inventory else None
+        self.store = store or shared_store
+        self._inflight = {device: {KIND_INFER: 0, KIND_TRAIN: 0} for device in self.inventory}
+        self._lock = threading.Lock()
+        if self.store.shared:
+            threading.Thread(target=self._heartbeat_loop, name="device-load", daemon=True).start()
+
+    def _publish_locked(self):
+        if not self.store.shared:
+            return
+        try:
+            self.store.set(LOAD_NAMESPACE, worker_id(), self._inflight, ttl=LOAD_TTL)
+        except Exception as exc:
+            # 共享存储暂时不可用时退化为只看本进程的负载
+            print(f"[backend.device_scheduler] 发布设备负载失败: {exc}")
+
+    def _heartbeat_loop(self):
+        while True:
+            with self._lock:
+                self._publish_locked()
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def _totals_locked(self):
+        """所有 worker 的进行中任务数：本进程以内存为准，其他 worker 取共享记录。"""
+        totals = {device: dict(counts) for device, counts in self._inflight.items()}
+        if not self.store.shared:
+            return totals
+        me = worker_id()
+        try:
+            records = self.store.items(LOAD_NAMESPACE)
+        except Exception as exc:
+            print(f"[backend.device_scheduler] 读取设备负载失败: {exc}")
+            return totals
+        for owner, counts in records:
+            if owner == me:
+                continue
+            for device, kinds in counts.items():
+                if device not in totals:
+                    continue
+                for kind, count in kinds.items():
+                    if kind in totals[device]:
+                        totals[device][kind] += count
+        return totals
+
+    def normalize(self, choice):
+        """把前端的 gpu_choice 规范为清单中的设备名，或 ``auto``；不认识的设备名抛出 ValueError。"""
+        value = str(choice or "").strip().upper()
+        if value in AUTO_CHOICES:
+            return AUTO
+        if value not in self.inventory:
+            raise ValueError(f"未知的设备: {choice}（可选: auto, {', '.join(self.inventory)}）")
+        return value
+
+    def _load(self, totals, device):
+        return sum(totals[device].values()) / float(self.inventory[device])
+
+    def _place_locked(self, choice, kind):
+        device = self.normalize(choice)
+        if device != AUTO:
+            return device
+        gpus = [d for d in self.inventory if d != self.overflow]
+        if not gpus:
+            return self.overflow
+        totals = self._totals_locked()
+        # 同负载时按清单顺序，保证结果可预测
+        best = min(gpus, key=lambda d: (self._load(totals, d), gpus.index(d)))
+        # 只有推理溢出到 CPU；训练在 CPU 上慢到不可用，宁可在 GPU 上排队
+        if (kind == KIND_INFER and self._load(totals, best) >= 1.0
+                and self.overflow and self._load(totals, self.overflow) < 1.0):
+            return self.overflow
+        return best
+
+    def place(self, choice, kind=KIND_INFER):
+        """只计算放置结果，不占用设备。"""
+        with self._lock:
+            return self._place_locked(choice, kind)
+
+    def assign(self, choice, kind=KIND_INFER):
+        """选择设备并计入一个进行中的任务；任务结束后必须调用 release。"""
+        with self._lock:
+            device = self._place_locked(choice, kind)
+            self._inflight[device][kind] += 1
+            self._publish_locked()
+        if self.normalize(choice) == AUTO:
+            print(f"[backend.device_scheduler] {kind} 任务分配到 {device}")
+        return device
+
+    def release(self, device, kind=KIND_INFER):
+        with self._lock:
+            counts = self._inflight.get(device)
+            if counts and counts[kind] > 0:
+                counts[kind] -= 1
+                self._publish_locked()
+
+    @contextmanager
+    def reserve(self, choice, kind=KIND_INFER):
+        """在 with 块内占用一个设备，返回设备名。"""
+        device = self.assign(choice, kind)
+        try:
+            yield device
+        finally:
+            self.release(device, kind)
+
+    def stats(self):
+        """所有 worker 合计的负载；共享后端下包含其他 worker 的任务。"""
+        with self._lock:
+            totals = self._totals_locked()
+        return {
+            device: {
+                "capacity": self.inventory[device],
+                "infer": counts[KIND_INFER],
+                "train": counts[KIND_TRAIN],
+                "load": round(self._load(totals, device), 3),
+            }
+            for device, counts in totals.items()
+        }
+
+
+device_scheduler = DeviceScheduler()
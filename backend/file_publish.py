@@ -0,0 +1,82 @@
+"""把生成结果发布到 static 目录，尽量不复制数据。
+
+按顺序尝试以下策略，前一种不可用（跨文件系统、文件系统不支持等）时退到下一种：
+
+* ``rename``：原子重命名，零拷贝，源文件随之移走；只用于应用自己生成的临时文件；
+* ``reflink``：写时复制克隆（btrfs/xfs 等），零拷贝且与源文件互不影响；
+* ``link``：硬链接，零拷贝，但与源文件共享 inode，源文件被原地覆盖时发布的文件也会变；
+* ``copy``：普通复制。
+
+除 rename 外都先写到临时文件再 ``os.replace``，读取方不会看到写了一半的视频。
+"""
+import os
+import shutil
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，reflink 不可用
+    fcntl = None
+
+
+# SyncTalk 的输出不归应用所有：移走会清空模型索引的结果列表，也会拿走后续请求兜底用的
+# test_audio.mp4；它又会原地覆盖 results 下的同名输出，硬链接会让已发布的视频跟着变。
+# 所以默认只用 reflink，不支持时复制
+DEFAULT_VIDEO_STRATEGIES = ("reflink", "copy")
+# linux/fs.h: FICLONE = _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+
+def video_strategies():
+    raw = os.getenv("VIDEO_PUBLISH_STRATEGIES")
+    if not raw:
+        return DEFAULT_VIDEO_STRATEGIES
+    return tuple(s.strip() for s in raw.split(",") if s.strip())
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError("reflink 不可用")
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def publish_file(src, dst, strategies=None):
+    """把 src 发布为 dst，返回实际使用的策略名；所有策略都失败时抛出最后一个异常。"""
+    strategies = strategies or video_strategies()
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    if os.path.abspath(src) == os.path.abspath(dst):
+        return "noop"
+
+    last_error = None
+    for strategy in strategies:
+        if strategy == "rename":
+            try:
+                os.replace(src, dst)
+                return strategy
+            except OSError as exc:
+                last_error = exc
+                continue
+
+        tmp_dst = f"{dst}.{time.time_ns()}.tmp"
+        try:
+            if strategy == "reflink":
+                _reflink(src, tmp_dst)
+            elif strategy == "link":
+                os.link(src, tmp_dst)
+            elif strategy == "copy":
+                shutil.copyfile(src, tmp_dst)
+            else:
+                raise ValueError(f"未知的发布策略: {strategy}")
+            os.replace(tmp_dst, dst)
+            return strategy
+        except OSError as exc:
+            last_error = exc
+            if os.path.exists(tmp_dst):
+                os.remove(tmp_dst)
+    raise last_error or OSError(f"无法发布文件: {src}")
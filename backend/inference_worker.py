@@ -0,0 +1,316 @@
+"""常驻 SyncTalk 推理进程及其进程池。
+
+协议：父进程与 worker 通过 stdin/stdout 交换逐行 JSON。
+
+* worker 启动并加载模型后输出 ``{"event": "ready"}``；
+* 请求 ``{"id": ..., "cmd": "infer", "audio_path": ..., "output_path": ..., "audio_features": ...}``，
+  ``audio_features`` 为缓存的特征 .npy（可为 null），有值时 worker 跳过特征提取；
+* worker 返回若干 ``{"id": ..., "event": "log", "line": ...}``，最后以
+  ``{"id": ..., "event": "done", "output_path": ...}`` 或
+  ``{"id": ..., "event": "error", "message": ...}`` 结束；
+* ``{"cmd": "shutdown"}`` 让 worker 退出。
+
+stdout 中不是 JSON 的行（第三方库的打印）按日志处理。
+"""
+import argparse
+import json
+import os
+import queue
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from backend.audio_features import audio_features, load_features
+
+
+# worker 启动命令模板，{model_dir} / {gpu} 会被替换
+DEFAULT_WORKER_CMD = "./SyncTalk/run_synctalk.sh serve --model_dir {model_dir} --gpu {gpu}"
+# 每个设备最多常驻的模型数量
+DEFAULT_MODELS_PER_DEVICE = 1
+READY_TIMEOUT = 300
+
+
+def warm_worker_enabled():
+    return os.getenv("SYNCTALK_WARM_WORKER") == "1"
+
+
+class WorkerError(RuntimeError):
+    """Raised when a warm worker fails to start or reports an error."""
+
+
+class WorkerProcess:
+    """One long-lived worker holding a single model directory on one device."""
+
+    def __init__(self, model_dir, device, cmd_template=None):
+        self.model_dir = model_dir
+        self.device = device
+        template = cmd_template or os.getenv("SYNCTALK_WORKER_CMD", DEFAULT_WORKER_CMD)
+        self.cmd = [part.format(model_dir=model_dir, gpu=device) for part in shlex.split(template)]
+        self.process = None
+        self.served = 0
+        self.last_used = time.time()
+        # 正在使用该 worker 的请求数，由 WorkerPool 维护；大于 0 时不会被淘汰
+        self.leases = 0
+        self._lock = threading.Lock()
+
+    def start(self, timeout=READY_TIMEOUT):
+        print(f"[backend.inference_worker] 启动常驻推理进程: {' '.join(self.cmd)}")
+        self.process = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        # 加载模型时 worker 可能长时间不输出（甚至卡死），在单独的线程里读，这里按截止时间等待
+        messages = queue.Queue()
+
+        def _read_until_ready():
+            for message in self._messages():
+                messages.put(message)
+                if message.get("event") in ("ready", "error"):
+                    return
+            messages.put(None)
+
+        threading.Thread(target=_read_until_ready, name="worker-ready", daemon=True).start()
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                message = messages.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if message is None:
+                break
+            if message.get("event") == "ready":
+                return
+            if message.get("event") == "error":
+                self.kill()
+                raise WorkerError(message.get("message") or "worker 启动失败")
+        self.kill()
+        raise WorkerError(f"常驻推理进程未就绪: {self.model_dir}")
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stream_infer(self, audio_path, output_path):
+        """发送一次推理请求，逐行产出日志；出错时抛出 WorkerError。"""
+        # 在占用 worker 之前准备好特征，提取期间 worker 仍可服务其他请求
+        features_path = audio_features.ensure(audio_path, self.device)
+        with self._lock:
+            if not self.alive():
+                raise WorkerError("常驻推理进程已退出")
+            request_id = uuid.uuid4().hex
+            self._send({
+                "id": request_id,
+                "cmd": "infer",
+                "audio_path": audio_path,
+                "output_path": output_path,
+                "audio_features": features_path,
+            })
+            for message in self._messages():
+                if message.get("id") not in (None, request_id):
+                    continue
+                event = message.get("event")
+                if event == "log":
+                    yield message.get("line", "")
+                elif event == "done":
+                    self.served += 1
+                    self.last_used = time.time()
+                    return
+                elif event == "error":
+                    raise WorkerError(message.get("message") or "推理失败")
+            raise WorkerError(f"常驻推理进程异常退出，退出码: {self.process.poll()}")
+
+    def infer(self, audio_path, output_path):
+        for line in self.stream_infer(audio_path, output_path):
+            print(f"[backend.inference_worker] {line}")
+        return output_path
+
+    def shutdown(self, timeout=10):
+        # 等待正在进行的请求结束后再退出
+        with self._lock:
+            if not self.alive():
+                return
+            try:
+                self._send({"cmd": "shutdown"})
+                self.process.wait(timeout=timeout)
+            except Exception:
+                self.kill()
+
+    def kill(self):
+        if self.alive():
+            self.process.kill()
+            self.process.wait()
+
+    def _send(self, payload):
+        self.process.stdin.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        self.process.stdin.flush()
+
+    def _messages(self):
+        for raw in self.process.stdout:
+            line = raw.rstrip("\n")
+            if line.startswith("{"):
+                try:
+                    yield json.loads(line)
+                    continue
+                except ValueError:
+                    pass
+            yield {"event": "log", "line": line}
+
+
+class WorkerPool:
+    """Per-device LRU of warm workers keyed by model directory."""
+
+    def __init__(self, models_per_device=None, cmd_template=None):
+        self.models_per_device = models_per_device or int(
+            os.getenv("SYNCTALK_WORKER_MODELS_PER_DEVICE", DEFAULT_MODELS_PER_DEVICE)
+        )
+        self.cmd_template = cmd_template
+        self._lock = threading.Lock()
+        # 租用计数的变化（release）通过它通知等待空位的 acquire
+        self._cond = threading.Condition(self._lock)
+        self._device_locks = {}
+        self._devices = {}
+
+    def acquire(self, model_dir, device):
+        """返回已加载该模型的 worker 并占用它，用完后必须调用 release。
+
+        需要时启动新进程并淘汰最久未用的模型；正在使用的 worker 不会被淘汰，
+        设备上的模型都在使用中时等待其中一个释放。
+        """
+        key = os.path.abspath(model_dir)
+        with self._lock:
+            device_lock = self._device_locks.setdefault(device, threading.Lock())
+            workers = self._devices.setdefault(device, OrderedDict())
+        # 加载模型可能很慢，只锁定当前设备，其他设备不受影响
+        with device_lock:
+            evicted = []
+            with self._cond:
+                while True:
+                    worker = workers.get(key)
+                    if worker is not None and not worker.alive():
+                        del workers[key]
+                        worker = None
+                    if worker is not None:
+                        workers.move_to_end(key)
+                        worker.leases += 1
+                        return worker
+                    for other_key, other in list(workers.items()):
+                        if len(workers) < self.models_per_device:
+                            break
+                        if other.leases == 0:
+                            del workers[other_key]
+                            evicted.append(other)
+                    if len(workers) < self.models_per_device:
+                        break
+                    self._cond.wait()
+
+            for worker in evicted:
+                print(f"[backend.inference_worker] 卸载模型: {worker.model_dir} ({device})")
+                worker.shutdown()
+
+            worker = WorkerProcess(model_dir, device, self.cmd_template)
+            worker.start()
+            with self._cond:
+                worker.leases = 1
+                workers[key] = worker
+            return worker
+
+    def release(self, worker):
+        with self._cond:
+            worker.leases -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def lease(self, model_dir, device):
+        worker = self.acquire(model_dir, device)
+        try:
+            yield worker
+        finally:
+            self.release(worker)
+
+    def stream_infer(self, model_dir, device, audio_path, output_path):
+        with self.lease(model_dir, device) as worker:
+            yield from worker.stream_infer(audio_path, output_path)
+
+    def infer(self, model_dir, device, audio_path, output_path):
+        with self.lease(model_dir, device) as worker:
+            return worker.infer(audio_path, output_path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                device: [
+                    {
+                        "model_dir": w.model_dir, "served": w.served, "leases": w.leases,
+                        "alive": w.alive(), "last_used": w.last_used,
+                    }
+                    for w in workers.values()
+                ]
+                for device, workers in self._devices.items()
+            }
+
+    def shutdown(self):
+        with self._lock:
+            for workers in self._devices.values():
+                for worker in workers.values():
+                    worker.shutdown()
+            self._devices.clear()
+
+
+worker_pool = WorkerPool()
+
+
+def _stub_main(args):
+    """CPU 上的替身 worker：按协议应答，并写出占位视频文件，用于测试协议与进程池。"""
+    def emit(payload):
+        sys.stdout.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    time.sleep(args.load_delay)
+    emit({"event": "ready", "model_dir": args.model_dir, "gpu": args.gpu})
+
+    for raw in sys.stdin:
+        try:
+            request = json.loads(raw)
+        except ValueError:
+            continue
+        if request.get("cmd") == "shutdown":
+            break
+        request_id = request.get("id")
+        audio_path = request.get("audio_path")
+        output_path = request.get("output_path")
+        if not audio_path or not os.path.isfile(audio_path):
+            emit({"id": request_id, "event": "error", "message": f"音频文件不存在: {audio_path}"})
+            continue
+        features_path = request.get("audio_features")
+        if features_path:
+            features = load_features(features_path)
+            emit({"id": request_id, "event": "log", "line": f"[stub] cached features {tuple(features.shape)}"})
+        for step in range(1, args.steps + 1):
+            time.sleep(args.infer_delay / args.steps)
+            emit({"id": request_id, "event": "log", "line": f"[stub] {step}/{args.steps}"})
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(output_path, 'wb') as f:
+            f.write(b"stub video for " + os.path.basename(audio_path).encode("utf-8"))
+        emit({"id": request_id, "event": "done", "output_path": output_path})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="SyncTalk warm worker (stub)")
+    parser.add_argument("--stub", action="store_true", help="run the CPU stub worker")
+    parser.add_argument("--model_dir", default="")
+    parser.add_argument("--gpu", default="CPU")
+    parser.add_argument("--load_delay", type=float, default=0.0)
+    parser.add_argument("--infer_delay", type=float, default=0.0)
+    parser.add_argument("--steps", type=int, default=3)
+    cli_args = parser.parse_args()
+    if not cli_args.stub:
+        parser.error("only --stub mode is implemented here; the real worker lives in SyncTalk")
+    _stub_main(cli_args)
@@ -0,0 +1,305 @@
+import os
+import queue
+import subprocess
+import threading
+import time
+import uuid
+
+from backend.result_cache import result_cache
+from backend.inference_worker import worker_pool, warm_worker_enabled, WorkerError
+from backend.video_generator import _validate_inputs, _build_cmd, _publish_output, _worker_output_path
+from backend.tracing import span
+from backend.device_scheduler import device_scheduler
+from backend.shared_state import JobRecords, device_slot
+
+
+# 每个设备允许同时运行的推理任务数，可通过环境变量覆盖，例如 "GPU0=1,GPU1=1,CPU=2"
+DEFAULT_DEVICE_LIMITS = {"GPU0": 1, "GPU1": 1, "CPU": 1}
+# 每个设备排队任务上限，超过后提交直接失败而不是无限堆积
+MAX_PENDING_PER_DEVICE = 32
+# 已结束任务在内存中的保留时间（秒）
+FINISHED_JOB_TTL = 3600
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when a device queue has no room for another job."""
+
+
+def _parse_device_limits(raw, defaults=DEFAULT_DEVICE_LIMITS):
+    """解析 "GPU0=2,CPU=0" 形式的按设备并发配置，未出现的设备使用 defaults。"""
+    limits = dict(defaults)
+    if not raw:
+        return limits
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        device, count = item.split("=", 1)
+        try:
+            limits[device.strip().upper()] = max(0, int(count))
+        except ValueError:
+            print(f"[backend.job_queue] 忽略无效的设备并发配置: {item}")
+    return limits
+
+
+class VideoJob:
+    def __init__(self, data, model_param, ref_audio, device, cache_key=None, cancel_on_disconnect=False):
+        self.id = uuid.uuid4().hex
+        self.data = data
+        self.model_param = model_param
+        self.ref_audio = ref_audio
+        self.device = device
+        self.cache_key = cache_key
+        self.cached = False
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.video_path = None
+        self.error = None
+        self.return_code = None
+        self.logs = []
+        self.process = None
+        self.cancel_requested = False
+        # 只有 SSE 请求本身提交的任务在客户端全部断开后取消，异步提交的任务在后台跑完
+        self.cancel_on_disconnect = cancel_on_disconnect
+        self.device_released = False
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "device": self.device,
+            "model_param": self.model_param,
+            "ref_audio": self.ref_audio,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "return_code": self.return_code,
+            "video_path": self.video_path,
+            "error": self.error,
+            "cached": self.cached,
+            "cancel_on_disconnect": self.cancel_on_disconnect,
+            "log_lines": len(self.logs),
+        }
+
+
+class JobQueue:
+    """Bounded per-device worker pool for SyncTalk inference jobs.
+
+    每个设备（GPU0/GPU1/CPU）拥有独立的队列和固定数量的工作线程，
+    因此吞吐随设备数量增长，而与占用的 HTTP 线程数无关。
+    """
+
+    def __init__(self, device_limits=None, max_pending=MAX_PENDING_PER_DEVICE):
+        self.device_limits = device_limits or _parse_device_limits(os.getenv("VIDEO_JOB_LIMITS"))
+        self.max_pending = max_pending
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._queues = {}
+        # 多 worker 部署时，其他 worker 通过共享记录查询本进程的任务、转发取消请求
+        self.records = JobRecords("video_jobs", FINISHED_JOB_TTL)
+        self.records.watch(self._active_jobs, self.cancel)
+        for device, limit in self.device_limits.items():
+            if limit <= 0:
+                continue
+            self._queues[device] = queue.Queue(maxsize=max_pending)
+            for i in range(limit):
+                worker = threading.Thread(
+                    target=self._worker_loop,
+                    args=(device,),
+                    name=f"video-job-{device}-{i}",
+                    daemon=True,
+                )
+                worker.start()
+
+    def submit(self, data, cancel_on_disconnect=False):
+        """校验输入并入队，立即返回任务对象。"""
+        model_param, ref_audio, gpu_choice = _validate_inputs(data)
+        cache_key = result_cache.key_for(model_param, ref_audio)
+
+        # 命中结果缓存时不占用设备，直接完成
+        cached_path = result_cache.lookup(cache_key)
+        if cached_path:
+            job = VideoJob(data, model_param, ref_audio, None, cache_key)
+            job.video_path = cached_path
+            job.cached = True
+            self._register(job)
+            self._finish(job, JOB_SUCCEEDED)
+            return job
+
+        # 排队中的任务也计入设备负载，auto 请求会避开已经排满的设备
+        device = device_scheduler.assign(gpu_choice)
+        if device not in self._queues:
+            device_scheduler.release(device)
+            raise ValueError(f"设备不可用: {device}")
+        job = VideoJob(data, model_param, ref_audio, device, cache_key, cancel_on_disconnect)
+        self._register(job)
+        try:
+            self._queues[device].put_nowait(job)
+        except queue.Full:
+            device_scheduler.release(device)
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            # 记录已经发布，其他 worker 不能再看到这个从未入队的任务
+            self.records.discard(job.id)
+            raise JobQueueFull(f"设备 {device} 的任务队列已满，请稍后再试")
+
+        print(f"[backend.job_queue] 任务入队: {job.id} -> {device}")
+        return job
+
+    def _register(self, job):
+        with self._lock:
+            self._prune_locked()
+            self._jobs[job.id] = job
+        self.records.publish(job)
+
+    def get(self, job_id):
+        """本进程中的任务。"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def lookup(self, job_id):
+        """本进程中的任务，或其他 worker 上任务的只读视图（RemoteJob）。"""
+        return self.get(job_id) or self.records.load(job_id)
+
+    def cancel(self, job_id):
+        """取消排队中的任务，或终止正在运行的 SyncTalk 进程；其他 worker 的任务转发取消请求。"""
+        job = self.get(job_id)
+        if job is None:
+            return self.records.request_cancel(job_id)
+        job.cancel_requested = True
+        if job.status == JOB_QUEUED:
+            self._finish(job, JOB_CANCELLED)
+        elif job.status == JOB_RUNNING and job.process is not None:
+            _terminate(job.process)
+        return job
+
+    def pending_count(self, device=None):
+        devices = [device] if device else list(self._queues)
+        return sum(self._queues[d].qsize() for d in devices if d in self._queues)
+
+    def _worker_loop(self, device):
+        q = self._queues[device]
+        while True:
+            job = q.get()
+            try:
+                if job.cancel_requested or job.status != JOB_QUEUED:
+                    continue
+                # 同一台机器上的其他 worker 共用设备并发上限
+                with span("video_job"), device_slot(
+                    f"infer-{device}", self.device_limits[device], lambda: job.cancel_requested
+                ) as acquired:
+                    if acquired:
+                        self._run(job)
+            except Exception as exc:
+                job.error = str(exc)
+                self._finish(job, JOB_FAILED)
+                print(f"[backend.job_queue] 任务异常: {job.id}: {exc}")
+            finally:
+                q.task_done()
+
+    def _run(self, job):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        self.records.publish(job)
+        if warm_worker_enabled():
+            self._run_on_worker(job)
+            return
+
+        cmd = _build_cmd(job.model_param, job.ref_audio, job.device)
+        print(f"[backend.job_queue] 开始执行任务 {job.id}: {' '.join(cmd)}")
+
+        job.process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        if job.cancel_requested:
+            _terminate(job.process)
+        if job.process.stdout:
+            for line in job.process.stdout:
+                job.logs.append(line.rstrip('\n'))
+        job.return_code = job.process.wait()
+        job.process = None
+
+        if job.cancel_requested:
+            self._finish(job, JOB_CANCELLED)
+            return
+        if job.return_code != 0:
+            job.error = f"SyncTalk 推理失败，退出码: {job.return_code}"
+            self._finish(job, JOB_FAILED)
+            return
+
+        job.video_path = _publish_output(job.model_param, job.ref_audio, job.cache_key)
+        self._finish(job, JOB_SUCCEEDED)
+
+    def _run_on_worker(self, job):
+        """交给常驻推理进程执行；取消时直接结束该 worker，进程池会在下次请求时重新拉起。"""
+        print(f"[backend.job_queue] 开始执行任务 {job.id}: 常驻推理进程 ({job.device})")
+        output_path = _worker_output_path(job.model_param, job.ref_audio)
+        try:
+            with worker_pool.lease(job.model_param, job.device) as worker:
+                job.process = worker.process
+                if job.cancel_requested:
+                    _terminate(job.process)
+                for line in worker.stream_infer(job.ref_audio, output_path):
+                    job.logs.append(line)
+            job.return_code = 0
+        except WorkerError as exc:
+            if not job.cancel_requested:
+                job.error = str(exc)
+                self._finish(job, JOB_FAILED)
+                return
+        finally:
+            job.process = None
+
+        if job.cancel_requested:
+            self._finish(job, JOB_CANCELLED)
+            return
+        job.video_path = _publish_output(job.model_param, job.ref_audio, job.cache_key)
+        self._finish(job, JOB_SUCCEEDED)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        if job.device and not job.device_released:
+            job.device_released = True
+            device_scheduler.release(job.device)
+        self.records.publish(job)
+        duration = job.finished_at - (job.started_at or job.created_at)
+        print(f"[backend.job_queue] 任务结束 {job.id}: {status} ({duration:.1f}s)")
+
+    def _active_jobs(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.status not in FINISHED_STATES]
+
+    def _prune_locked(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.status in FINISHED_STATES and now - job.finished_at > FINISHED_JOB_TTL
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def _terminate(process, timeout=5):
+    try:
+        process.terminate()
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    except Exception as exc:
+        print(f"[backend.job_queue] 终止进程失败: {exc}")
+
+
+video_jobs = JobQueue()
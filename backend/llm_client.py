@@ -0,0 +1,232 @@
+"""可复用的大模型客户端：进程级连接池、超时、带退避的重试、并发上限、回复缓存与多轮历史。
+
+通过环境变量配置：
+
+* ``ZHIPU_BASE_URL``：接口地址，可指向本地的 chat-completions 替身服务；
+* ``LLM_TIMEOUT`` / ``LLM_MAX_RETRIES`` / ``LLM_MAX_CONCURRENCY``；
+* ``LLM_CACHE_SIZE`` / ``LLM_CACHE_TTL``；
+* ``LLM_HISTORY_TOKENS``：多轮历史的 token 预算。
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+from zhipuai import ZhipuAI
+
+from backend.shared_state import shared_store
+
+
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_CACHE_TTL = 600
+DEFAULT_HISTORY_TOKENS = 2000
+# 共享存储中的多轮历史闲置超过该时间（秒）后过期
+HISTORY_TTL = 24 * 3600
+HISTORY_NAMESPACE = "chat_history"
+# 退避基数（秒），第 n 次重试等待 base * 2^n 加随机抖动
+BACKOFF_BASE = 0.5
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日韩字符按 1 个 token，其余按 4 个字符 1 个 token。"""
+    cjk = sum(1 for ch in text if '\u3000' <= ch <= '\u9fff' or '\uff00' <= ch <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ConversationHistory:
+    """Per-conversation message window trimmed to a token budget.
+
+    共享后端下历史保存在共享存储中（按 TTL 过期），同一会话的后续轮次落到其他 worker 也能接上。
+    """
+
+    def __init__(self, max_tokens=None, max_conversations=1000, state_store=None):
+        self.max_tokens = max_tokens or int(os.getenv("LLM_HISTORY_TOKENS", DEFAULT_HISTORY_TOKENS))
+        self.max_conversations = max_conversations
+        self.state_store = state_store or shared_store
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def messages(self, conversation_id):
+        if not conversation_id:
+            return []
+        if self.state_store.shared:
+            return self.state_store.get(HISTORY_NAMESPACE, conversation_id, [])
+        with self._lock:
+            return list(self._conversations.get(conversation_id, []))
+
+    def append(self, conversation_id, user_content, assistant_content):
+        if not conversation_id:
+            return
+        turn = [{"role": "user", "content": user_content}, {"role": "assistant", "content": assistant_content}]
+        if self.state_store.shared:
+            # 在共享存储内原子地追加，多个 worker 同时写同一会话时不会丢轮次
+            self.state_store.update(
+                HISTORY_NAMESPACE, conversation_id, lambda history: self._trim((history or []) + turn),
+                ttl=HISTORY_TTL,
+            )
+            return
+        with self._lock:
+            history = self._conversations.setdefault(conversation_id, [])
+            self._conversations.move_to_end(conversation_id)
+            history[:] = self._trim(history + turn)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+
+    def _trim(self, history):
+        # 从最早的一问一答开始丢弃，直到落入预算
+        while history and sum(estimate_tokens(m["content"]) for m in history) > self.max_tokens:
+            history = history[2:]
+        return history
+
+    def clear(self, conversation_id):
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+        if self.state_store.shared:
+            self.state_store.delete(HISTORY_NAMESPACE, conversation_id)
+
+
+class ResponseCache:
+    """Bounded LRU of replies keyed on (model, messages) with a TTL."""
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or int(os.getenv("LLM_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+        self.ttl = ttl or float(os.getenv("LLM_CACHE_TTL", DEFAULT_CACHE_TTL))
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model, messages):
+        raw = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class LLMClient:
+    def __init__(self, base_url=None, timeout=None, max_retries=None, max_concurrency=None,
+                 cache=None, history=None):
+        self.base_url = base_url or os.getenv("ZHIPU_BASE_URL") or None
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", DEFAULT_TIMEOUT))
+        self.max_retries = max_retries if max_retries is not None else int(
+            os.getenv("LLM_MAX_RETRIES", DEFAULT_MAX_RETRIES)
+        )
+        concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+        self.cache = cache or ResponseCache()
+        self.history = history or ConversationHistory()
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        # 所有 ZhipuAI 客户端共享同一个 httpx 连接池，避免每轮对话重新握手
+        self._http = httpx.Client(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency),
+        )
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, api_key):
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                client = ZhipuAI(
+                    api_key=api_key,
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    max_retries=0,
+                    http_client=self._http,
+                )
+                self._clients[api_key] = client
+            return client
+
+    def _with_retries(self, call):
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._semaphore:
+                    return call()
+            except Exception as exc:
+                last_error = exc
+                if attempt == self.max_retries:
+                    break
+                delay = BACKOFF_BASE * (2 ** attempt) * (1 + random.random() * 0.25)
+                print(f"[LLM] 请求失败，{delay:.1f}s 后重试 ({attempt + 1}/{self.max_retries}): {exc}")
+                time.sleep(delay)
+        raise last_error
+
+    def build_messages(self, content, conversation_id=None):
+        return self.history.messages(conversation_id) + [{"role": "user", "content": content}]
+
+    def chat(self, content, api_key, model, conversation_id=None):
+        """返回完整回复；失败时抛出最后一次的异常。"""
+        messages = self.build_messages(content, conversation_id)
+        cache_key = ResponseCache.key(model, messages)
+        output = self.cache.get(cache_key)
+        if output is None:
+            client = self._client(api_key)
+            response = self._with_retries(
+                lambda: client.chat.completions.create(model=model, messages=messages)
+            )
+            output = response.choices[0].message.content
+            self.cache.put(cache_key, output)
+        self.history.append(conversation_id, content, output)
+        return output
+
+    def stream_chat(self, content, api_key, model, conversation_id=None):
+        """逐段产出回复；只在第一个 token 到达之前重试，缓存命中时一次性返回。"""
+        messages = self.build_messages(content, conversation_id)
+        cache_key = ResponseCache.key(model, messages)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.history.append(conversation_id, content, cached)
+            yield cached
+            return
+
+        client = self._client(api_key)
+        response = self._with_retries(
+            lambda: client.chat.completions.create(model=model, messages=messages, stream=True)
+        )
+        parts = []
+        with self._semaphore:
+            for chunk in response:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        output = "".join(parts)
+        if output:
+            self.cache.put(cache_key, output)
+            self.history.append(conversation_id, content, output)
+
+    def stats(self):
+        return {
+            "cache_entries": len(self.cache._entries),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "base_url": self.base_url,
+        }
+
+
+llm_client = LLMClient()
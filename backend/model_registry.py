@@ -0,0 +1,163 @@
+"""SyncTalk 模型索引：启动时扫描一次 SyncTalk/model/*，之后按目录 mtime 增量更新。
+
+每个模型记录 checkpoint 列表、最新 checkpoint、训练 epoch 数（来自 train_model 的
+``{video}_ep{epochs}`` 命名）以及 results 下已有的视频，供推理路径解析和前端模型选择使用。
+"""
+import os
+import re
+import threading
+import time
+
+
+MODEL_ROOT = os.path.join("SyncTalk", "model")
+# 两次 mtime 检查之间的最短间隔（秒），避免每个请求都 stat 目录
+REFRESH_INTERVAL = 2.0
+CHECKPOINT_EXTS = (".pth", ".pt", ".ckpt")
+
+_EPOCH_SUFFIX_RE = re.compile(r"^(?P<video>.+)_ep(?P<epochs>\d+)$")
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ModelEntry:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        match = _EPOCH_SUFFIX_RE.match(name)
+        self.video_name = match.group("video") if match else name
+        self.epochs = int(match.group("epochs")) if match else None
+        self.checkpoints = []
+        self.results = {}
+        self._checkpoints_mtime = None
+        self._results_mtime = None
+
+    @property
+    def checkpoints_dir(self):
+        return os.path.join(self.path, "checkpoints")
+
+    @property
+    def results_dir(self):
+        return os.path.join(self.path, "results")
+
+    @property
+    def latest_checkpoint(self):
+        return self.checkpoints[-1] if self.checkpoints else None
+
+    @property
+    def valid(self):
+        return os.path.isdir(self.checkpoints_dir)
+
+    def refresh(self):
+        """只有 checkpoints/results 目录的 mtime 变化时才重新列目录。"""
+        checkpoints_mtime = _mtime(self.checkpoints_dir)
+        if checkpoints_mtime != self._checkpoints_mtime:
+            self._checkpoints_mtime = checkpoints_mtime
+            found = []
+            if checkpoints_mtime is not None:
+                for entry in os.scandir(self.checkpoints_dir):
+                    if entry.is_file() and entry.name.endswith(CHECKPOINT_EXTS):
+                        found.append((entry.stat().st_mtime, entry.name, entry.path))
+            self.checkpoints = [path for _, _, path in sorted(found)]
+
+        results_mtime = _mtime(self.results_dir)
+        if results_mtime != self._results_mtime:
+            self._results_mtime = results_mtime
+            results = {}
+            if results_mtime is not None:
+                for entry in os.scandir(self.results_dir):
+                    if entry.is_file() and entry.name.endswith(".mp4"):
+                        results[entry.name] = entry.stat().st_mtime
+            self.results = results
+
+    def latest_result(self):
+        if not self.results:
+            return None
+        name = max(self.results, key=self.results.get)
+        return os.path.join(self.results_dir, name)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "path": self.path,
+            "video_name": self.video_name,
+            "epochs": self.epochs,
+            "checkpoints": len(self.checkpoints),
+            "latest_checkpoint": self.latest_checkpoint,
+            "results": sorted(self.results, key=self.results.get, reverse=True),
+        }
+
+
+class ModelRegistry:
+    def __init__(self, root=MODEL_ROOT, refresh_interval=REFRESH_INTERVAL):
+        self.root = root
+        self.refresh_interval = refresh_interval
+        self._entries = {}
+        self._root_mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        with self._lock:
+            now = time.time()
+            if not force and now - self._last_check < self.refresh_interval:
+                return
+            self._last_check = now
+
+            root_mtime = _mtime(self.root)
+            if root_mtime != self._root_mtime:
+                self._root_mtime = root_mtime
+                names = set()
+                if root_mtime is not None:
+                    names = {e.name for e in os.scandir(self.root) if e.is_dir()}
+                for name in set(self._entries) - names:
+                    del self._entries[name]
+                for name in names - set(self._entries):
+                    self._entries[name] = ModelEntry(name, os.path.join(self.root, name))
+
+            for entry in self._entries.values():
+                entry.refresh()
+
+    def get(self, name, refresh=True):
+        if refresh:
+            self.refresh()
+        entry = self._entries.get(name)
+        if entry is not None and refresh:
+            # 刚推理完的模型需要立即看到新结果，单个模型的 mtime 检查开销很小
+            with self._lock:
+                entry.refresh()
+        return entry
+
+    def list(self, query=None):
+        """列出有效模型（含 checkpoints 目录），可按名称子串过滤，按 epoch 和名称排序。"""
+        self.refresh()
+        with self._lock:
+            entries = [e for e in self._entries.values() if e.valid]
+        if query:
+            q = query.lower()
+            entries = [e for e in entries if q in e.name.lower()]
+        return sorted(entries, key=lambda e: (e.video_name, e.epochs or 0, e.name))
+
+    def resolve(self, model_param):
+        """把模型名或 SyncTalk/model 下的路径解析为模型目录；无法识别时返回 None。"""
+        if not model_param:
+            return None
+        candidate = os.path.normpath(os.path.expanduser(model_param))
+        if os.path.basename(candidate) == "checkpoints":
+            candidate = os.path.dirname(candidate)
+
+        is_bare_name = os.sep not in candidate
+        root = os.path.normpath(self.root)
+        if is_bare_name or os.path.dirname(candidate) in (root, os.path.abspath(root)):
+            entry = self.get(os.path.basename(candidate))
+            if entry is not None and entry.valid:
+                # 传入的是路径时保持原样（相对/绝对），只给裸模型名补全目录
+                return entry.path if is_bare_name else candidate
+        return None
+
+
+model_registry = ModelRegistry()
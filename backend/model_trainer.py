@@ -3,23 +3,179 @@ import os
 import time
 from pathlib import Path
 
-def _map_gpu_choice(gpu_choice: str) -> str:
-    if not gpu_choice:
-        return "GPU0"
-    val = str(gpu_choice).upper()
-    if val in ("GPU0", "GPU1", "CPU"):
-        return val
-    return "GPU0"
+from backend.file_publish import publish_file
+from backend.tracing import traced
+from backend.device_scheduler import device_scheduler, KIND_TRAIN
+from backend.video_generator import _build_cmd
+from backend.train_cache import (
+    preprocess_cache, preprocess_enabled, find_base_checkpoint, read_meta, write_meta,
+    META_NAME, TRAIN_MODE_INCREMENTAL, TRAIN_MODES, DEFAULT_TRAIN_MODE,
+)
+
+DEFAULT_EPOCHS = 140
+
+
+def parse_epochs(value):
+    """把表单中的训练轮数转成正整数，留空时使用默认值；无效时抛出 ValueError。"""
+    if value in (None, ""):
+        return DEFAULT_EPOCHS
+    try:
+        epochs = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"无效的训练轮数: {value}")
+    if epochs <= 0:
+        raise ValueError(f"训练轮数必须为正整数: {value}")
+    return epochs
+
+
+def _build_train_cmd(ref_video, gpu_choice, epochs, data_dir=None, base=None):
+    cmd = [
+        "./SyncTalk/run_synctalk.sh", "train",
+        "--video_path", ref_video,
+        "--gpu", gpu_choice,
+        "--epochs", str(epochs),
+    ]
+    # 预处理已经单独完成时直接读取结果，不再重新抽帧、检测关键点
+    if data_dir:
+        cmd += ["--data_dir", data_dir, "--skip_preprocess"]
+    # 从同一视频的已有模型继续训练，只训练新增的 epoch
+    if base is not None:
+        cmd += ["--resume_from", base.checkpoint, "--start_epoch", str(base.epoch)]
+    return cmd
+
+
+def _model_dir_for(ref_video, epochs):
+    """训练输出目录遵循 SyncTalk 的 {video}_ep{epochs} 命名。"""
+    model_dir_name = f"{Path(ref_video).stem}_ep{epochs}"
+    return model_dir_name, os.path.join("SyncTalk", "model", model_dir_name)
+
+
+class TrainPlan:
+    """What a training run will actually do: reuse preprocessing, continue from a checkpoint, or skip."""
+
+    def __init__(self, ref_video, epochs, mode):
+        self.ref_video = ref_video
+        self.epochs = epochs
+        self.mode = mode
+        self.model_dir = _model_dir_for(ref_video, epochs)[1]
+        self.video_sha256 = None
+        self.data_dir = None
+        self.base = None
+        self.skip = False
+        self.cmd = None
+
+
+def plan_training(ref_video, epochs, gpu_choice, mode=DEFAULT_TRAIN_MODE, run_step=None, should_abort=None):
+    """准备一次训练：需要时先用 run_step(cmd) 执行（或复用）视频预处理，再决定从哪里开始训练。"""
+    if mode not in TRAIN_MODES:
+        raise ValueError(f"不支持的训练方式: {mode}")
+    plan = TrainPlan(ref_video, int(epochs), mode)
+    if preprocess_enabled() or mode == TRAIN_MODE_INCREMENTAL:
+        plan.video_sha256 = preprocess_cache.key_for(ref_video)
+    if preprocess_enabled() and run_step is not None:
+        plan.data_dir = preprocess_cache.ensure(ref_video, plan.video_sha256, gpu_choice, run_step, should_abort)
+
+    if mode == TRAIN_MODE_INCREMENTAL:
+        meta = read_meta(plan.model_dir)
+        if meta and meta.get("video_sha256") == plan.video_sha256 and (meta.get("trained_epochs") or 0) >= plan.epochs:
+            plan.skip = True
+            return plan
+        plan.base = find_base_checkpoint(ref_video, plan.video_sha256, plan.epochs)
+
+    # 目标目录将被重新训练，训练成功前旧的记录不再可信
+    meta_path = os.path.join(plan.model_dir, META_NAME)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    plan.cmd = _build_train_cmd(ref_video, gpu_choice, plan.epochs, plan.data_dir, plan.base)
+    return plan
+
+
+def record_training(plan):
+    """训练成功后记录模型来自哪段视频、训练到了第几个 epoch，供之后的增量训练使用。"""
+    if plan.video_sha256 is None:
+        return
+    write_meta(
+        plan.model_dir,
+        video_path=plan.ref_video,
+        video_sha256=plan.video_sha256,
+        trained_epochs=plan.epochs,
+        base_model=plan.base.model_dir if plan.base else None,
+        data_dir=plan.data_dir,
+        updated_at=time.time(),
+    )
+
+
+def _run_step(cmd, log_path=None):
+    """同步执行预处理，输出追加到训练日志。"""
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if log_path:
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write("# PREPROCESS CMD\n" + " ".join(cmd) + "\n\n# PREPROCESS STDOUT\n" + (result.stdout or "") + "\n\n")
+            if result.stderr:
+                f.write("# PREPROCESS STDERR\n" + result.stderr + "\n\n")
+    return result.returncode
+
+
+@traced("train_preview")
+def _run_preview(ref_video, epochs, gpu_choice, log_path=None):
+    """用默认音频 aud.wav 做一次推理预览，成功时返回 static/videos 下的视频路径。"""
+    try:
+        model_dir_name, model_dir = _model_dir_for(ref_video, epochs)
+        preview_audio = os.path.join("SyncTalk", "audio", "aud.wav")
+
+        os.makedirs(os.path.join("static", "videos"), exist_ok=True)
 
+        if os.path.isdir(model_dir) and os.path.isfile(preview_audio):
+            # 每次预览都用同一段 aud.wav，其音频特征只在第一次预览时提取
+            infer_cmd = _build_cmd(model_dir, preview_audio, gpu_choice)
+            print(f"[backend.model_trainer] 训练后预览推理: {' '.join(infer_cmd)}")
+            infer_res = subprocess.run(
+                infer_cmd,
+                capture_output=True,
+                text=True,
+            )
+            if log_path:
+                with open(log_path, 'a', encoding='utf-8') as f:
+                    f.write("\n# INFER STDOUT\n" + (infer_res.stdout or "") + "\n")
+                    if infer_res.stderr:
+                        f.write("# INFER STDERR\n" + infer_res.stderr + "\n")
+
+            # 发布输出视频到静态目录（优先重命名/reflink，不行再复制）
+            audio_name = Path(preview_audio).stem
+            results_dir = os.path.join(model_dir, "results")
+            expected_output = os.path.join(results_dir, f"{model_dir_name}_{audio_name}.mp4")
+            if os.path.exists(expected_output):
+                dest = os.path.join("static", "videos", f"{model_dir_name}_{audio_name}.mp4")
+                try:
+                    publish_file(expected_output, dest)
+                    print(f"[backend.model_trainer] 预览视频生成完成: {dest}")
+                    return dest
+                except Exception as copy_err:
+                    print(f"[backend.model_trainer] 发布预览视频失败: {copy_err}")
+
+        else:
+            print("[backend.model_trainer] 缺少模型目录或预览音频，跳过预览推理")
+
+    except Exception as e:
+        print(f"[backend.model_trainer] 预览推理失败: {e}")
+    return None
+
+
+@traced("train")
 def train_model(data):
     """运行 SyncTalk 训练流程，并在成功后生成一个简短推理预览视频。"""
+    # 训练和预览推理期间占用同一个设备，auto 时由调度器选择
+    with device_scheduler.reserve(data.get('gpu_choice'), KIND_TRAIN) as gpu_choice:
+        return _train_on_device(data, gpu_choice)
+
+
+def _train_on_device(data, gpu_choice):
     print("[backend.model_trainer] 收到数据：")
     for k, v in data.items():
         print(f"  {k}: {v}")
 
     ref_video = data.get('ref_video')
-    gpu_choice = _map_gpu_choice(data.get('gpu_choice'))
-    epochs = str(data.get('epoch') or '140')
+    epochs = str(parse_epochs(data.get('epoch')))
     generate_log = bool(data.get('generate_log'))
 
     # 基础校验
@@ -38,31 +194,33 @@ def train_model(data):
 
     if data.get('model_choice') == "SyncTalk":
         try:
-            cmd = [
-                "./SyncTalk/run_synctalk.sh", "train",
-                "--video_path", ref_video,
-                "--gpu", gpu_choice,
-                "--epochs", epochs,
-            ]
-
-            print(f"[backend.model_trainer] 执行命令: {' '.join(cmd)}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=True,
+            plan = plan_training(
+                ref_video, epochs, gpu_choice, data.get('train_mode') or DEFAULT_TRAIN_MODE,
+                run_step=lambda step_cmd: _run_step(step_cmd, log_path),
             )
+            if plan.skip:
+                print(f"[backend.model_trainer] 模型已训练到 {epochs} 个 epoch，跳过训练: {plan.model_dir}")
+            else:
+                cmd = plan.cmd
+                print(f"[backend.model_trainer] 执行命令: {' '.join(cmd)}")
+                result = subprocess.run(
+                    cmd,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
 
-            # 打印并保存日志
-            print("[backend.model_trainer] 训练输出:\n", result.stdout)
-            if result.stderr:
-                print("[backend.model_trainer] 错误输出:\n", result.stderr)
-            if log_path:
-                with open(log_path, 'w', encoding='utf-8') as f:
-                    f.write("# CMD\n" + " ".join(cmd) + "\n\n")
-                    f.write("# STDOUT\n" + (result.stdout or "") + "\n\n")
-                    if result.stderr:
-                        f.write("# STDERR\n" + result.stderr + "\n")
+                # 打印并保存日志
+                print("[backend.model_trainer] 训练输出:\n", result.stdout)
+                if result.stderr:
+                    print("[backend.model_trainer] 错误输出:\n", result.stderr)
+                if log_path:
+                    with open(log_path, 'a', encoding='utf-8') as f:
+                        f.write("# CMD\n" + " ".join(cmd) + "\n\n")
+                        f.write("# STDOUT\n" + (result.stdout or "") + "\n\n")
+                        if result.stderr:
+                            f.write("# STDERR\n" + result.stderr + "\n")
+                record_training(plan)
 
         except subprocess.CalledProcessError as e:
             print(f"[backend.model_trainer] 训练失败，退出码: {e.returncode}")
@@ -78,52 +236,9 @@ def train_model(data):
             return ref_video
 
         # 训练完成后尝试生成一个预览视频（使用默认音频 aud.wav）
-        try:
-            video_name = Path(ref_video).stem
-            model_dir_name = f"{video_name}_ep{epochs}"
-            model_dir = os.path.join("SyncTalk", "model", model_dir_name)
-            preview_audio = os.path.join("SyncTalk", "audio", "aud.wav")
-
-            os.makedirs(os.path.join("static", "videos"), exist_ok=True)
-
-            if os.path.isdir(model_dir) and os.path.isfile(preview_audio):
-                infer_cmd = [
-                    "./SyncTalk/run_synctalk.sh", "infer",
-                    "--model_dir", model_dir,
-                    "--audio_path", preview_audio,
-                    "--gpu", gpu_choice,
-                ]
-                print(f"[backend.model_trainer] 训练后预览推理: {' '.join(infer_cmd)}")
-                infer_res = subprocess.run(
-                    infer_cmd,
-                    capture_output=True,
-                    text=True,
-                )
-                if log_path:
-                    with open(log_path, 'a', encoding='utf-8') as f:
-                        f.write("\n# INFER STDOUT\n" + (infer_res.stdout or "") + "\n")
-                        if infer_res.stderr:
-                            f.write("# INFER STDERR\n" + infer_res.stderr + "\n")
-
-                # 复制输出视频到静态目录
-                audio_name = Path(preview_audio).stem
-                results_dir = os.path.join(model_dir, "results")
-                expected_output = os.path.join(results_dir, f"{model_dir_name}_{audio_name}.mp4")
-                if os.path.exists(expected_output):
-                    dest = os.path.join("static", "videos", f"{model_dir_name}_{audio_name}.mp4")
-                    try:
-                        import shutil
-                        shutil.copy(expected_output, dest)
-                        print(f"[backend.model_trainer] 预览视频生成完成: {dest}")
-                        return dest
-                    except Exception as copy_err:
-                        print(f"[backend.model_trainer] 复制预览视频失败: {copy_err}")
-
-            else:
-                print("[backend.model_trainer] 缺少模型目录或预览音频，跳过预览推理")
-
-        except Exception as e:
-            print(f"[backend.model_trainer] 预览推理失败: {e}")
+        preview_path = _run_preview(ref_video, epochs, gpu_choice, log_path)
+        if preview_path:
+            return preview_path
 
     print("[backend.model_trainer] 训练完成")
     # 默认返回原始训练视频路径（作为页面占位或预览）
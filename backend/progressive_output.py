@@ -0,0 +1,394 @@
+"""渐进式视频输出：推理过程中把已经渲染好的帧实时封装成 HLS（fMP4 分片），边生成边播放。
+
+帧来源协议：``SYNCTALK_STREAM_CMD`` 启动的进程先在 stdout 输出一行 JSON 头
+``{"width": W, "height": H, "fps": F}``，随后连续输出 rgb24 原始帧（每帧 W*H*3 字节），
+stderr 作为日志。``python -m backend.progressive_output --stub`` 是不需要 GPU 的替身。
+
+每帧写入 ffmpeg 的 stdin，由 ffmpeg 切成 ``static/videos/live/<job_id>/`` 下的
+``init.mp4`` + ``seg_*.m4s`` 并持续更新 ``index.m3u8``（EVENT 类型播放列表），
+前端拿到播放列表后即可开始播放，不必等整段视频渲染完。
+
+任务状态发布到共享存储（``JobRecords``），其他 worker 可以查询、取消，并从同一台机器上的
+分片目录直接提供播放列表和分片。
+"""
+import argparse
+import json
+import os
+import queue
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from backend.video_generator import _validate_inputs
+from backend.job_queue import video_jobs, JobQueueFull, MAX_PENDING_PER_DEVICE
+from backend.device_scheduler import device_scheduler
+from backend.shared_state import device_slot, JobRecords
+
+
+DEFAULT_STREAM_CMD = "./SyncTalk/run_synctalk.sh stream --model_dir {model_dir} --audio_path {audio_path} --gpu {gpu}"
+LIVE_ROOT = os.path.join("static", "videos", "live")
+PLAYLIST_NAME = "index.m3u8"
+INIT_SEGMENT_NAME = "init.mp4"
+DEFAULT_SEGMENT_SECONDS = 2
+FINISHED_JOB_TTL = 3600
+# 帧生成进程加载模型后必须在这段时间（秒）内输出头信息，否则视为卡死
+HEADER_TIMEOUT = 300
+
+LIVE_STARTING = "starting"
+LIVE_STREAMING = "streaming"
+LIVE_SUCCEEDED = "succeeded"
+LIVE_FAILED = "failed"
+LIVE_CANCELLED = "cancelled"
+LIVE_FINISHED_STATES = (LIVE_SUCCEEDED, LIVE_FAILED, LIVE_CANCELLED)
+
+
+class FrameProducer:
+    """Read raw rgb24 frames from a SyncTalk streaming process."""
+
+    def __init__(self, model_dir, audio_path, device, cmd_template=None):
+        template = cmd_template or os.getenv("SYNCTALK_STREAM_CMD", DEFAULT_STREAM_CMD)
+        self.cmd = [
+            part.format(model_dir=model_dir, audio_path=audio_path, gpu=device)
+            for part in shlex.split(template)
+        ]
+        self.process = None
+        self.width = self.height = self.fps = None
+        self.logs = []
+
+    def start(self, timeout=HEADER_TIMEOUT):
+        print(f"[backend.progressive_output] 启动帧生成进程: {' '.join(self.cmd)}")
+        self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        threading.Thread(target=self._drain_stderr, daemon=True).start()
+        # 头信息在单独的线程里读，这里按截止时间等待；进程卡住时结束它，不一直占着设备槽位
+        header = queue.Queue()
+        threading.Thread(target=lambda: header.put(self.process.stdout.readline()), daemon=True).start()
+        try:
+            header_line = header.get(timeout=timeout)
+        except queue.Empty:
+            self.terminate()
+            raise RuntimeError(f"帧生成进程 {timeout} 秒内未输出头信息")
+        try:
+            header = json.loads(header_line)
+            self.width, self.height, self.fps = int(header["width"]), int(header["height"]), float(header["fps"])
+        except (ValueError, KeyError, TypeError):
+            self.terminate()
+            raise RuntimeError(f"帧生成进程未输出有效的头信息: {header_line[:200]!r}")
+        return self
+
+    def frames(self):
+        frame_size = self.width * self.height * 3
+        while True:
+            frame = self.process.stdout.read(frame_size)
+            if len(frame) < frame_size:
+                break
+            yield frame
+
+    def wait(self):
+        return self.process.wait()
+
+    def terminate(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def _drain_stderr(self):
+        for raw in self.process.stderr:
+            self.logs.append(raw.decode('utf-8', errors='replace').rstrip())
+
+
+class HlsSegmenter:
+    """ffmpeg process that muxes piped frames (and the driving audio) into fMP4 HLS segments."""
+
+    def __init__(self, output_dir, width, height, fps, audio_path=None, segment_seconds=None):
+        self.output_dir = output_dir
+        self.segment_seconds = segment_seconds or float(
+            os.getenv("PROGRESSIVE_SEGMENT_SECONDS", DEFAULT_SEGMENT_SECONDS)
+        )
+        # 每个分片以关键帧开头，否则播放器无法从任意分片开始解码
+        gop = max(1, int(round(fps * self.segment_seconds)))
+        self.cmd = [
+            'ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps), '-i', 'pipe:0',
+        ]
+        if audio_path:
+            self.cmd += ['-i', audio_path, '-map', '0:v', '-map', '1:a', '-c:a', 'aac', '-b:a', '128k']
+        self.cmd += [
+            '-c:v', 'libx264', '-preset', 'veryfast', '-tune', 'zerolatency', '-pix_fmt', 'yuv420p',
+            '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+            '-f', 'hls',
+            '-hls_time', str(self.segment_seconds),
+            '-hls_playlist_type', 'event',
+            '-hls_segment_type', 'fmp4',
+            '-hls_fmp4_init_filename', INIT_SEGMENT_NAME,
+            '-hls_segment_filename', os.path.join(output_dir, 'seg_%05d.m4s'),
+            os.path.join(output_dir, PLAYLIST_NAME),
+        ]
+        self.process = None
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        try:
+            self.process = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError("未找到 ffmpeg，无法进行渐进式输出")
+        return self
+
+    def write_frame(self, frame):
+        self.process.stdin.write(frame)
+
+    def close(self):
+        """关闭输入并等待 ffmpeg 写完最后一个分片和 #EXT-X-ENDLIST。"""
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = self.process.stderr.read().decode('utf-8', errors='replace')
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg 分片失败: {stderr.strip()[-500:]}")
+
+    def kill(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+def live_dir(job_id):
+    """任务的分片目录；同一台机器上的所有 worker 都能读取。"""
+    return os.path.join(LIVE_ROOT, job_id)
+
+
+class ProgressiveJob:
+    def __init__(self, model_param, ref_audio, device):
+        self.id = uuid.uuid4().hex
+        self.model_param = model_param
+        self.ref_audio = ref_audio
+        self.device = device
+        self.dir = live_dir(self.id)
+        self.status = LIVE_STARTING
+        self.frames = 0
+        self.fps = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.producer = None
+        self.segmenter = None
+        self.cancel_requested = False
+
+    @property
+    def playlist_url(self):
+        return f"/video_generation/live/{self.id}/{PLAYLIST_NAME}"
+
+    def segment_count(self):
+        try:
+            with open(os.path.join(self.dir, PLAYLIST_NAME), encoding='utf-8') as f:
+                return sum(1 for line in f if line.startswith("#EXTINF"))
+        except OSError:
+            return 0
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "device": self.device,
+            "model_param": self.model_param,
+            "ref_audio": self.ref_audio,
+            "frames": self.frames,
+            "fps": self.fps,
+            "rendered_seconds": round(self.frames / self.fps, 2) if self.fps else 0.0,
+            "segments": self.segment_count(),
+            "playlist": self.playlist_url,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ProgressiveRenderer:
+    """Run progressive renders off the request threads, sharing video_jobs' per-device slots."""
+
+    def __init__(self, device_limits=None, max_pending=MAX_PENDING_PER_DEVICE):
+        # 与 video_jobs 使用同一组 infer-<设备> 槽位，排队推理与渐进式推理合计不超过设备并发上限
+        self.device_limits = device_limits or video_jobs.device_limits
+        self.max_pending = max_pending
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # 多 worker 部署时，其他 worker 通过共享记录查询本进程的任务、转发取消请求
+        self.records = JobRecords("progressive_jobs", FINISHED_JOB_TTL)
+        self.records.watch(self._active_jobs, self.cancel)
+
+    def start(self, data):
+        model_param, ref_audio, gpu_choice = _validate_inputs(data)
+        device = device_scheduler.assign(gpu_choice)
+        if self.device_limits.get(device, 0) <= 0:
+            device_scheduler.release(device)
+            raise ValueError(f"设备不可用: {device}")
+        job = ProgressiveJob(model_param, ref_audio, device)
+        with self._lock:
+            self._prune_locked()
+            # 还没开始出帧（等待槽位或启动中）的任务有上限，超过后直接拒绝而不是无限堆积线程
+            pending = sum(1 for j in self._jobs.values() if j.device == device and j.status == LIVE_STARTING)
+            if pending >= self.max_pending:
+                device_scheduler.release(device)
+                raise JobQueueFull(f"设备 {device} 的渐进式任务已满，请稍后再试")
+            self._jobs[job.id] = job
+        self.records.publish(job)
+        threading.Thread(target=self._run, args=(job,), name=f"live-{job.id[:8]}", daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def lookup(self, job_id):
+        """本进程中的任务，或其他 worker 上任务的只读视图（RemoteJob）。"""
+        return self.get(job_id) or self.records.load(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """终止本进程的任务；其他 worker 的任务转发取消请求。"""
+        job = self.get(job_id)
+        if job is None:
+            return self.records.request_cancel(job_id)
+        job.cancel_requested = True
+        if job.producer is not None:
+            job.producer.terminate()
+        return job
+
+    def _run(self, job):
+        try:
+            self._run_in_slot(job)
+        finally:
+            device_scheduler.release(job.device)
+
+    def _run_in_slot(self, job):
+        with device_slot(
+            f"infer-{job.device}", self.device_limits[job.device], lambda: job.cancel_requested
+        ) as acquired:
+            try:
+                if not acquired:
+                    self._finish(job, LIVE_CANCELLED)
+                    return
+                if job.cancel_requested:
+                    self._finish(job, LIVE_CANCELLED)
+                    return
+                # 先挂到任务上再等待头信息，等待期间的取消也能结束进程
+                job.producer = FrameProducer(job.model_param, job.ref_audio, job.device)
+                job.producer.start()
+                job.fps = job.producer.fps
+                job.segmenter = HlsSegmenter(
+                    job.dir, job.producer.width, job.producer.height, job.producer.fps, job.ref_audio
+                ).start()
+                job.status = LIVE_STREAMING
+                self.records.publish(job)
+                # 每个分片时长发布一次进度，其他 worker 查询到的帧数不会落后太多
+                publish_every = max(1, int(job.fps * DEFAULT_SEGMENT_SECONDS))
+                for frame in job.producer.frames():
+                    job.segmenter.write_frame(frame)
+                    job.frames += 1
+                    if job.frames % publish_every == 0:
+                        self.records.publish(job)
+                return_code = job.producer.wait()
+                job.segmenter.close()
+
+                if job.cancel_requested:
+                    self._finish(job, LIVE_CANCELLED)
+                elif return_code != 0:
+                    job.error = f"帧生成进程退出码: {return_code} {' '.join(job.producer.logs[-3:])}".strip()
+                    self._finish(job, LIVE_FAILED)
+                else:
+                    self._finish(job, LIVE_SUCCEEDED)
+            except Exception as exc:
+                if job.producer is not None:
+                    job.producer.terminate()
+                if job.segmenter is not None:
+                    job.segmenter.kill()
+                job.error = str(exc)
+                self._finish(job, LIVE_CANCELLED if job.cancel_requested else LIVE_FAILED)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        self.records.publish(job)
+        print(f"[backend.progressive_output] 渐进式任务结束 {job.id}: {status} ({job.frames} 帧)")
+
+    def _active_jobs(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.status not in LIVE_FINISHED_STATES]
+
+    def _prune_locked(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.status in LIVE_FINISHED_STATES and now - job.finished_at > FINISHED_JOB_TTL
+        ]
+        for job_id in expired:
+            shutil.rmtree(self._jobs.pop(job_id).dir, ignore_errors=True)
+        # 进程重启前留下的（或其他 worker 的）分片目录，超过保留时间没有更新也一并删除
+        try:
+            names = os.listdir(LIVE_ROOT)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(LIVE_ROOT, name)
+            try:
+                stale = name not in self._jobs and now - os.path.getmtime(path) > FINISHED_JOB_TTL
+            except OSError:
+                continue
+            if stale:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+progressive_renderer = ProgressiveRenderer()
+
+
+def _stub_main(args):
+    """替身帧生成器：按音频时长输出渐变色块帧，用于在没有 GPU 的环境下测试分片与播放。"""
+    seconds = args.seconds
+    if seconds is None:
+        from backend.audio_ingest import load_pcm
+        try:
+            seconds = load_pcm(args.audio_path).duration
+        except Exception as exc:
+            sys.stderr.write(f"[stub] 无法读取音频时长，使用 5 秒: {exc}\n")
+            seconds = 5.0
+
+    out = sys.stdout.buffer
+    out.write((json.dumps({"width": args.width, "height": args.height, "fps": args.fps}) + "\n").encode())
+    out.flush()
+    total = max(1, int(seconds * args.fps))
+    row = bytes(range(256)) * (args.width * 3 // 256 + 2)
+    for index in range(total):
+        # 每帧整体平移一个像素，肉眼可以看出画面在动
+        shift = (index * 3) % 256
+        line = row[shift:shift + args.width * 3]
+        out.write(line * args.height)
+        out.flush()
+        if args.frame_delay:
+            time.sleep(args.frame_delay)
+        if index % int(args.fps) == 0:
+            sys.stderr.write(f"[stub] frame {index}/{total}\n")
+            sys.stderr.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="SyncTalk progressive frame producer (stub)")
+    parser.add_argument("--stub", action="store_true", help="emit synthetic frames instead of running SyncTalk")
+    parser.add_argument("--model_dir", default="")
+    parser.add_argument("--audio_path", default="")
+    parser.add_argument("--gpu", default="CPU")
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=240)
+    parser.add_argument("--fps", type=int, default=25)
+    parser.add_argument("--seconds", type=float, default=None)
+    parser.add_argument("--frame_delay", type=float, default=0.0)
+    cli_args = parser.parse_args()
+    if not cli_args.stub:
+        parser.error("only --stub mode is implemented here; the real producer lives in SyncTalk")
+    _stub_main(cli_args)
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from backend.shared_state import shared_store
+
+
+CACHE_DIR = os.path.join("static", "videos")
+INDEX_PATH = os.path.join(CACHE_DIR, ".result_cache.json")
+NAMESPACE = "result_cache"
+# 缓存视频总大小上限（字节），默认 5GB，可通过环境变量覆盖
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path):
+    """分块计算文件内容哈希，避免一次性读入大文件。"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checkpoint_fingerprint(model_dir):
+    """Fingerprint a model directory by its checkpoint names, sizes and mtimes.
+
+    checkpoint 文件通常有数百 MB，这里不读取内容，只要有文件被替换或重新训练指纹就会变化。
+    """
+    checkpoints_dir = os.path.join(model_dir, "checkpoints")
+    digest = hashlib.sha256(os.path.abspath(model_dir).encode('utf-8'))
+    for entry in sorted(os.scandir(checkpoints_dir), key=lambda e: e.name):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        digest.update(f"{entry.name}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Content-addressed LRU cache of rendered videos under static/videos."""
+
+    def __init__(self, index_path=INDEX_PATH, max_bytes=None, state_store=None):
+        self.index_path = index_path
+        # 共享后端下索引条目同时写入共享存储，其他 worker 渲染的结果也能命中
+        self.state_store = state_store or shared_store
+        self.max_bytes = max_bytes or int(os.getenv("VIDEO_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._load()
+
+    def key_for(self, model_dir, audio_path):
+        fingerprint = checkpoint_fingerprint(model_dir)
+        audio_hash = file_sha256(audio_path)
+        return hashlib.sha256(f"{fingerprint}:{audio_hash}".encode('utf-8')).hexdigest()[:32]
+
+    def output_name(self, model_dir, key):
+        """缓存文件名包含内容哈希，同名但内容不同的音频不会互相覆盖。"""
+        model_dir_name = os.path.basename(os.path.normpath(model_dir))
+        return f"{model_dir_name}_{key[:16]}.mp4"
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not os.path.isfile(entry["path"]):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                entry = self._adopt_shared_locked(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_access"] = time.time()
+            self._entries.move_to_end(key)
+            self._save_locked()
+            return entry["path"]
+
+    def store(self, key, path):
+        if not os.path.isfile(path):
+            return
+        with self._lock:
+            entry = self._entries[key] = {
+                "path": path,
+                "size": os.path.getsize(path),
+                "last_access": time.time(),
+            }
+            self._entries.move_to_end(key)
+            self._evict_locked()
+            self._save_locked()
+            if self.state_store.shared:
+                self.state_store.set(NAMESPACE, key, entry)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(e["size"] for e in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _evict_locked(self):
+        total = sum(e["size"] for e in self._entries.values())
+        # 至少保留最近写入的一个条目
+        while total > self.max_bytes and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            total -= entry["size"]
+            self.evictions += 1
+            if self.state_store.shared:
+                self.state_store.delete(NAMESPACE, key)
+            try:
+                os.remove(entry["path"])
+            except OSError:
+                pass
+            print(f"[backend.result_cache] 淘汰缓存视频: {entry['path']}")
+
+    def _adopt_shared_locked(self, key):
+        """本地索引未命中时查共享索引，文件仍在则并入本地索引。"""
+        if not self.state_store.shared:
+            return None
+        entry = self.state_store.get(NAMESPACE, key)
+        if not entry or not os.path.isfile(entry.get("path", "")):
+            return None
+        self._entries[key] = entry
+        return entry
+
+    def _load(self):
+        if not os.path.isfile(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+        except (OSError, ValueError) as exc:
+            print(f"[backend.result_cache] 缓存索引读取失败，将重新建立: {exc}")
+            return
+        for key, entry in sorted(raw.items(), key=lambda kv: kv[1].get("last_access", 0)):
+            if os.path.isfile(entry.get("path", "")):
+                self._entries[key] = entry
+
+    def _save_locked(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+
+result_cache = ResultCache()
@@ -0,0 +1,381 @@
+"""多 worker / 多节点共享状态：任务记录、缓存索引和会话数据。
+
+后端由 ``STATE_BACKEND`` 选择：
+
+* ``memory``（默认）：只在本进程内有效，适合单进程开发服务器；
+* ``sqlite``：``STATE_DB_PATH`` 指向的 SQLite 文件（WAL 模式），同一台机器上的 worker 共享，
+  ``gunicorn.conf.py`` 默认启用；
+* ``redis``：``REDIS_URL`` 指向的 Redis 兼容服务，可跨机器共享，需要安装 ``redis`` 包。
+
+值统一以 JSON 保存，可以带 TTL；``update`` 在存储内原子地完成读-改-写，多个 worker 同时修改
+同一个键时不会互相覆盖。任务由接收它的 worker 执行，该 worker 把状态发布成
+记录（``JobRecords``），其他 worker 据此回答状态查询、转发取消请求。设备并发上限用
+文件锁（``device_slot``）在同一台机器的 worker 之间共享。
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，设备槽位退化为进程内限制
+    fcntl = None
+
+try:
+    import redis
+except ImportError:  # 只有 STATE_BACKEND=redis 时才需要
+    redis = None
+
+
+DEFAULT_DB_PATH = os.path.join("static", "state", "shared.db")
+DEFAULT_LOCK_DIR = os.path.join("static", "state", "locks")
+# 每写入这么多次清理一次过期记录
+PURGE_EVERY = 200
+# 其他 worker 读取记录后，至少隔这么久（秒）才重新读取状态
+RECORD_REFRESH_INTERVAL = 1.0
+# 任务所属 worker 检查跨 worker 取消请求、刷新记录的间隔（秒）
+WATCH_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 15.0
+
+
+def worker_id():
+    """当前进程的标识（主机名:pid），写入任务记录的 owner 字段。"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class MemoryStore:
+    """Process-local store; the default dev server runs a single process."""
+
+    shared = False
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            item = self._data.get((namespace, key))
+            if item is None:
+                return default
+            raw, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[(namespace, key)]
+                return default
+        return json.loads(raw)
+
+    def set(self, namespace, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        raw = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._data[(namespace, key)] = (raw, expires_at)
+
+    def update(self, namespace, key, fn, default=None, ttl=None):
+        """原子地把值替换为 fn(旧值)，返回新值。"""
+        with self._lock:
+            item = self._data.get((namespace, key))
+            if item is None or (item[1] is not None and item[1] <= time.time()):
+                current = default
+            else:
+                current = json.loads(item[0])
+            value = fn(current)
+            expires_at = time.time() + ttl if ttl else None
+            self._data[(namespace, key)] = (json.dumps(value, ensure_ascii=False), expires_at)
+        return value
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+    def items(self, namespace):
+        now = time.time()
+        with self._lock:
+            found = [
+                (key, raw) for (ns, key), (raw, expires_at) in self._data.items()
+                if ns == namespace and (expires_at is None or expires_at > now)
+            ]
+        return [(key, json.loads(raw)) for key, raw in found]
+
+
+class SQLiteStore:
+    """Key/value table in a SQLite file shared by every worker on the host."""
+
+    shared = True
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL,"
+            " PRIMARY KEY (ns, key))"
+        )
+
+    def _conn(self):
+        # 连接按线程创建；fork 出的 worker 不能复用父进程的连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace, key, default=None):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM kv WHERE ns = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return default
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value, ensure_ascii=False), expires_at),
+        )
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def update(self, namespace, key, fn, default=None, ttl=None):
+        """原子地把值替换为 fn(旧值)，返回新值；BEGIN IMMEDIATE 让并发的写者排队。"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value = fn(self.get(namespace, key, default))
+            self.set(namespace, key, value, ttl=ttl)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return value
+
+    def delete(self, namespace, key):
+        self._conn().execute("DELETE FROM kv WHERE ns = ? AND key = ?", (namespace, key))
+
+    def items(self, namespace):
+        rows = self._conn().execute(
+            "SELECT key, value FROM kv WHERE ns = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, time.time()),
+        ).fetchall()
+        return [(key, json.loads(raw)) for key, raw in rows]
+
+
+class RedisStore:
+    """Redis-compatible store for workers spread over several machines."""
+
+    shared = True
+
+    def __init__(self, url, prefix="tfg:"):
+        if redis is None:
+            raise RuntimeError("STATE_BACKEND=redis 需要安装 redis 包")
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def _key(self, namespace, key):
+        return f"{self.prefix}{namespace}:{key}"
+
+    def get(self, namespace, key, default=None):
+        raw = self._client.get(self._key(namespace, key))
+        return default if raw is None else json.loads(raw)
+
+    def set(self, namespace, key, value, ttl=None):
+        ex = max(1, int(ttl + 0.999)) if ttl else None
+        self._client.set(self._key(namespace, key), json.dumps(value, ensure_ascii=False), ex=ex)
+
+    def update(self, namespace, key, fn, default=None, ttl=None):
+        """原子地把值替换为 fn(旧值)，返回新值；WATCH 到并发修改时自动重试。"""
+        name = self._key(namespace, key)
+        ex = max(1, int(ttl + 0.999)) if ttl else None
+        result = {}
+
+        def apply(pipe):
+            raw = pipe.get(name)
+            value = fn(default if raw is None else json.loads(raw))
+            pipe.multi()
+            pipe.set(name, json.dumps(value, ensure_ascii=False), ex=ex)
+            result["value"] = value
+
+        self._client.transaction(apply, name)
+        return result["value"]
+
+    def delete(self, namespace, key):
+        self._client.delete(self._key(namespace, key))
+
+    def items(self, namespace):
+        prefix = self._key(namespace, "")
+        keys = list(self._client.scan_iter(match=prefix + "*", count=500))
+        if not keys:
+            return []
+        result = []
+        for raw_key, raw in zip(keys, self._client.mget(keys)):
+            if raw is not None:
+                key = raw_key.decode('utf-8') if isinstance(raw_key, bytes) else raw_key
+                result.append((key[len(prefix):], json.loads(raw)))
+        return result
+
+
+def create_store(backend=None):
+    backend = (backend or os.getenv("STATE_BACKEND") or "memory").strip().lower()
+    if backend == "sqlite":
+        return SQLiteStore(os.getenv("STATE_DB_PATH", DEFAULT_DB_PATH))
+    if backend == "redis":
+        return RedisStore(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    if backend != "memory":
+        print(f"[backend.shared_state] 未知的 STATE_BACKEND: {backend}，使用 memory")
+    return MemoryStore()
+
+
+class RemoteJob:
+    """Read-only view of a job owned by another worker.
+
+    属性来自共享记录；读取 ``status`` 时按间隔重新加载，因此可以直接交给
+    ``stream_job_events`` / ``stream_train_log`` 跟随到任务结束。日志只在所属 worker 的内存中，
+    这里的 ``logs`` 为空。
+    """
+
+    def __init__(self, records, record):
+        self._records = records
+        self._record = record
+        self._loaded_at = time.time()
+        self.id = record["job"]["job_id"]
+        self.logs = []
+
+    @property
+    def status(self):
+        if time.time() - self._loaded_at >= RECORD_REFRESH_INTERVAL:
+            record = self._records.store.get(self._records.namespace, self.id)
+            if record is not None:
+                self._record = record
+            self._loaded_at = time.time()
+        return self._record["job"].get("status")
+
+    def __getattr__(self, name):
+        # 先取任务字段（to_dict 的内容），再取记录附带的字段（owner、data 等）
+        record = self.__dict__.get("_record", {})
+        if name in record.get("job", {}):
+            return record["job"][name]
+        if name in record:
+            return record[name]
+        raise AttributeError(name)
+
+    def to_dict(self):
+        return dict(self._record["job"])
+
+
+class JobRecords:
+    """Publish a scheduler's jobs to the shared store and relay cancels to their owner."""
+
+    def __init__(self, namespace, ttl, store=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.store = store or shared_store
+        self._cancel_namespace = namespace + ":cancel"
+
+    def publish(self, job, **extra):
+        record = {"job": job.to_dict(), "owner": worker_id(), "updated_at": time.time()}
+        record.update(extra)
+        try:
+            self.store.set(self.namespace, job.id, record, ttl=self.ttl)
+        except Exception as exc:
+            # 共享存储暂时不可用时不影响本进程内的任务执行
+            print(f"[backend.shared_state] 发布任务记录失败 {job.id}: {exc}")
+
+    def discard(self, job_id):
+        """删除没能真正接收的任务记录（例如入队失败）。"""
+        try:
+            self.store.delete(self.namespace, job_id)
+        except Exception as exc:
+            print(f"[backend.shared_state] 删除任务记录失败 {job_id}: {exc}")
+
+    def load(self, job_id):
+        record = self.store.get(self.namespace, job_id)
+        return RemoteJob(self, record) if record else None
+
+    def list(self):
+        return [RemoteJob(self, record) for _, record in self.store.items(self.namespace)]
+
+    def request_cancel(self, job_id):
+        """给其他 worker 上的任务打取消标记，返回该任务的视图；任务不存在时返回 None。"""
+        job = self.load(job_id)
+        if job is None:
+            return None
+        self.store.set(self._cancel_namespace, job_id, time.time(), ttl=self.ttl)
+        return job
+
+    def watch(self, active_jobs, cancel, extra=None):
+        """后台线程：检查本进程任务的取消标记并定期刷新记录；只在共享后端下启动。"""
+        if not self.store.shared:
+            return
+        threading.Thread(
+            target=self._watch_loop,
+            args=(active_jobs, cancel, extra),
+            name=f"{self.namespace}-records",
+            daemon=True,
+        ).start()
+
+    def _watch_loop(self, active_jobs, cancel, extra):
+        last_heartbeat = time.time()
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            try:
+                jobs = active_jobs()
+                for job in jobs:
+                    if self.store.get(self._cancel_namespace, job.id) is not None:
+                        self.store.delete(self._cancel_namespace, job.id)
+                        print(f"[backend.shared_state] 收到其他 worker 的取消请求: {job.id}")
+                        cancel(job.id)
+                # 长任务定期刷新记录，续上 TTL 并同步进度
+                if time.time() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    last_heartbeat = time.time()
+                    for job in jobs:
+                        self.publish(job, **(extra(job) if extra else {}))
+            except Exception as exc:
+                print(f"[backend.shared_state] 检查任务记录失败: {exc}")
+
+
+@contextmanager
+def device_slot(name, limit, should_abort=None, poll_interval=0.5):
+    """在同一台机器的所有 worker 之间占用 name 的一个并发槽位（共 limit 个）。
+
+    用文件锁实现，进程退出时锁自动释放。等待期间 ``should_abort()`` 为真时放弃，
+    产出 False；拿到槽位时产出 True。
+    """
+    if fcntl is None or limit <= 0:
+        yield True
+        return
+    lock_dir = os.getenv("STATE_LOCK_DIR", DEFAULT_LOCK_DIR)
+    os.makedirs(lock_dir, exist_ok=True)
+    handle = None
+    while handle is None:
+        for slot in range(limit):
+            f = open(os.path.join(lock_dir, f"{name}.{slot}.lock"), 'a')
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                continue
+            handle = f
+            break
+        if handle is None:
+            if should_abort is not None and should_abort():
+                yield False
+                return
+            time.sleep(poll_interval)
+    try:
+        yield True
+    finally:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        handle.close()
+
+
+shared_store = create_store()
@@ -0,0 +1,478 @@
+"""流式语音输入：边说边上传 PCM 分块，VAD 切掉静音并判断一句话何时结束，识别随即开始。
+
+* VAD 默认按帧能量判断（噪声底噪自适应），安装了 ``webrtcvad`` 时可用 ``VAD_ENGINE=webrtc``；
+* 说话过程中每积累 ``ASR_PARTIAL_SECONDS`` 秒新语音，就在后台对当前片段做一次识别，得到部分结果；
+* 静音超过 ``VAD_END_SILENCE_MS`` 视为一句话结束，去掉首尾静音后立即做最终识别，
+  不必等用户停止录音、上传完整文件；
+* 识别引擎可插拔，``ASR_ENGINE`` 选择已注册的引擎（默认 google，离线可用 sphinx，
+  ``stub`` 为本地替身），``audio_to_text`` 也使用同一个引擎。
+
+共享后端（``STATE_BACKEND=sqlite/redis``）下，每个分块和已完成句子的识别结果写入共享存储，
+分块落到其他 worker 时按顺序重放 PCM 重建 VAD 状态（已有结果的句子不再识别），
+之后由该 worker 继续处理。
+"""
+import array
+import base64
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import speech_recognition as sr
+
+from backend.audio_ingest import TARGET_RATE, SAMPLE_WIDTH
+from backend.shared_state import shared_store
+from backend.tracing import span
+
+try:
+    import numpy as np
+except ImportError:  # 没有 numpy 时逐个采样计算能量
+    np = None
+
+try:
+    import webrtcvad
+except ImportError:  # 只有 VAD_ENGINE=webrtc 时才需要
+    webrtcvad = None
+
+
+DEFAULT_LANG = "zh-CN"
+FRAME_MS = 30
+# 连续这么多帧有声才算开始说话，避免咳嗽、按键声触发
+START_FRAMES = 3
+# 句首保留的静音（毫秒），识别引擎需要一点起始上下文
+PADDING_MS = 300
+END_SILENCE_MS = int(os.getenv("VAD_END_SILENCE_MS", 700))
+MAX_UTTERANCE_SECONDS = float(os.getenv("VAD_MAX_UTTERANCE_SECONDS", 30))
+PARTIAL_SECONDS = float(os.getenv("ASR_PARTIAL_SECONDS", 1.0))
+# 分块请求等待本块内结束的那句话识别完成的最长时间（秒）
+FINAL_WAIT_SECONDS = float(os.getenv("ASR_FINAL_WAIT_SECONDS", 10))
+# 闲置超过该时间（秒）的流会被清理
+STREAM_TTL = 120
+# 共享存储中分块的保留时间（秒）；流关闭时删除，这里只兜底清理被放弃的流
+CHUNK_TTL = 3600
+STREAM_NAMESPACE = "speech_streams"
+CHUNK_NAMESPACE = "speech_stream_chunks"
+MAX_WORKERS = int(os.getenv("ASR_MAX_WORKERS", 4))
+
+
+class RecognizerError(RuntimeError):
+    """Raised when a recognition engine fails (as opposed to hearing nothing)."""
+
+
+def _google_engine(pcm, sample_rate, lang):
+    try:
+        return sr.Recognizer().recognize_google(sr.AudioData(pcm, sample_rate, SAMPLE_WIDTH), language=lang)
+    except sr.UnknownValueError:
+        return ""
+    except sr.RequestError as exc:
+        raise RecognizerError(f"语音识别服务错误: {exc}")
+
+
+def _sphinx_engine(pcm, sample_rate, lang):
+    """离线引擎：CMU Sphinx，需要安装 pocketsphinx 及对应语言模型。"""
+    try:
+        return sr.Recognizer().recognize_sphinx(sr.AudioData(pcm, sample_rate, SAMPLE_WIDTH), language=lang)
+    except sr.UnknownValueError:
+        return ""
+    except sr.RequestError as exc:
+        raise RecognizerError(f"离线识别不可用: {exc}")
+
+
+def _stub_engine(pcm, sample_rate, lang):
+    """本地替身：不识别内容，返回 ``ASR_STUB_TEXT`` 或语音时长描述。"""
+    duration = len(pcm) / float(SAMPLE_WIDTH * sample_rate)
+    return os.getenv("ASR_STUB_TEXT") or f"语音 {duration:.1f} 秒"
+
+
+# 引擎名 -> recognize(pcm_bytes, sample_rate, lang) -> text，听不清时返回空字符串
+RECOGNIZERS = {
+    "google": _google_engine,
+    "sphinx": _sphinx_engine,
+    "stub": _stub_engine,
+}
+
+
+def register_recognizer(name, recognize):
+    """注册自定义引擎：recognize(pcm_bytes, sample_rate, lang) -> text。"""
+    RECOGNIZERS[name] = recognize
+
+
+def recognize(pcm, sample_rate=TARGET_RATE, lang=DEFAULT_LANG, engine=None):
+    """用 ``ASR_ENGINE`` 指定的引擎识别 16 bit 单声道 PCM。"""
+    engine = engine or os.getenv("ASR_ENGINE", "google")
+    recognize_fn = RECOGNIZERS.get(engine)
+    if recognize_fn is None:
+        raise RecognizerError(f"未知的识别引擎: {engine}")
+    return recognize_fn(pcm, sample_rate, lang) or ""
+
+
+def frame_rms(frame):
+    if np is not None:
+        samples = np.frombuffer(frame, dtype='<i2').astype(np.float64)
+        return float(np.sqrt(np.mean(samples * samples))) if len(samples) else 0.0
+    samples = array.array('h', frame)
+    return math.sqrt(sum(s * s for s in samples) / len(samples)) if samples else 0.0
+
+
+class EnergyVad:
+    """Frame-energy voice detector with an adaptive noise floor.
+
+    底噪只在判为静音的帧上更新，门限为底噪的 ``ratio`` 倍且不低于 ``min_rms``。
+    """
+
+    # 支持的采样率，None 表示不限
+    sample_rates = None
+
+    def __init__(self, ratio=3.0, min_rms=300.0):
+        self.ratio = ratio
+        self.min_rms = min_rms
+        self.noise_floor = None
+
+    def is_speech(self, frame, sample_rate):
+        rms = frame_rms(frame)
+        if self.noise_floor is None:
+            self.noise_floor = rms
+        voiced = rms > max(self.min_rms, self.noise_floor * self.ratio)
+        if not voiced:
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * rms
+        return voiced
+
+
+class WebrtcVad:
+    sample_rates = (8000, 16000, 32000, 48000)
+
+    def __init__(self, mode=2):
+        if webrtcvad is None:
+            raise RuntimeError("VAD_ENGINE=webrtc 需要安装 webrtcvad 包")
+        self._vad = webrtcvad.Vad(mode)
+
+    def is_speech(self, frame, sample_rate):
+        return self._vad.is_speech(frame, sample_rate)
+
+
+def create_vad():
+    if os.getenv("VAD_ENGINE", "energy") == "webrtc":
+        return WebrtcVad(int(os.getenv("VAD_WEBRTC_MODE", 2)))
+    return EnergyVad()
+
+
+class Utterance:
+    def __init__(self, index, start):
+        self.index = index
+        self.start = start
+        self.end = None
+        self.text = None
+        self.error = None
+        self.asr_seconds = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            "index": self.index,
+            "start": round(self.start, 3),
+            "end": round(self.end, 3) if self.end is not None else None,
+            "text": self.text,
+            "error": self.error,
+            "asr_seconds": self.asr_seconds,
+        }
+
+
+class SpeechStream:
+    """One live microphone stream: VAD segmentation plus partial and final recognition.
+
+    ``feed(pcm)`` 接收任意长度的 16 bit 单声道 PCM，按 ``FRAME_MS`` 切帧；
+    ``recognize`` 为 ``recognize(pcm, sample_rate, lang)`` 形式的可调用对象，测试时可替换。
+    """
+
+    def __init__(self, sample_rate=TARGET_RATE, lang=DEFAULT_LANG, recognize_fn=None, vad=None, executor=None,
+                 stream_id=None):
+        if sample_rate <= 0:
+            raise ValueError(f"无效的采样率: {sample_rate}")
+        self.id = stream_id or uuid.uuid4().hex
+        self.sample_rate = sample_rate
+        self.lang = lang
+        self.recognize_fn = recognize_fn or recognize
+        self.vad = vad or create_vad()
+        rates = getattr(self.vad, "sample_rates", None)
+        if rates and sample_rate not in rates:
+            raise ValueError(f"VAD 不支持采样率 {sample_rate}（可选: {', '.join(map(str, rates))}）")
+        self.executor = executor or _executor
+        self.frame_bytes = sample_rate * FRAME_MS // 1000 * SAMPLE_WIDTH
+        self.lock = threading.Lock()
+        self.last_access = time.time()
+        self.partial = ""
+        self.utterances = []
+        self._pending = b""
+        self._frames_seen = 0
+        self._preroll = deque(maxlen=max(1, PADDING_MS // FRAME_MS))
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._current = None
+        self._speech = bytearray()
+        self._partial_at = 0
+        self._partial_busy = False
+        self._reported = 0
+        # 已送入的分块数，与共享记录比较判断本地状态是否落后
+        self.seq = 0
+        # 重放期间：句子序号 -> 已有的识别结果
+        self._restored = None
+
+    @property
+    def in_speech(self):
+        return self._current is not None
+
+    def _seconds(self, frames):
+        return frames * FRAME_MS / 1000.0
+
+    def feed(self, pcm):
+        """处理一段 PCM，返回本段内结束的句子（最终识别已在后台开始）。"""
+        self.last_access = time.time()
+        data = self._pending + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self._pending = data[usable:]
+        ended = []
+        for offset in range(0, usable, self.frame_bytes):
+            utterance = self._process_frame(data[offset:offset + self.frame_bytes])
+            if utterance is not None:
+                ended.append(utterance)
+        if self.in_speech and self._restored is None:
+            self._maybe_partial()
+        return ended
+
+    def replay(self, chunks, results, reported):
+        """按顺序重放之前的分块重建状态；results 中已有结果的句子直接套用，其余重新识别。"""
+        self._restored = {int(index): result for index, result in results.items()}
+        try:
+            for pcm in chunks:
+                self.feed(pcm)
+        finally:
+            self._restored = None
+        self.seq = len(chunks)
+        self._reported = min(reported, len(self.utterances))
+
+    def results(self):
+        """已完成句子的识别结果，写入共享记录。"""
+        return {
+            str(u.index): {"text": u.text, "error": u.error, "asr_seconds": u.asr_seconds}
+            for u in self.utterances if u.done.is_set()
+        }
+
+    def flush(self):
+        """流结束：当前正在说的句子立即收尾。"""
+        if self._current is None:
+            return []
+        return [self._end_utterance(trailing_silence=self._silent_run)]
+
+    def _process_frame(self, frame):
+        self._frames_seen += 1
+        voiced = self.vad.is_speech(frame, self.sample_rate)
+        if self._current is None:
+            self._preroll.append(frame)
+            self._voiced_run = self._voiced_run + 1 if voiced else 0
+            if self._voiced_run >= START_FRAMES:
+                start_frame = self._frames_seen - len(self._preroll)
+                self._current = Utterance(len(self.utterances), self._seconds(start_frame))
+                self._speech = bytearray(b"".join(self._preroll))
+                self._preroll.clear()
+                self._silent_run = 0
+                self._partial_at = 0
+            return None
+
+        self._speech += frame
+        self._silent_run = 0 if voiced else self._silent_run + 1
+        if self._silent_run * FRAME_MS >= END_SILENCE_MS:
+            return self._end_utterance(trailing_silence=self._silent_run)
+        if len(self._speech) >= MAX_UTTERANCE_SECONDS * self.sample_rate * SAMPLE_WIDTH:
+            return self._end_utterance(trailing_silence=self._silent_run)
+        return None
+
+    def _end_utterance(self, trailing_silence):
+        utterance = self._current
+        # 尾部静音只保留与句首相同的长度
+        keep_silence = min(trailing_silence, PADDING_MS // FRAME_MS)
+        trim = (trailing_silence - keep_silence) * self.frame_bytes
+        speech = bytes(self._speech[:len(self._speech) - trim] if trim else self._speech)
+        utterance.end = utterance.start + len(speech) / float(self.sample_rate * SAMPLE_WIDTH)
+        self.utterances.append(utterance)
+        self._current = None
+        self._speech = bytearray()
+        self._voiced_run = 0
+        self._silent_run = 0
+        self.partial = ""
+        restored = self._restored.get(utterance.index) if self._restored is not None else None
+        if restored is not None:
+            utterance.text = restored["text"]
+            utterance.error = restored["error"]
+            utterance.asr_seconds = restored["asr_seconds"]
+            utterance.done.set()
+        else:
+            self.executor.submit(self._final, utterance, speech)
+        return utterance
+
+    def _final(self, utterance, speech):
+        started = time.time()
+        try:
+            with span("asr_stream"):
+                utterance.text = self.recognize_fn(speech, self.sample_rate, self.lang)
+        except Exception as exc:
+            utterance.error = str(exc)
+            print(f"[backend.speech_stream] 识别失败 {self.id}#{utterance.index}: {exc}")
+        finally:
+            utterance.asr_seconds = round(time.time() - started, 3)
+            utterance.done.set()
+
+    def _maybe_partial(self):
+        # 同一时间只跑一个部分识别，跟不上时跳过而不是排队
+        new_bytes = len(self._speech) - self._partial_at
+        if self._partial_busy or new_bytes < PARTIAL_SECONDS * self.sample_rate * SAMPLE_WIDTH:
+            return
+        self._partial_busy = True
+        self._partial_at = len(self._speech)
+        index = self._current.index
+        self.executor.submit(self._run_partial, index, bytes(self._speech))
+
+    def _run_partial(self, index, speech):
+        try:
+            text = self.recognize_fn(speech, self.sample_rate, self.lang)
+            # 句子已经结束时丢弃过时的部分结果
+            if self._current is not None and self._current.index == index:
+                self.partial = text
+        except Exception as exc:
+            print(f"[backend.speech_stream] 部分识别失败 {self.id}: {exc}")
+        finally:
+            self._partial_busy = False
+
+    def take_finished(self):
+        """返回上次调用之后识别完成的句子（按顺序，遇到未完成的句子即停止）。"""
+        finished = []
+        while self._reported < len(self.utterances) and self.utterances[self._reported].done.is_set():
+            finished.append(self.utterances[self._reported])
+            self._reported += 1
+        return finished
+
+    def state(self):
+        return {
+            "stream_id": self.id,
+            "speech": self.in_speech,
+            "partial": self.partial,
+            "utterances": [u.to_dict() for u in self.take_finished()],
+        }
+
+
+class SpeechStreamManager:
+    def __init__(self, ttl=STREAM_TTL, store=None):
+        self.ttl = ttl
+        self.store = store or shared_store
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def create(self, sample_rate=TARGET_RATE, lang=DEFAULT_LANG):
+        stream = SpeechStream(sample_rate, lang)
+        with self._lock:
+            self._prune_locked()
+            self._streams[stream.id] = stream
+        self._save(stream)
+        return stream
+
+    def get(self, stream_id):
+        """本进程中的流；共享后端下本地没有或落后于共享记录时，从记录重建。"""
+        with self._lock:
+            stream = self._streams.get(stream_id)
+        if not self.store.shared:
+            return stream
+        record = self.store.get(STREAM_NAMESPACE, stream_id)
+        if record is None:
+            # 流已关闭或过期
+            with self._lock:
+                self._streams.pop(stream_id, None)
+            return None
+        if stream is not None and stream.seq == record["seq"]:
+            return stream
+        stream = self._restore(stream_id, record)
+        if stream is not None:
+            with self._lock:
+                self._streams[stream_id] = stream
+        return stream
+
+    def feed(self, stream, pcm, wait=FINAL_WAIT_SECONDS):
+        """送入一段 PCM；本段内有句子结束时，等待其最终识别完成后再返回状态。"""
+        with stream.lock:
+            ended = stream.feed(pcm)
+            self._save_chunk(stream, pcm)
+        _wait_for(ended, wait)
+        with stream.lock:
+            state = stream.state()
+            self._save(stream)
+            return state
+
+    def close(self, stream_id, wait=FINAL_WAIT_SECONDS):
+        stream = self.get(stream_id)
+        with self._lock:
+            self._streams.pop(stream_id, None)
+        if stream is None:
+            return None
+        with stream.lock:
+            stream.flush()
+        _wait_for(stream.utterances, wait)
+        with stream.lock:
+            state = stream.state()
+        self._discard(stream)
+        return state
+
+    def _save(self, stream):
+        if not self.store.shared:
+            return
+        record = {
+            "sample_rate": stream.sample_rate,
+            "lang": stream.lang,
+            "seq": stream.seq,
+            "reported": stream._reported,
+            "results": stream.results(),
+        }
+        self.store.set(STREAM_NAMESPACE, stream.id, record, ttl=self.ttl)
+
+    def _save_chunk(self, stream, pcm):
+        if self.store.shared:
+            encoded = base64.b64encode(pcm).decode('ascii')
+            self.store.set(CHUNK_NAMESPACE, f"{stream.id}:{stream.seq}", encoded, ttl=CHUNK_TTL)
+        stream.seq += 1
+
+    def _restore(self, stream_id, record):
+        chunks = []
+        for seq in range(record["seq"]):
+            encoded = self.store.get(CHUNK_NAMESPACE, f"{stream_id}:{seq}")
+            if encoded is None:
+                print(f"[backend.speech_stream] 分块 {stream_id}:{seq} 已丢失，无法恢复流")
+                return None
+            chunks.append(base64.b64decode(encoded))
+        stream = SpeechStream(record["sample_rate"], record["lang"], stream_id=stream_id)
+        with stream.lock:
+            stream.replay(chunks, record["results"], record["reported"])
+        print(f"[backend.speech_stream] 从共享记录恢复流 {stream_id}（{len(chunks)} 个分块）")
+        return stream
+
+    def _discard(self, stream):
+        if not self.store.shared:
+            return
+        self.store.delete(STREAM_NAMESPACE, stream.id)
+        for seq in range(stream.seq):
+            self.store.delete(CHUNK_NAMESPACE, f"{stream.id}:{seq}")
+
+    def _prune_locked(self):
+        now = time.time()
+        expired = [sid for sid, s in self._streams.items() if now - s.last_access > self.ttl]
+        for sid in expired:
+            del self._streams[sid]
+
+
+def _wait_for(utterances, timeout):
+    deadline = time.time() + timeout
+    for utterance in utterances:
+        utterance.done.wait(max(0.0, deadline - time.time()))
+
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="asr-stream")
+speech_streams = SpeechStreamManager()
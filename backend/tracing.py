@@ -0,0 +1,158 @@
+"""轻量级阶段计时：span 记录耗时到直方图，/metrics 以 Prometheus 文本格式导出。
+
+* ``with span("asr"):`` 或 ``@traced("asr")`` 计时一个阶段；
+* 每个 HTTP 请求有一个 request id（``X-Request-Id``），请求内的 span 会带上它，
+  请求带 ``?timing=1`` 或 ``X-Timing: 1`` 时，JSON 响应里附上各阶段耗时；
+* ``TRACING=0`` 关闭，此时 span 是一个共享的空上下文管理器，几乎没有开销。
+"""
+import contextvars
+import functools
+import os
+import threading
+import time
+import uuid
+
+
+ENABLED = os.getenv("TRACING", "1") != "0"
+# 超过这个时间（秒）的阶段会打印一行日志，便于对照 request id 排查
+SLOW_SPAN_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", 5))
+# 覆盖从毫秒级的格式转换到数十分钟的训练
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800, 7200)
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+            for labels, (counts, total, count) in items:
+                base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+                prefix = base + "," if base else ""
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{base}}} {total:.6f}")
+                lines.append(f"{self.name}_count{{{base}}} {count}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+stage_duration = Histogram(
+    "tfg_stage_duration_seconds", "Duration of pipeline stages.", ("stage", "status")
+)
+http_duration = Histogram(
+    "tfg_http_request_duration_seconds", "Duration of HTTP requests.", ("endpoint", "method", "code")
+)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("name", "started", "duration")
+
+    def __init__(self, name):
+        self.name = name
+        self.started = None
+        self.duration = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.started
+        status = "error" if exc_type is not None else "ok"
+        stage_duration.observe((self.name, status), self.duration)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((self.name, self.duration))
+        if self.duration >= SLOW_SPAN_SECONDS:
+            print(f"[backend.tracing] 慢阶段 {self.name}: {self.duration:.2f}s (request {_request_id.get()})")
+        return False
+
+
+def span(name):
+    """计时一个阶段；关闭追踪时返回共享的空上下文管理器。"""
+    if not ENABLED:
+        return _NOOP_SPAN
+    return Span(name)
+
+
+def traced(name):
+    """把整个函数调用记为一个 span 的装饰器。"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def begin_request(request_id=None):
+    """在请求开始时调用，返回 request id；之后本线程上的 span 都会归到这个请求。"""
+    # 沿用上游传入的 id（截断，避免异常长的头部），没有时生成一个
+    request_id = (request_id or "")[:64] or uuid.uuid4().hex[:16]
+    _request_id.set(request_id)
+    _request_spans.set([] if ENABLED else None)
+    return request_id
+
+
+def end_request():
+    """返回本请求的 [(stage, seconds)] 并清空上下文。"""
+    spans = _request_spans.get() or []
+    _request_id.set(None)
+    _request_spans.set(None)
+    return spans
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def observe_request(endpoint, method, code, seconds):
+    if ENABLED:
+        http_duration.observe((endpoint or "unknown", method, str(code)), seconds)
+
+
+def render_metrics():
+    return "\n".join([stage_duration.render(), http_duration.render()]) + "\n"
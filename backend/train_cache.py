@@ -0,0 +1,171 @@
+"""增量训练：视频预处理结果按内容复用，再次训练从已有模型的 checkpoint 继续。
+
+SyncTalk 训练的前半段是视频预处理（抽帧、人脸关键点、语义分割、背景/躯干图像），
+同一段视频每次训练都会重做一遍；只改 epoch 数重新训练时也要从头训练。这里把两者拆开：
+
+* 预处理作为单独的阶段（``TRAIN_PREPROCESS_CMD``，可用 ``{video_path}`` ``{data_dir}`` ``{gpu}``），
+  输出到 ``static/train_data/<视频 sha256>/``，出现 ``TRAIN_PREPROCESS_MARKER``
+  （默认 ``transforms_train.json``，预处理最后一步的产物）即视为完成，之后的训练直接复用；
+* ``train_mode=incremental`` 时，同一视频已有训练到 M 个 epoch 的模型，训练 N (> M) 个 epoch 会加上
+  ``--resume_from <checkpoint> --start_epoch M``，只训练新增的 N - M 个 epoch。``run_synctalk.sh``
+  还不支持这两个参数，默认的训练方式因此是 ``scratch``；
+* 训练成功后在模型目录写入 ``train_meta.json``（视频哈希、已训练 epoch 数），
+  只有哈希一致的模型才能作为续训起点。没有该文件的模型（旧模型、其他任务正在训练的目录）
+  无法确认来自同一段视频，不会被使用。
+
+预处理缓存需要 SyncTalk 支持 ``preprocess`` 子命令和 ``--data_dir/--skip_preprocess``，与增量训练一样默认关闭，
+``TRAIN_PREPROCESS_CACHE=1`` 开启；预处理阶段失败时退回原来的训练命令（由 SyncTalk 自己预处理）。
+"""
+import json
+import os
+import shlex
+import threading
+from pathlib import Path
+
+from backend.model_registry import model_registry
+from backend.result_cache import file_sha256
+from backend.shared_state import device_slot
+from backend.tracing import span
+from backend.upload_store import upload_store
+
+
+PREPROCESS_ROOT = os.path.join("static", "train_data")
+DEFAULT_PREPROCESS_CMD = (
+    "./SyncTalk/run_synctalk.sh preprocess --video_path {video_path} --data_dir {data_dir} --gpu {gpu}"
+)
+DEFAULT_PREPROCESS_MARKER = "transforms_train.json"
+META_NAME = "train_meta.json"
+
+TRAIN_MODE_INCREMENTAL = "incremental"
+TRAIN_MODE_SCRATCH = "scratch"
+TRAIN_MODES = (TRAIN_MODE_INCREMENTAL, TRAIN_MODE_SCRATCH)
+# SyncTalk 的训练脚本支持 --resume_from / --start_epoch 之前，增量训练需要显式选择
+DEFAULT_TRAIN_MODE = TRAIN_MODE_SCRATCH
+
+
+def preprocess_enabled():
+    return os.getenv("TRAIN_PREPROCESS_CACHE", "0") == "1"
+
+
+class PreprocessCache:
+    """Per-video preprocessing output, keyed by the video's content hash."""
+
+    def __init__(self, root=PREPROCESS_ROOT, cmd_template=None, marker=None):
+        self.root = root
+        self.cmd_template = cmd_template or os.getenv("TRAIN_PREPROCESS_CMD", DEFAULT_PREPROCESS_CMD)
+        self.marker = marker or os.getenv("TRAIN_PREPROCESS_MARKER", DEFAULT_PREPROCESS_MARKER)
+        self._lock = threading.Lock()
+        # (路径, 大小, mtime) -> 内容哈希，训练视频可能有数 GB，不重复读取
+        self._hashes = {}
+
+    def key_for(self, video_path):
+        # 上传存储中的文件已经按内容哈希存放，不必再读一遍
+        digest = upload_store.sha_of(video_path)
+        if digest is not None:
+            return digest
+        stat = os.stat(video_path)
+        ident = (os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._hashes.get(ident)
+        if digest is None:
+            with span("video_hash"):
+                digest = file_sha256(video_path)
+            with self._lock:
+                self._hashes[ident] = digest
+        return digest
+
+    def data_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def ready(self, key):
+        return os.path.isfile(os.path.join(self.data_dir(key), self.marker))
+
+    def command(self, video_path, key, gpu):
+        return [
+            part.format(video_path=video_path, data_dir=self.data_dir(key), gpu=gpu)
+            for part in shlex.split(self.cmd_template)
+        ]
+
+    def ensure(self, video_path, key, gpu, run_step, should_abort=None):
+        """返回预处理完成的数据目录；需要时用 run_step(cmd) 执行预处理，失败或取消时返回 None。
+
+        同一段视频同时只有一个 worker 在预处理，其他任务等它完成后直接复用。
+        """
+        if self.ready(key):
+            print(f"[backend.train_cache] 复用预处理结果: {self.data_dir(key)}")
+            return self.data_dir(key)
+        with device_slot(f"preprocess-{key[:16]}", 1, should_abort) as acquired:
+            if not acquired:
+                return None
+            if self.ready(key):
+                return self.data_dir(key)
+            os.makedirs(self.data_dir(key), exist_ok=True)
+            cmd = self.command(video_path, key, gpu)
+            print(f"[backend.train_cache] 预处理训练视频: {' '.join(cmd)}")
+            try:
+                with span("train_preprocess"):
+                    return_code = run_step(cmd)
+            except OSError as exc:
+                print(f"[backend.train_cache] 无法执行预处理: {exc}")
+                return None
+            if return_code != 0 or not self.ready(key):
+                print(f"[backend.train_cache] 预处理失败，退出码 {return_code}: {video_path}")
+                return None
+            return self.data_dir(key)
+
+
+class BaseCheckpoint:
+    """A checkpoint of an earlier model of the same video to continue training from."""
+
+    def __init__(self, model_dir, checkpoint, epoch):
+        self.model_dir = model_dir
+        self.checkpoint = checkpoint
+        self.epoch = epoch
+
+
+def read_meta(model_dir):
+    try:
+        with open(os.path.join(model_dir, META_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(model_dir, **meta):
+    if not os.path.isdir(model_dir):
+        return
+    path = os.path.join(model_dir, META_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def trained_epochs(entry, video_key):
+    """模型已经训练到的 epoch 数；模型不是由这段视频训练的或无法判断时返回 None。"""
+    # 没有 train_meta.json 的目录可能是同名的其他视频训练的，也可能正在被其他任务训练（训练开始时删除、
+    # 成功后才写入），都不能作为续训起点
+    meta = read_meta(entry.path)
+    if meta is None or meta.get("video_sha256") != video_key:
+        return None
+    return meta.get("trained_epochs")
+
+
+def find_base_checkpoint(video_path, video_key, epochs):
+    """同一视频已训练模型中 epoch 数最多（但少于 epochs）的 checkpoint；没有时返回 None。"""
+    video_name = Path(video_path).stem
+    best = None
+    # 前一个任务刚训练完的模型也要能找到
+    model_registry.refresh(force=True)
+    for entry in model_registry.list():
+        if entry.video_name != video_name or not entry.latest_checkpoint:
+            continue
+        done = trained_epochs(entry, video_key)
+        if not done or done >= epochs:
+            continue
+        if best is None or done > best.epoch:
+            best = BaseCheckpoint(entry.path, entry.latest_checkpoint, done)
+    return best
+
+
+preprocess_cache = PreprocessCache()
@@ -0,0 +1,395 @@
+"""训练任务调度：排队 + 每个 GPU 的训练槽位，日志逐行写盘，解析 epoch/loss 进度，支持取消与续训。
+
+训练总是复用同一视频的预处理结果；默认从头训练（``train_mode=scratch``），``train_mode=incremental``
+从同一视频已有模型的 checkpoint 继续，需要 SyncTalk 的训练脚本支持续训参数，见 ``backend.train_cache``。
+"""
+import os
+import queue
+import re
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+
+from backend.model_trainer import _build_train_cmd, _run_preview, plan_training, record_training, parse_epochs
+from backend.train_cache import TRAIN_MODE_INCREMENTAL, TRAIN_MODES, DEFAULT_TRAIN_MODE
+from backend.device_scheduler import device_scheduler, KIND_TRAIN
+from backend.job_queue import _parse_device_limits
+from backend.shared_state import JobRecords, device_slot
+
+
+# 每个设备同时运行的训练任务数，例如 "GPU0=1,GPU1=1"
+DEFAULT_TRAIN_SLOTS = {"GPU0": 1, "GPU1": 1, "CPU": 1}
+MAX_PENDING_PER_DEVICE = 8
+# 内存中只保留最近的日志行，完整日志在磁盘上
+RECENT_LOG_LINES = 200
+FINISHED_JOB_TTL = 24 * 3600
+
+_EPOCH_RE = re.compile(r"[Ee]poch[\s:=#]*(\d+)(?:\s*/\s*(\d+))?")
+_LOSS_RE = re.compile(r"\bloss\s*[=:]\s*([-+0-9.eE]+)")
+
+TRAIN_QUEUED = "queued"
+TRAIN_RUNNING = "running"
+TRAIN_SUCCEEDED = "succeeded"
+TRAIN_FAILED = "failed"
+TRAIN_CANCELLED = "cancelled"
+TRAIN_FINISHED_STATES = (TRAIN_SUCCEEDED, TRAIN_FAILED, TRAIN_CANCELLED)
+
+
+class TrainQueueFull(RuntimeError):
+    """Raised when a device has too many pending training jobs."""
+
+
+def parse_progress(line):
+    """从一行训练输出中解析 (epoch, total_epochs, loss)，未出现的字段为 None。"""
+    epoch = total = loss = None
+    match = _EPOCH_RE.search(line)
+    if match:
+        epoch = int(match.group(1))
+        total = int(match.group(2)) if match.group(2) else None
+    match = _LOSS_RE.search(line)
+    if match:
+        try:
+            loss = float(match.group(1))
+        except ValueError:
+            pass
+    return epoch, total, loss
+
+
+class TrainJob:
+    def __init__(self, data, ref_video, device, epochs, train_mode, resumed_from=None):
+        self.id = uuid.uuid4().hex
+        self.data = data
+        self.ref_video = ref_video
+        self.device = device
+        self.epochs = epochs
+        self.train_mode = train_mode
+        self.resumed_from = resumed_from
+        # 实际命令在开始执行时由 plan_training 决定（是否复用预处理、从哪个 checkpoint 继续）
+        self.cmd = _build_train_cmd(ref_video, device, epochs)
+        self.start_epoch = None
+        self.base_model = None
+        self.preprocessed = None
+        self.status = TRAIN_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.return_code = None
+        self.error = None
+        self.video_path = None
+        self.epoch = None
+        self.loss = None
+        self.recent_logs = deque(maxlen=RECENT_LOG_LINES)
+        self.log_path = os.path.join("static", "logs", f"train_{int(self.created_at)}_{self.id[:8]}.log")
+        self.process = None
+        self.cancel_requested = False
+        self.device_released = False
+
+    @property
+    def progress(self):
+        if self.epoch is None or not self.epochs:
+            return None
+        return min(1.0, self.epoch / float(self.epochs))
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "device": self.device,
+            "ref_video": self.ref_video,
+            "epochs": self.epochs,
+            "epoch": self.epoch,
+            "loss": self.loss,
+            "progress": self.progress,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "return_code": self.return_code,
+            "error": self.error,
+            "video_path": self.video_path,
+            "log_path": self.log_path,
+            "resumed_from": self.resumed_from,
+            "train_mode": self.train_mode,
+            "start_epoch": self.start_epoch,
+            "base_model": self.base_model,
+            "preprocessed": self.preprocessed,
+        }
+
+
+class TrainScheduler:
+    """Queue training jobs per device and run them in fixed slots off the HTTP threads."""
+
+    def __init__(self, slots=None, max_pending=MAX_PENDING_PER_DEVICE):
+        self.slots = slots or _parse_device_limits(os.getenv("TRAIN_SLOTS"), DEFAULT_TRAIN_SLOTS)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._queues = {}
+        self.records = JobRecords("train_jobs", FINISHED_JOB_TTL)
+        self.records.watch(self._active_jobs, self.cancel, _record_extra)
+        for device, count in self.slots.items():
+            if count <= 0:
+                continue
+            self._queues[device] = queue.Queue(maxsize=max_pending)
+            for i in range(count):
+                threading.Thread(
+                    target=self._worker_loop,
+                    args=(device,),
+                    name=f"train-{device}-{i}",
+                    daemon=True,
+                ).start()
+
+    def submit(self, data, resumed_from=None):
+        if data.get('model_choice') != "SyncTalk":
+            raise ValueError(f"不支持的训练模型: {data.get('model_choice')}")
+        ref_video = data.get('ref_video')
+        if not ref_video or not os.path.isfile(ref_video):
+            raise ValueError(f"训练输入视频不存在: {ref_video}")
+        epochs = parse_epochs(data.get('epoch'))
+        train_mode = data.get('train_mode') or DEFAULT_TRAIN_MODE
+        if train_mode not in TRAIN_MODES:
+            raise ValueError(f"不支持的训练方式: {train_mode}")
+        # auto / multi 由设备调度器按当前训练+推理负载选择设备
+        device = device_scheduler.assign(data.get('gpu_choice'), KIND_TRAIN)
+        if device not in self._queues:
+            device_scheduler.release(device, KIND_TRAIN)
+            raise ValueError(f"设备不可用: {device}")
+
+        job = TrainJob(data, ref_video, device, epochs, train_mode, resumed_from)
+        with self._lock:
+            self._prune_locked()
+            self._jobs[job.id] = job
+        self._publish(job)
+        try:
+            self._queues[device].put_nowait(job)
+        except queue.Full:
+            device_scheduler.release(device, KIND_TRAIN)
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise TrainQueueFull(f"设备 {device} 的训练队列已满，请稍后再试")
+        print(f"[backend.train_scheduler] 训练任务入队: {job.id} -> {device}")
+        return job
+
+    def resume(self, job_id):
+        """以相同参数重新提交已取消或失败的任务，从模型目录中最新的 checkpoint 继续训练。"""
+        job = self.lookup(job_id)
+        if job is None:
+            return None
+        if job.status not in (TRAIN_CANCELLED, TRAIN_FAILED):
+            raise ValueError(f"任务状态为 {job.status}，无法续训")
+        return self.submit(dict(job.data, train_mode=TRAIN_MODE_INCREMENTAL), resumed_from=job.id)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def lookup(self, job_id):
+        """本进程中的任务，或其他 worker 上任务的只读视图。"""
+        return self.get(job_id) or self.records.load(job_id)
+
+    def list(self):
+        """所有 worker 的训练任务，本进程的任务优先用内存中的最新状态。"""
+        with self._lock:
+            jobs = dict(self._jobs)
+        for remote in self.records.list():
+            jobs.setdefault(remote.id, remote)
+        return sorted(jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return self.records.request_cancel(job_id)
+        job.cancel_requested = True
+        if job.status == TRAIN_QUEUED:
+            self._finish(job, TRAIN_CANCELLED)
+        elif job.status == TRAIN_RUNNING and job.process is not None:
+            _kill_process_group(job.process)
+        return job
+
+    def _worker_loop(self, device):
+        q = self._queues[device]
+        while True:
+            job = q.get()
+            try:
+                if job.cancel_requested or job.status != TRAIN_QUEUED:
+                    continue
+                with device_slot(
+                    f"train-{device}", self.slots[device], lambda: job.cancel_requested
+                ) as acquired:
+                    if acquired:
+                        self._run(job)
+            except Exception as exc:
+                job.error = str(exc)
+                self._finish(job, TRAIN_FAILED)
+                print(f"[backend.train_scheduler] 训练任务异常: {job.id}: {exc}")
+            finally:
+                q.task_done()
+
+    def _run(self, job):
+        job.status = TRAIN_RUNNING
+        job.started_at = time.time()
+        self._publish(job)
+        os.makedirs(os.path.dirname(job.log_path), exist_ok=True)
+
+        # 日志逐行写盘并立即 flush，长时间训练不会把输出堆在内存里
+        with open(job.log_path, 'w', encoding='utf-8') as log:
+            plan = self._plan(job, log)
+            if plan.skip:
+                log.write(f"# SKIPPED\n{plan.model_dir} 已训练到 {job.epochs} 个 epoch\n")
+                job.epoch = job.epochs
+                job.return_code = 0
+            elif not job.cancel_requested:
+                print(f"[backend.train_scheduler] 开始训练 {job.id}: {' '.join(job.cmd)}")
+                log.write("# CMD\n" + " ".join(job.cmd) + "\n\n# STDOUT\n")
+                log.flush()
+                job.return_code = self._stream(job, job.cmd, log)
+
+            if job.cancel_requested:
+                log.write("\n# CANCELLED\n")
+            elif job.return_code != 0:
+                log.write(f"\n# ERROR\nReturn code: {job.return_code}\n")
+
+        if job.cancel_requested:
+            self._finish(job, TRAIN_CANCELLED)
+            return
+        if job.return_code != 0:
+            job.error = f"训练失败，退出码: {job.return_code}"
+            self._finish(job, TRAIN_FAILED)
+            return
+
+        if not plan.skip:
+            record_training(plan)
+        job.video_path = _run_preview(job.ref_video, job.epochs, job.device, job.log_path) or job.ref_video
+        self._finish(job, TRAIN_SUCCEEDED)
+
+    def _plan(self, job, log):
+        """执行（或复用）预处理并确定训练命令，预处理输出也写入训练日志。"""
+        def run_step(cmd):
+            log.write("# PREPROCESS CMD\n" + " ".join(cmd) + "\n\n# PREPROCESS STDOUT\n")
+            log.flush()
+            return_code = self._stream(job, cmd, log)
+            log.write("\n")
+            return return_code
+
+        plan = plan_training(
+            job.ref_video, job.epochs, job.device, job.train_mode,
+            run_step=run_step, should_abort=lambda: job.cancel_requested,
+        )
+        job.preprocessed = plan.data_dir is not None
+        if plan.base is not None:
+            job.start_epoch = plan.base.epoch
+            job.base_model = plan.base.model_dir
+            # 进度从已有的 epoch 开始计算
+            job.epoch = plan.base.epoch
+            log.write(f"# RESUME\n从 {plan.base.checkpoint} 继续（已训练 {plan.base.epoch} 个 epoch）\n\n")
+        if plan.cmd is not None:
+            job.cmd = plan.cmd
+        self._publish(job)
+        return plan
+
+    def _stream(self, job, cmd, log):
+        """运行一个子进程，输出逐行写入日志并解析进度，返回退出码；取消时终止整个进程组。"""
+        job.process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            start_new_session=True,
+        )
+        if job.cancel_requested:
+            _kill_process_group(job.process)
+        for raw in job.process.stdout:
+            # tqdm 用 \r 刷新同一行，拆开后逐段记录
+            for line in raw.replace('\r', '\n').splitlines():
+                if not line.strip():
+                    continue
+                log.write(line + "\n")
+                log.flush()
+                job.recent_logs.append(line)
+                epoch, total, loss = parse_progress(line)
+                if epoch is not None:
+                    job.epoch = epoch
+                if loss is not None:
+                    job.loss = loss
+        return_code = job.process.wait()
+        job.process = None
+        return return_code
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        if not job.device_released:
+            job.device_released = True
+            device_scheduler.release(job.device, KIND_TRAIN)
+        self._publish(job)
+        print(f"[backend.train_scheduler] 训练任务结束 {job.id}: {status}")
+
+    def _publish(self, job):
+        self.records.publish(job, **_record_extra(job))
+
+    def _active_jobs(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.status not in TRAIN_FINISHED_STATES]
+
+    def _prune_locked(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.status in TRAIN_FINISHED_STATES and now - job.finished_at > FINISHED_JOB_TTL
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def _record_extra(job):
+    # 续训需要原始参数；最近日志供其他 worker 的状态查询使用
+    return {"data": job.data, "recent_logs": list(job.recent_logs)[-20:]}
+
+
+def stream_train_log(job, offset=0, poll_interval=0.5):
+    """从字节偏移 offset 开始输出训练日志，任务运行期间持续跟随，结束后输出状态标记。"""
+    while not os.path.exists(job.log_path) and job.status == TRAIN_QUEUED:
+        time.sleep(poll_interval)
+
+    if os.path.exists(job.log_path):
+        with open(job.log_path, 'rb') as f:
+            f.seek(offset)
+            pending = b""
+            while True:
+                chunk = f.read(64 * 1024)
+                if chunk:
+                    pending += chunk
+                    # 只输出完整的行，不完整的部分等下次读取
+                    complete, _, pending = pending.rpartition(b"\n")
+                    if complete:
+                        yield (complete + b"\n").decode('utf-8', errors='replace')
+                    continue
+                if job.status in TRAIN_FINISHED_STATES:
+                    # 上次读取与状态变为结束之间写入的内容还没读到，结束前再读到文件末尾
+                    pending += f.read()
+                    if pending:
+                        yield pending.decode('utf-8', errors='replace').rstrip("\n") + "\n"
+                    break
+                time.sleep(poll_interval)
+
+    yield f"__STATUS__ {job.status}\n"
+    if job.status == TRAIN_SUCCEEDED and job.video_path:
+        yield f"__VIDEO_PATH__ {job.video_path}\n"
+    elif job.error:
+        yield f"__ERROR__ {job.error}\n"
+
+
+def _kill_process_group(process, timeout=10):
+    """run_synctalk.sh 会再拉起 docker/python 子进程，按进程组终止。"""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError, OSError) as exc:
+        print(f"[backend.train_scheduler] 终止训练进程失败: {exc}")
+
+
+train_scheduler = TrainScheduler()
@@ -0,0 +1,168 @@
+"""TTS 短语缓存：按 (文本, 音色, 语言, 引擎) 缓存合成结果，磁盘存储 + LRU 淘汰。
+
+引擎可插拔，``TTS_ENGINE`` 选择已注册的引擎（默认 gtts，离线可用 espeak）。
+固定回复（如大模型不可用时的兜底语句）在启动时预先合成，之后命中缓存不再耗时。
+"""
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+
+from gtts import gTTS
+
+from backend.file_publish import publish_file
+
+
+CACHE_DIR = os.path.join("static", "tts_cache")
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_LANG = "zh"
+DEFAULT_VOICE = "default"
+
+
+def _gtts_engine(text, voice, lang, output_path):
+    # gTTS 没有音色概念，voice 用作 tld（口音），default 时使用 gTTS 默认值
+    kwargs = {} if voice == DEFAULT_VOICE else {"tld": voice}
+    gTTS(text=text, lang=lang, **kwargs).save(output_path)
+    return output_path
+
+
+def _espeak_engine(text, voice, lang, output_path):
+    """离线引擎：调用本地 espeak-ng / espeak 生成 wav。"""
+    binary = shutil.which("espeak-ng") or shutil.which("espeak")
+    if not binary:
+        raise RuntimeError("未找到 espeak-ng/espeak")
+    voice_name = lang if voice == DEFAULT_VOICE else voice
+    subprocess.run(
+        [binary, "-v", voice_name, "-w", output_path, text],
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    return output_path
+
+
+# 引擎名 -> (合成函数, 输出扩展名)
+ENGINES = {
+    "gtts": (_gtts_engine, ".mp3"),
+    "espeak": (_espeak_engine, ".wav"),
+}
+
+
+def register_engine(name, synthesize, ext=".wav"):
+    """注册自定义引擎：synthesize(text, voice, lang, output_path) -> output_path。"""
+    ENGINES[name] = (synthesize, ext)
+
+
+class TTSCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=None, engine=None):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries or int(os.getenv("TTS_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        self.engine = engine or os.getenv("TTS_ENGINE", "gtts")
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._load()
+
+    def _key(self, text, voice, lang):
+        raw = f"{self.engine}\0{voice}\0{lang}\0{text}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def synthesize(self, text, output_path=None, voice=DEFAULT_VOICE, lang=DEFAULT_LANG):
+        """返回合成音频路径；output_path 给定时把缓存文件链接/复制过去。"""
+        text = (text or "").strip()
+        if not text:
+            return None
+        synthesize_fn, ext = ENGINES[self.engine]
+        key = self._key(text, voice, lang)
+        cached_path = os.path.join(self.cache_dir, key + ext)
+
+        # 同一短语并发请求时只合成一次；锁按引用计数保留到最后一个使用者离开，
+        # 否则等待旧锁的请求与新到的请求会各自拿到一把锁、重复合成
+        with self._lock:
+            key_lock = self._key_locks.get(key)
+            if key_lock is None:
+                key_lock = self._key_locks[key] = [threading.Lock(), 0]
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                with self._lock:
+                    hit = key in self._entries and os.path.isfile(cached_path)
+                    if hit:
+                        self.hits += 1
+                        self._entries.move_to_end(key)
+                        os.utime(cached_path)
+                    else:
+                        self.misses += 1
+                if not hit:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    tmp_path = f"{cached_path}.{threading.get_ident()}.tmp{ext}"
+                    synthesize_fn(text, voice, lang, tmp_path)
+                    os.replace(tmp_path, cached_path)
+                    with self._lock:
+                        self._entries[key] = cached_path
+                        self._evict_locked()
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if key_lock[1] == 0:
+                    del self._key_locks[key]
+
+        if output_path is None:
+            return cached_path
+        _link_or_copy(cached_path, output_path)
+        return output_path
+
+    def presynthesize(self, phrases, voice=DEFAULT_VOICE, lang=DEFAULT_LANG):
+        """预先合成固定短语；失败只记录日志，不影响启动。"""
+        done = 0
+        for phrase in phrases:
+            try:
+                self.synthesize(phrase, voice=voice, lang=lang)
+                done += 1
+            except Exception as exc:
+                print(f"[backend.tts_cache] 预合成失败: {phrase}: {exc}")
+        print(f"[backend.tts_cache] 预合成完成: {done}/{len(phrases)}")
+        return done
+
+    def stats(self):
+        with self._lock:
+            return {
+                "engine": self.engine,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _evict_locked(self):
+        while len(self._entries) > self.max_entries:
+            _, path = self._entries.popitem(last=False)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _load(self):
+        """按文件修改时间恢复 LRU 顺序，进程重启后缓存仍然有效。"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            name, ext = os.path.splitext(entry.name)
+            if entry.is_file() and len(name) == 64 and ".tmp" not in entry.name:
+                files.append((entry.stat().st_mtime, name, entry.path))
+        for _, key, path in sorted(files):
+            self._entries[key] = path
+        self._evict_locked()
+
+
+def _link_or_copy(src, dst):
+    # 缓存文件只会被整体替换（os.replace），不会原地改写，硬链接是安全的
+    publish_file(src, dst, ("link", "reflink", "copy"))
+
+
+tts_cache = TTSCache()
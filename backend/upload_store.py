@@ -0,0 +1,487 @@
+"""上传文件的内容寻址存储：边写边算哈希，相同内容只保存一份，支持断点续传和垃圾回收。
+
+* 每份内容一个目录 ``static/uploads/blobs/<sha[:2]>/<sha256>/``，里面是 ``<sha[:8]>_<文件名>``；
+  同一内容换个文件名再上传时只新增一个硬链接。SyncTalk 的输出和训练出的模型目录按文件名命名，
+  带上哈希前缀后不同内容的同名文件不会互相覆盖；
+* 小文件随表单一次上传（``ingest``），大文件（训练视频可达数 GB）走分块上传：
+  ``begin`` → 多次 ``append``（按偏移量续传）→ ``complete``，会话记录在共享存储中，
+  已传部分保存在 ``static/uploads/partial``；开始时带上 sha256 且内容已存在的话直接完成；
+* 音频转换结果（16 kHz WAV）也保存在内容目录中，同一段音频只转换一次；
+* 超过 ``UPLOAD_RETENTION_HOURS`` 未被使用、也没有未完成任务引用的内容会被清理，
+  总大小超过 ``UPLOAD_MAX_BYTES`` 时按最近使用时间淘汰。请求每次用到某个内容时 ``touch``
+  刷新其使用时间，同步渲染等不经过任务队列的处理用 ``using`` 在处理期间登记引用。
+"""
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from werkzeug.utils import secure_filename
+
+from backend.audio_ingest import is_target_wav, load_pcm
+from backend.file_publish import publish_file
+from backend.shared_state import shared_store
+
+
+UPLOAD_ROOT = os.path.join("static", "uploads")
+AUDIO_EXTS = {'.wav', '.mp3', '.m4a', '.webm', '.ogg', '.flac'}
+VIDEO_EXTS = {'.mp4', '.mov', '.avi', '.mkv', '.webm'}
+CHUNK_SIZE = 1024 * 1024
+# 分块上传会话（及已上传的部分）保留时间（秒）
+SESSION_TTL = 24 * 3600
+SESSION_NAMESPACE = "uploads"
+# 单个上传文件的大小上限（字节）
+DEFAULT_MAX_FILE_BYTES = 8 * 1024 ** 3
+# 所有内容的总大小上限（字节）
+DEFAULT_MAX_BYTES = 50 * 1024 ** 3
+DEFAULT_RETENTION_HOURS = 72
+GC_INTERVAL = 600
+# 内容目录中原始内容和转换后 16 kHz WAV 的固定名字，各个文件名都是它们的硬链接
+_CONTENT_NAME = ".data"
+_CONVERTED_NAME = ".16k.wav"
+
+_SHA_RE = re.compile(r"^[0-9a-f]{64}$")
+_UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadOffsetMismatch(ValueError):
+    """Chunk offset does not match what the server already holds."""
+
+    def __init__(self, expected):
+        super().__init__(f"分块偏移量不匹配，服务器已有 {expected} 字节")
+        self.expected = expected
+
+
+class Upload:
+    """A stored upload: its content hash and the path the caller should use."""
+
+    def __init__(self, sha256, path, size, deduplicated=False):
+        self.sha256 = sha256
+        self.path = path
+        self.size = size
+        self.deduplicated = deduplicated
+
+    def to_dict(self):
+        return {
+            "sha256": self.sha256,
+            "path": self.path,
+            "size": self.size,
+            "deduplicated": self.deduplicated,
+        }
+
+
+def _clean_filename(filename, allowed_exts=None):
+    filename = secure_filename(os.path.basename(filename or "")) or "upload"
+    name, ext = os.path.splitext(filename)
+    ext = ext.lower()
+    allowed = allowed_exts or (AUDIO_EXTS | VIDEO_EXTS)
+    if ext not in allowed:
+        raise ValueError(f"不支持的文件类型: {ext or filename}")
+    # 以 . 开头的名字留给内部文件
+    return (name.lstrip(".") or "upload") + ext
+
+
+class UploadStore:
+    """Content-addressed upload storage with resumable chunked uploads."""
+
+    def __init__(self, root=UPLOAD_ROOT, state_store=None, max_bytes=None, max_file_bytes=None, retention=None):
+        self.root = root
+        self.blob_root = os.path.join(root, "blobs")
+        self.partial_root = os.path.join(root, "partial")
+        self.tmp_root = os.path.join(root, "tmp")
+        self.state_store = state_store or shared_store
+        self.max_bytes = max_bytes or int(os.getenv("UPLOAD_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.max_file_bytes = max_file_bytes or int(os.getenv("UPLOAD_MAX_FILE_BYTES", DEFAULT_MAX_FILE_BYTES))
+        self.retention = retention or float(os.getenv("UPLOAD_RETENTION_HOURS", DEFAULT_RETENTION_HOURS)) * 3600
+        self.uploads = 0
+        self.deduplicated = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        # upload_id -> (sha256 对象, 已计算的字节数)，顺序到达的分块不必重新读取已上传的部分
+        self._hashers = {}
+        self._reference_sources = []
+        # 本进程正在处理（不经过任务队列）的文件路径 -> 使用次数
+        self._in_use = Counter()
+        self._last_gc = 0.0
+
+    def register_reference_source(self, source):
+        """source() 返回仍在使用的文件路径，垃圾回收不会删除这些文件所在的内容。"""
+        self._reference_sources.append(source)
+
+    def blob_dir(self, sha256):
+        return os.path.join(self.blob_root, sha256[:2], sha256)
+
+    def touch(self, path):
+        """刷新 path 所属内容的最近使用时间；不在存储中的路径忽略。"""
+        sha256 = self.sha_of(path)
+        if sha256 is None:
+            return
+        try:
+            os.utime(self.blob_dir(sha256), None)
+        except OSError:
+            pass
+
+    @contextmanager
+    def using(self, *paths):
+        """with 块内把 paths 登记为本进程正在使用的文件，垃圾回收不会删除它们所在的内容。"""
+        paths = [path for path in paths if path]
+        for path in paths:
+            self.touch(path)
+        with self._lock:
+            self._in_use.update(paths)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use.subtract(paths)
+                self._in_use += Counter()
+
+    # ---- 一次性上传 ----
+
+    def ingest(self, stream, filename, allowed_exts=None):
+        """把可读流写入存储，边写边计算哈希；返回 Upload。"""
+        self._maybe_gc()
+        filename = _clean_filename(filename, allowed_exts)
+        os.makedirs(self.tmp_root, exist_ok=True)
+        tmp_path = os.path.join(self.tmp_root, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise ValueError(f"文件超过大小上限 {self.max_file_bytes} 字节")
+                    digest.update(chunk)
+                    f.write(chunk)
+            return self._commit(tmp_path, digest.hexdigest(), filename, size)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _commit(self, tmp_path, sha256, filename, size):
+        """把写完的临时文件放进内容目录；内容已存在时丢弃临时文件，只补一个文件名。"""
+        blob_dir = self.blob_dir(sha256)
+        with self._key_lock(sha256):
+            content = os.path.join(blob_dir, _CONTENT_NAME)
+            deduplicated = os.path.isfile(content)
+            if not deduplicated:
+                os.makedirs(blob_dir, exist_ok=True)
+                os.replace(tmp_path, content)
+            path = self._link_name(blob_dir, content, filename)
+            os.utime(blob_dir, None)
+        with self._lock:
+            self.uploads += 1
+            if deduplicated:
+                self.deduplicated += 1
+        if deduplicated:
+            print(f"[backend.upload_store] 内容已存在，复用: {path}")
+        return Upload(sha256, path, size, deduplicated)
+
+    def _link_name(self, blob_dir, content, filename):
+        """在内容目录中为内容挂一个文件名（硬链接，不支持时复制）。"""
+        name, ext = os.path.splitext(filename)
+        name = f"{os.path.basename(blob_dir)[:8]}_{name}"
+        path = os.path.join(blob_dir, name + ext)
+        suffix = 1
+        # 同名文件可能是转换出的 WAV，不是同一份内容时换个名字
+        while os.path.exists(path) and not os.path.samefile(path, content):
+            path = os.path.join(blob_dir, f"{name}_{suffix}{ext}")
+            suffix += 1
+        if not os.path.exists(path):
+            publish_file(content, path, ("link", "reflink", "copy"))
+        return path
+
+    def _key_lock(self, sha256):
+        with self._lock:
+            return self._key_locks.setdefault(sha256, threading.Lock())
+
+    # ---- 分块上传 ----
+
+    def begin(self, filename, size, sha256=None, allowed_exts=None):
+        """开始一次分块上传；声明的 sha256 已在存储中时直接完成，不必再传数据。"""
+        self._maybe_gc()
+        filename = _clean_filename(filename, allowed_exts)
+        size = int(size)
+        if size <= 0 or size > self.max_file_bytes:
+            raise ValueError(f"文件大小必须在 1 到 {self.max_file_bytes} 字节之间")
+        sha256 = (sha256 or "").lower() or None
+        if sha256 is not None and not _SHA_RE.match(sha256):
+            raise ValueError("sha256 格式不正确")
+
+        session = {
+            "upload_id": uuid.uuid4().hex,
+            "filename": filename,
+            "size": size,
+            "sha256": sha256,
+            "created_at": time.time(),
+            "result": None,
+        }
+        if sha256 is not None:
+            blob_dir = self.blob_dir(sha256)
+            with self._key_lock(sha256):
+                content = os.path.join(blob_dir, _CONTENT_NAME)
+                if os.path.isfile(content) and os.path.getsize(content) == size:
+                    path = self._link_name(blob_dir, content, filename)
+                    os.utime(blob_dir, None)
+                    session["result"] = Upload(sha256, path, size, deduplicated=True).to_dict()
+                    with self._lock:
+                        self.uploads += 1
+                        self.deduplicated += 1
+        self._save_session(session)
+        return self._state(session)
+
+    def status(self, upload_id):
+        session = self._load_session(upload_id)
+        return self._state(session) if session else None
+
+    def append(self, upload_id, offset, stream):
+        """从 offset 处追加一个分块；offset 与已上传的字节数不一致时抛出 UploadOffsetMismatch。"""
+        session = self._require_session(upload_id)
+        if session["result"] is not None:
+            return self._state(session)
+        part_path = self._part_path(upload_id)
+        os.makedirs(self.partial_root, exist_ok=True)
+        with self._key_lock(upload_id):
+            current = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if int(offset) != current:
+                raise UploadOffsetMismatch(current)
+            digest = self._hasher_at(upload_id, part_path, current)
+            remaining = session["size"] - current
+            written = 0
+            with open(part_path, 'ab') as f:
+                try:
+                    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                        if written + len(chunk) > remaining:
+                            raise ValueError("分块超出了声明的文件大小")
+                        f.write(chunk)
+                        digest.update(chunk)
+                        written += len(chunk)
+                except Exception:
+                    # 丢弃这个分块写入的部分，客户端从原偏移量重传
+                    f.truncate(current)
+                    self._hashers.pop(upload_id, None)
+                    raise
+            self._hashers[upload_id] = (digest, current + written)
+        # 续上会话的 TTL
+        self._save_session(session)
+        return self._state(session)
+
+    def complete(self, upload_id):
+        """所有分块到齐后校验大小和哈希，把内容放进存储，返回 Upload。"""
+        session = self._require_session(upload_id)
+        if session["result"] is not None:
+            result = session["result"]
+            return Upload(result["sha256"], result["path"], result["size"], result["deduplicated"])
+        part_path = self._part_path(upload_id)
+        with self._key_lock(upload_id):
+            current = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if current != session["size"]:
+                raise UploadOffsetMismatch(current)
+            sha256 = self._hasher_at(upload_id, part_path, current).hexdigest()
+            self._hashers.pop(upload_id, None)
+            if session["sha256"] is not None and session["sha256"] != sha256:
+                os.remove(part_path)
+                self._delete_session(upload_id)
+                raise ValueError("上传内容的 sha256 与声明的不一致，请重新上传")
+            upload = self._commit(part_path, sha256, session["filename"], current)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        session["result"] = upload.to_dict()
+        self._save_session(session)
+        return upload
+
+    def abort(self, upload_id):
+        session = self._load_session(upload_id)
+        if session is None:
+            return False
+        with self._key_lock(upload_id):
+            self._hashers.pop(upload_id, None)
+            part_path = self._part_path(upload_id)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        self._delete_session(upload_id)
+        return True
+
+    def _hasher_at(self, upload_id, part_path, offset):
+        cached = self._hashers.get(upload_id)
+        if cached is not None and cached[1] == offset:
+            return cached[0]
+        # 进程重启或分块落到了其他 worker：重新读取已上传的部分
+        digest = hashlib.sha256()
+        if offset:
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+        return digest
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.partial_root, f"{upload_id}.part")
+
+    def _state(self, session):
+        part_path = self._part_path(session["upload_id"])
+        result = session["result"]
+        if result is not None:
+            offset = session["size"]
+        else:
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        return {
+            "upload_id": session["upload_id"],
+            "filename": session["filename"],
+            "size": session["size"],
+            "offset": offset,
+            "complete": result is not None,
+            "result": result,
+        }
+
+    def _require_session(self, upload_id):
+        session = self._load_session(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        return session
+
+    def _load_session(self, upload_id):
+        if not upload_id or not _UPLOAD_ID_RE.match(upload_id):
+            return None
+        return self.state_store.get(SESSION_NAMESPACE, upload_id)
+
+    def _save_session(self, session):
+        self.state_store.set(SESSION_NAMESPACE, session["upload_id"], session, ttl=SESSION_TTL)
+
+    def _delete_session(self, upload_id):
+        self.state_store.delete(SESSION_NAMESPACE, upload_id)
+
+    # ---- 派生文件 ----
+
+    def ensure_wav(self, path):
+        """返回 16 kHz 单声道 WAV；存储中的内容只转换一次，之后各个文件名都直接复用。"""
+        if is_target_wav(path):
+            return path
+        base, ext = os.path.splitext(path)
+        wav_path = base + ('_16k.wav' if ext.lower() == '.wav' else '.wav')
+        blob_dir = os.path.dirname(path)
+        if not self._in_store(path):
+            return load_pcm(path).save_wav(wav_path)
+        converted = os.path.join(blob_dir, _CONVERTED_NAME)
+        with self._key_lock(os.path.basename(blob_dir)):
+            if not os.path.isfile(converted):
+                load_pcm(path).save_wav(converted)
+            if not os.path.exists(wav_path):
+                publish_file(converted, wav_path, ("link", "reflink", "copy"))
+        return wav_path
+
+    def _in_store(self, path):
+        blob_root = os.path.abspath(self.blob_root)
+        return os.path.commonpath([blob_root, os.path.abspath(path)]) == blob_root
+
+    def sha_of(self, path):
+        """存储中文件所属内容的 sha256；不在存储中时返回 None。"""
+        if not path or not self._in_store(path):
+            return None
+        name = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        return name if _SHA_RE.match(name) else None
+
+    # ---- 垃圾回收 ----
+
+    def _referenced(self):
+        with self._lock:
+            referenced = set(filter(None, map(self.sha_of, self._in_use)))
+        for source in self._reference_sources:
+            try:
+                referenced.update(filter(None, map(self.sha_of, source())))
+            except Exception as exc:
+                print(f"[backend.upload_store] 读取引用失败: {exc}")
+        return referenced
+
+    def gc(self, now=None):
+        """删除过期或超出总大小上限、且没有被引用的内容，以及过期的分块上传；返回删除的内容数。"""
+        now = now or time.time()
+        referenced = self._referenced()
+        entries = []
+        for prefix in _scandirs(self.blob_root):
+            for entry in _scandirs(prefix.path):
+                entries.append((entry.stat().st_mtime, entry.name, entry.path, _dir_size(entry.path)))
+        entries.sort()
+        total = sum(e[3] for e in entries)
+
+        removed = 0
+        for mtime, sha256, path, size in entries:
+            expired = now - mtime > self.retention
+            if not expired and total <= self.max_bytes:
+                continue
+            if sha256 in referenced:
+                continue
+            with self._key_lock(sha256):
+                shutil.rmtree(path, ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+
+        # 会话记录已过期的分块上传
+        for entry in _scandirs(self.partial_root, files=True):
+            upload_id = entry.name[:-len(".part")]
+            if now - entry.stat().st_mtime > SESSION_TTL and self._load_session(upload_id) is None:
+                os.remove(entry.path)
+        for entry in _scandirs(self.tmp_root, files=True):
+            if now - entry.stat().st_mtime > SESSION_TTL:
+                os.remove(entry.path)
+        if removed:
+            print(f"[backend.upload_store] 清理未引用的上传内容: {removed} 个")
+        return removed
+
+    def _maybe_gc(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_gc < GC_INTERVAL:
+                return
+            self._last_gc = now
+        try:
+            self.gc(now)
+        except OSError as exc:
+            print(f"[backend.upload_store] 清理上传内容失败: {exc}")
+
+    def stats(self):
+        blobs = 0
+        total = 0
+        for prefix in _scandirs(self.blob_root):
+            for entry in _scandirs(prefix.path):
+                blobs += 1
+                total += _dir_size(entry.path)
+        with self._lock:
+            return {
+                "blobs": blobs,
+                "bytes": total,
+                "uploads": self.uploads,
+                "deduplicated": self.deduplicated,
+                "dedup_rate": self.deduplicated / self.uploads if self.uploads else 0.0,
+            }
+
+
+def _scandirs(path, files=False):
+    try:
+        return [e for e in os.scandir(path) if (e.is_file() if files else e.is_dir())]
+    except FileNotFoundError:
+        return []
+
+
+def _dir_size(path):
+    """目录内文件的总大小，硬链接只计一次。"""
+    seen = set()
+    total = 0
+    for entry in _scandirs(path, files=True):
+        stat = entry.stat()
+        if stat.st_ino not in seen:
+            seen.add(stat.st_ino)
+            total += stat.st_size
+    return total
+
+
+upload_store = UploadStore()
@@ -1,15 +1,29 @@
 import os
 import time
 import subprocess
-import shutil
+from contextlib import contextmanager
 from glob import glob
 
+from backend.result_cache import result_cache
+from backend.inference_worker import worker_pool, warm_worker_enabled
+from backend.model_registry import model_registry
+from backend.file_publish import publish_file
+from backend.tracing import traced, span
+from backend.device_scheduler import device_scheduler
+from backend.audio_features import audio_features
+from backend.shared_state import device_slot
+
 
 def _resolve_model_dir(model_param):
     """Handle dir/file/glob inputs and return the model directory containing checkpoints."""
     if not model_param:
         return None
 
+    # 先查模型索引，命中时不需要 glob 或逐个探测目录
+    indexed = model_registry.resolve(model_param)
+    if indexed:
+        return indexed
+
     def _from_checkpoint(path):
         parent = os.path.dirname(path)
         return os.path.dirname(parent) if os.path.basename(parent) == "checkpoints" else parent
@@ -39,8 +53,9 @@ def _resolve_model_dir(model_param):
     return None
 
 
-def _copy_output_video(model_param, ref_audio):
-    """Locate the output video generated by SyncTalk and copy it to static/videos."""
+@traced("publish_output")
+def _copy_output_video(model_param, ref_audio, destination_name=None):
+    """Locate the output video generated by SyncTalk and publish it to static/videos (reflink, copy as fallback)."""
     model_dir_name = os.path.basename(model_param)
     audio_name = os.path.splitext(os.path.basename(ref_audio))[0]
     results_dir = os.path.join("SyncTalk", "model", model_dir_name, "results")
@@ -48,24 +63,23 @@ def _copy_output_video(model_param, ref_audio):
     os.makedirs(destination_dir, exist_ok=True)
 
     expected_output = os.path.join(results_dir, f"{model_dir_name}_{audio_name}.mp4")
-    destination_path = os.path.join(destination_dir, f"{model_dir_name}_{audio_name}.mp4")
+    destination_path = os.path.join(destination_dir, destination_name or f"{model_dir_name}_{audio_name}.mp4")
 
     if os.path.exists(expected_output):
-        shutil.copy(expected_output, destination_path)
+        publish_file(expected_output, destination_path)
         return destination_path
 
     default_output = os.path.join(results_dir, "test_audio.mp4")
     if os.path.exists(default_output):
-        shutil.copy(default_output, destination_path)
+        publish_file(default_output, destination_path)
         return destination_path
 
-    if os.path.exists(results_dir):
-        mp4_files = [f for f in os.listdir(results_dir) if f.endswith('.mp4')]
-        if mp4_files:
-            latest_file = max(mp4_files, key=lambda f: os.path.getctime(os.path.join(results_dir, f)))
-            source_path = os.path.join(results_dir, latest_file)
-            shutil.copy(source_path, destination_path)
-            return destination_path
+    # 使用模型索引中记录的结果文件，而不是每次列目录并按时间排序
+    entry = model_registry.get(model_dir_name)
+    source_path = entry.latest_result() if entry is not None else None
+    if source_path and os.path.exists(source_path):
+        publish_file(source_path, destination_path)
+        return destination_path
 
     return os.path.join("static", "videos", "out.mp4")
 
@@ -74,7 +88,8 @@ def _validate_inputs(data):
     model_param_raw = data.get('model_param')
     model_param = _resolve_model_dir(model_param_raw)
     ref_audio = data.get('ref_audio')
-    gpu_choice = data.get('gpu_choice') or "GPU0"
+    # 返回设备名或 "auto"，实际设备在执行时由调度器分配
+    gpu_choice = device_scheduler.normalize(data.get('gpu_choice'))
 
     if not model_param or not os.path.isdir(model_param):
         raise ValueError(f"模型目录无效: {model_param_raw}")
@@ -89,28 +104,74 @@ def _validate_inputs(data):
     return model_param, ref_audio, gpu_choice
 
 
+def _worker_output_path(model_param, ref_audio):
+    """常驻 worker 的输出位置，与 _copy_output_video 查找的 expected_output 一致。"""
+    model_dir_name = os.path.basename(model_param)
+    audio_name = os.path.splitext(os.path.basename(ref_audio))[0]
+    return os.path.join("SyncTalk", "model", model_dir_name, "results", f"{model_dir_name}_{audio_name}.mp4")
+
+
+def _publish_output(model_param, ref_audio, cache_key, cacheable=True, strict=False):
+    """Copy the SyncTalk output under its content-addressed name and record it in the cache.
+
+    strict=True 时找不到这段音频的输出直接抛出 RuntimeError，不发布兜底结果。
+    """
+    # test_audio.mp4 / latest_result 等兜底结果不是这段音频渲染出来的，不能写入缓存
+    expected_output = _worker_output_path(model_param, ref_audio)
+    if not os.path.exists(expected_output):
+        if strict:
+            raise RuntimeError(f"未找到 SyncTalk 输出: {expected_output}")
+        cacheable = False
+    destination_name = result_cache.output_name(model_param, cache_key)
+    destination_path = _copy_output_video(model_param, ref_audio, destination_name)
+    if cacheable and os.path.basename(destination_path) == destination_name:
+        result_cache.store(cache_key, destination_path)
+    return destination_path
+
+
 def _build_cmd(model_param, ref_audio, gpu_choice):
-    return [
+    cmd = [
         './SyncTalk/run_synctalk.sh', 'infer',
         '--model_dir', model_param,
         '--audio_path', ref_audio,
         '--gpu', gpu_choice
     ]
+    # 同一段音频的特征只提取一次，之后的推理直接读取缓存的 .npy
+    features_path = audio_features.ensure(ref_audio, gpu_choice)
+    if features_path:
+        cmd += ['--audio_features', features_path]
+    return cmd
 
-def generate_video(data):
-    """
-    模拟视频生成逻辑：接收来自前端的参数，并返回一个视频路径。
-    """
-    print("[backend.video_generator] 收到数据：")
-    for k, v in data.items():
-        print(f"  {k}: {v}")
+@contextmanager
+def infer_slot(device, should_abort=None):
+    """占用 device 的一个推理槽位，与排队任务、渐进式任务共用同一台机器上的 infer-<设备> 并发上限。
 
-    if data.get('model_name') == "SyncTalk":
-        try:
-            model_param, ref_audio, gpu_choice = _validate_inputs(data)
-            cmd = _build_cmd(model_param, ref_audio, gpu_choice)
-
-            print(f"[backend.video_generator] 解析模型目录: {model_param}")
+    产出是否拿到槽位；should_abort() 为真时放弃等待。
+    """
+    # job_queue 依赖本模块，延迟导入避免循环引用
+    from backend.job_queue import video_jobs
+    limit = max(1, video_jobs.device_limits.get(device, 0))
+    with device_slot(f"infer-{device}", limit, should_abort) as acquired:
+        yield acquired
+
+
+def _render(model_param, ref_audio, gpu_choice, strict=False):
+    """查结果缓存，未命中时占用设备推理并发布输出，返回 (视频路径, 退出码)；命中缓存时退出码为 0。"""
+    cache_key = result_cache.key_for(model_param, ref_audio)
+    cached_path = result_cache.lookup(cache_key)
+    if cached_path:
+        print(f"[backend.video_generator] 命中结果缓存: {cached_path}")
+        return cached_path, 0
+
+    print(f"[backend.video_generator] 解析模型目录: {model_param}")
+
+    with span("video_render"), device_scheduler.reserve(gpu_choice) as device, infer_slot(device):
+        if warm_worker_enabled():
+            print(f"[backend.video_generator] 使用常驻推理进程: {device}")
+            worker_pool.infer(model_param, device, ref_audio, _worker_output_path(model_param, ref_audio))
+            return_code = 0
+        else:
+            cmd = _build_cmd(model_param, ref_audio, device)
             print(f"[backend.video_generator] 执行命令: {' '.join(cmd)}")
 
             # 执行命令
@@ -120,12 +181,39 @@ def generate_video(data):
                 text=True
                 # check=True
             )
-            
+
             print("命令标准输出:", result.stdout)
             if result.stderr:
                 print("命令标准错误:", result.stderr)
-            
-            destination_path = _copy_output_video(model_param, ref_audio)
+            return_code = result.returncode
+
+    succeeded = return_code == 0
+    return _publish_output(model_param, ref_audio, cache_key, succeeded, strict and succeeded), return_code
+
+
+def render_video(model_param, ref_audio, gpu_choice):
+    """渲染一段音频并返回 static/videos 下的视频路径；推理失败或没有产出这段音频的视频时抛出 RuntimeError。
+
+    model_param / gpu_choice 应已经过 _validate_inputs。
+    """
+    destination_path, return_code = _render(model_param, ref_audio, gpu_choice, strict=True)
+    if return_code != 0:
+        raise RuntimeError(f"SyncTalk 推理失败，退出码: {return_code}")
+    return destination_path
+
+
+def generate_video(data):
+    """
+    模拟视频生成逻辑：接收来自前端的参数，并返回一个视频路径。
+    """
+    print("[backend.video_generator] 收到数据：")
+    for k, v in data.items():
+        print(f"  {k}: {v}")
+
+    if data.get('model_name') == "SyncTalk":
+        try:
+            model_param, ref_audio, gpu_choice = _validate_inputs(data)
+            destination_path, _ = _render(model_param, ref_audio, gpu_choice)
             print(f"[backend.video_generator] 视频生成完成，路径：{destination_path}")
             return destination_path
             
@@ -140,34 +228,3 @@ def generate_video(data):
     video_path = os.path.join("static", "videos", "out.mp4")
     print(f"[backend.video_generator] 视频生成完成，路径：{video_path}")
     return video_path
-
-
-def stream_generate_video(data):
-    """Stream stdout from run_synctalk.sh so the frontend can display logs."""
-    try:
-        model_param, ref_audio, gpu_choice = _validate_inputs(data)
-        cmd = _build_cmd(model_param, ref_audio, gpu_choice)
-
-        yield f"[backend.video_generator] 解析模型目录: {model_param}\n"
-        yield f"[backend.video_generator] 执行命令: {' '.join(cmd)}\n"
-
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1
-        )
-
-        if process.stdout:
-            for line in process.stdout:
-                yield line.rstrip('\n') + "\n"
-
-        return_code = process.wait()
-        yield f"[backend.video_generator] 退出码: {return_code}\n"
-
-        destination_path = _copy_output_video(model_param, ref_audio)
-        yield f"__VIDEO_PATH__ {destination_path}\n"
-
-    except Exception as exc:
-        yield f"__ERROR__ {exc}\n"
@@ -0,0 +1,156 @@
+"""视频生成的 Server-Sent Events 流：带类型的进度事件、心跳保活、按任务 id 断线重连。
+
+推理本身由 ``video_jobs`` 在后台执行，输出逐行追加到 ``job.logs``；这里只负责把日志
+从某个偏移开始翻译成 SSE 事件，所以慢客户端不会阻塞 SyncTalk 进程，重连时也能从
+``Last-Event-ID`` 处补发。由 SSE 请求本身提交的任务（``cancel_on_disconnect``）在所有订阅者
+都断开并超过宽限期后会被取消，进程随之终止；通过异步接口提交、只是用 SSE 查看进度的任务不受影响。
+"""
+import json
+import os
+import re
+import threading
+import time
+
+from backend.job_queue import video_jobs, FINISHED_STATES, JOB_SUCCEEDED
+from backend.shared_state import shared_store
+
+
+# 没有新输出时每隔多少秒发送一次心跳；写入失败也是发现客户端断开的唯一途径
+KEEPALIVE_INTERVAL = float(os.getenv("VIDEO_STREAM_KEEPALIVE", 15))
+# 最后一个订阅者断开后等待重连的时间（秒），超时则取消任务
+DISCONNECT_GRACE = float(os.getenv("VIDEO_STREAM_DISCONNECT_GRACE", 10))
+POLL_INTERVAL = 0.2
+# 建议浏览器在断线后多久重连（毫秒）
+RETRY_MS = 2000
+# 多 worker 部署时，客户端可能重连到另一个 worker；订阅中的流定期在共享存储里留下心跳，
+# 任务所属 worker 据此判断是否还有人在看
+WATCHING_NAMESPACE = "video_stream_watchers"
+WATCHING_INTERVAL = 2.0
+
+# tqdm 风格进度："45%|████      | 123/270 [00:10<00:12, 11.2it/s]"
+_PERCENT_RE = re.compile(r"(\d{1,3}(?:\.\d+)?)%\|")
+_FRAMES_RE = re.compile(r"\b(\d+)\s*/\s*(\d+)\b")
+_FRAME_RE = re.compile(r"\bframe[\s:=#]*(\d+)", re.IGNORECASE)
+
+_subscribers = {}
+_subscribers_lock = threading.Lock()
+
+
+def parse_frame_progress(line):
+    """从一行推理输出中解析进度，返回 {"percent", "frame", "total_frames"} 或 None。"""
+    percent_match = _PERCENT_RE.search(line)
+    frames_match = _FRAMES_RE.search(line)
+    frame_match = _FRAME_RE.search(line)
+    if not (percent_match or frames_match or frame_match):
+        return None
+
+    progress = {"percent": None, "frame": None, "total_frames": None}
+    if frames_match and (percent_match or frame_match or "it/s" in line or "s/it" in line):
+        progress["frame"] = int(frames_match.group(1))
+        progress["total_frames"] = int(frames_match.group(2))
+    elif frame_match:
+        progress["frame"] = int(frame_match.group(1))
+    if percent_match:
+        progress["percent"] = float(percent_match.group(1))
+    elif progress["total_frames"]:
+        progress["percent"] = round(100.0 * progress["frame"] / progress["total_frames"], 1)
+
+    if progress["percent"] is None and progress["frame"] is None:
+        return None
+    return progress
+
+
+def sse_event(event, data, event_id=None):
+    """按 SSE 格式编码一个事件；data 序列化为单行 JSON。"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return "\n".join(lines) + "\n\n"
+
+
+def _subscribe(job_id):
+    with _subscribers_lock:
+        _subscribers[job_id] = _subscribers.get(job_id, 0) + 1
+
+
+def _unsubscribe(job_id, cancel_on_disconnect):
+    with _subscribers_lock:
+        remaining = _subscribers.get(job_id, 1) - 1
+        if remaining > 0:
+            _subscribers[job_id] = remaining
+        else:
+            _subscribers.pop(job_id, None)
+    if remaining <= 0 and cancel_on_disconnect:
+        timer = threading.Timer(DISCONNECT_GRACE, _cancel_if_abandoned, args=(job_id,))
+        timer.daemon = True
+        timer.start()
+
+
+def _cancel_if_abandoned(job_id):
+    with _subscribers_lock:
+        if _subscribers.get(job_id):
+            return
+    if shared_store.shared:
+        seen_at = shared_store.get(WATCHING_NAMESPACE, job_id)
+        if seen_at is not None and time.time() - seen_at < DISCONNECT_GRACE:
+            return
+    job = video_jobs.lookup(job_id)
+    if job is not None and job.status not in FINISHED_STATES and getattr(job, "cancel_on_disconnect", False):
+        print(f"[backend.video_stream] 客户端已断开，取消任务: {job_id}")
+        video_jobs.cancel(job_id)
+
+
+def stream_job_events(job, offset=0):
+    """从第 offset 行日志开始产出 SSE 事件，直到任务结束。
+
+    事件类型：job / log / progress / done / error；每条 log/progress 事件的 id 是
+    下一行的偏移，重连时作为 ``Last-Event-ID`` 传回即可接着输出。
+    """
+    _subscribe(job.id)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        yield sse_event("job", job.to_dict())
+        last_sent = time.time()
+        last_watching = 0.0
+        offset = max(0, min(offset, len(job.logs)))
+        while True:
+            if shared_store.shared and time.time() - last_watching >= WATCHING_INTERVAL:
+                last_watching = time.time()
+                shared_store.set(WATCHING_NAMESPACE, job.id, last_watching, ttl=DISCONNECT_GRACE * 2)
+            # 先记下状态再读日志，保证任务结束前的最后几行不会漏掉
+            finished = job.status in FINISHED_STATES
+            lines = job.logs[offset:]
+            for line in lines:
+                offset += 1
+                progress = parse_frame_progress(line)
+                if progress is not None:
+                    yield sse_event("progress", dict(progress, line=line), offset)
+                else:
+                    yield sse_event("log", {"line": line}, offset)
+            if lines:
+                last_sent = time.time()
+
+            if finished:
+                break
+            if time.time() - last_sent >= KEEPALIVE_INTERVAL:
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+            time.sleep(POLL_INTERVAL)
+
+        if job.status == JOB_SUCCEEDED:
+            yield sse_event("done", {
+                "job_id": job.id,
+                "video_path": "/" + job.video_path.replace("\\", "/"),
+                "cached": job.cached,
+            })
+        else:
+            yield sse_event("error", {
+                "job_id": job.id,
+                "status": job.status,
+                "message": job.error or f"任务{job.status}",
+            })
+    finally:
+        # 客户端断开时 WSGI 服务器会关闭生成器，这里同样会执行
+        _unsubscribe(job.id, getattr(job, "cancel_on_disconnect", False))
@@ -0,0 +1,31 @@
+"""gunicorn 配置，全部可通过环境变量覆盖：
+
+* ``WEB_WORKERS``：worker 进程数，默认 2；
+* ``WEB_THREADS``：每个 worker 的线程数，SSE/日志流会长时间占用线程，默认 8；
+* ``WEB_BIND``：监听地址，默认 ``0.0.0.0:5001``；
+* ``WEB_TIMEOUT``：worker 心跳超时（秒），默认 120；
+* ``STATE_BACKEND``：共享状态后端，未设置时使用 sqlite，让多个 worker 共享任务与会话。
+"""
+import os
+
+
+# 在 fork worker 之前设置，worker 导入 backend.shared_state 时继承
+os.environ.setdefault("STATE_BACKEND", "sqlite")
+
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("WEB_WORKERS", 2))
+threads = int(os.getenv("WEB_THREADS", 8))
+worker_class = "gthread"
+timeout = int(os.getenv("WEB_TIMEOUT", 120))
+# 任务线程、SQLite 连接都必须在 worker 进程里创建，不能在 master 中预加载后 fork
+preload_app = False
+accesslog = "-"
+
+
+def on_starting(server):
+    backend = os.environ["STATE_BACKEND"].strip().lower()
+    if workers > 1 and backend == "memory":
+        server.log.warning(
+            "STATE_BACKEND=memory 时各 worker 的任务和会话互不可见，多 worker 部署请使用 sqlite 或 redis"
+        )
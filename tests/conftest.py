@@ -0,0 +1,76 @@
+"""测试公共夹具：每个测试在临时目录中运行，SyncTalk、常驻 worker、帧生成进程都用本地替身。"""
+import os
+import stat
+import sys
+import wave
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+# 必须在导入 backend 之前设置：共享状态只在本进程内，识别用替身引擎
+os.environ["STATE_BACKEND"] = "memory"
+os.environ.setdefault("ASR_ENGINE", "stub")
+
+# 替身命令，{model_dir} / {gpu} / {audio_path} 由被测代码替换
+WORKER_STUB_CMD = f"{sys.executable} -m backend.inference_worker --stub --model_dir {{model_dir}} --gpu {{gpu}}"
+STREAM_STUB_CMD = (
+    f"{sys.executable} -m backend.progressive_output --stub --model_dir {{model_dir}} "
+    f"--audio_path {{audio_path}} --gpu {{gpu}} --width 32 --height 24 --fps 10 --seconds 1"
+)
+
+# SyncTalk 脚本替身：infer 把占位视频写到 SyncTalk 的默认输出位置，STUB_INFER_DELAY 控制耗时
+SYNCTALK_STUB = """#!/bin/sh
+echo "stub $@"
+sleep "${STUB_INFER_DELAY:-0}"
+d=$3
+a=$(basename "$5" .wav)
+mkdir -p "$d/results"
+echo "video for $a" > "$d/results/$(basename "$d")_$a.mp4"
+"""
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """切换到临时目录：SyncTalk/、static/ 等相对路径都落在这里。"""
+    monkeypatch.chdir(tmp_path)
+    # 替身进程以 python -m backend.xxx 启动，需要能找到仓库里的 backend 包
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(filter(None, [REPO_ROOT, os.getenv("PYTHONPATH")])))
+    monkeypatch.setenv("STATE_LOCK_DIR", str(tmp_path / "locks"))
+    return tmp_path
+
+
+@pytest.fixture
+def model_dir(workdir):
+    """SyncTalk/model 下带 checkpoints 的模型目录，返回相对路径。"""
+    path = os.path.join("SyncTalk", "model", "demo")
+    os.makedirs(os.path.join(path, "checkpoints"))
+    with open(os.path.join(path, "checkpoints", "ngp.pth"), 'wb') as f:
+        f.write(b"checkpoint")
+    return path
+
+
+@pytest.fixture
+def synctalk_stub(workdir):
+    script = os.path.join(workdir, "SyncTalk", "run_synctalk.sh")
+    os.makedirs(os.path.dirname(script), exist_ok=True)
+    with open(script, 'w') as f:
+        f.write(SYNCTALK_STUB)
+    os.chmod(script, os.stat(script).st_mode | stat.S_IXUSR)
+    return script
+
+
+@pytest.fixture
+def make_wav(workdir):
+    """写一段 16 kHz 单声道 WAV；不同的 tag 产生不同的内容（结果缓存按内容命中）。"""
+    def _make(name="ref.wav", seconds=0.2, tag=0):
+        path = os.path.join(workdir, name)
+        frames = int(16000 * seconds)
+        with wave.open(path, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(16000)
+            w.writeframes(bytes([tag % 256, 0]) * frames)
+        return path
+    return _make
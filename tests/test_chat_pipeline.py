@@ -0,0 +1,73 @@
+import os
+import time
+
+from backend.chat_pipeline import ChatPipeline, split_sentences
+
+
+def _tts(text, output_path):
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return output_path
+
+
+def test_split_sentences_merges_short_fragments():
+    tokens = ["你好", "。今天天气", "不错！", "好。", "我们出去走走吧"]
+    assert list(split_sentences(tokens)) == ["你好。今天天气不错！", "好。我们出去走走吧"]
+
+
+def test_pipeline_emits_events_in_order(workdir):
+    pipeline = ChatPipeline(
+        asr=lambda path: "你好",
+        llm=lambda text: iter(["第一句话。", "第二句话。"]),
+        tts=_tts,
+        renderer=lambda audio, index: audio + ".mp4",
+        stitch=lambda videos, output: output,
+        output_root=str(workdir / "turns"),
+    )
+    events = list(pipeline.run(audio_path="in.wav", turn_id="t1"))
+    types = [event["type"] for event in events]
+
+    assert types[0] == "transcript" and events[0]["text"] == "你好"
+    assert types.count("sentence") == 2 and types.count("audio") == 2 and types.count("video") == 2
+    assert types[-2:] == ["reply_video", "done"]
+    assert events[-1]["text"] == "第一句话。第二句话。"
+    assert os.path.isfile(os.path.join(workdir, "turns", "t1", "sentence_000.mp3"))
+
+
+def test_pipeline_reports_stage_errors(workdir):
+    def llm(text):
+        yield "只有一句话。"
+        raise RuntimeError("llm down")
+
+    pipeline = ChatPipeline(llm=llm, tts=lambda text, path: None, output_root=str(workdir))
+    events = list(pipeline.run(text="hi"))
+    stages = [event["stage"] for event in events if event["type"] == "error"]
+    assert sorted(stages) == ["llm", "tts"]
+    assert events[-1]["type"] == "done"
+
+
+def test_closing_the_stream_stops_llm_and_tts(workdir):
+    produced = []
+    synthesized = []
+
+    def llm(text):
+        for i in range(50):
+            produced.append(i)
+            yield f"第{i}句话。"
+            time.sleep(0.02)
+
+    def tts(text, output_path):
+        synthesized.append(text)
+        return _tts(text, output_path)
+
+    stream = ChatPipeline(llm=llm, tts=tts, output_root=str(workdir)).run(text="hi")
+    for event in stream:
+        if event["type"] == "audio":
+            break
+    # 客户端断开：关闭生成器后各阶段不再继续调用 LLM / TTS
+    stream.close()
+    time.sleep(0.2)
+    counts = (len(produced), len(synthesized))
+    time.sleep(0.3)
+    assert (len(produced), len(synthesized)) == counts
+    assert counts[0] < 50
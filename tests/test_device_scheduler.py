@@ -0,0 +1,45 @@
+import pytest
+
+from backend.device_scheduler import DeviceScheduler, AUTO, KIND_TRAIN
+from backend.shared_state import MemoryStore
+
+
+@pytest.fixture
+def scheduler():
+    return DeviceScheduler(inventory={"GPU0": 1, "GPU1": 1, "CPU": 1}, store=MemoryStore())
+
+
+def test_normalize_accepts_auto_choices_and_rejects_unknown(scheduler):
+    assert scheduler.normalize("") == AUTO
+    assert scheduler.normalize("multi") == AUTO
+    assert scheduler.normalize("gpu1") == "GPU1"
+    with pytest.raises(ValueError):
+        scheduler.normalize("GPU7")
+
+
+def test_auto_spreads_over_gpus_then_overflows_to_cpu(scheduler):
+    assert scheduler.assign("auto") == "GPU0"
+    assert scheduler.assign("auto") == "GPU1"
+    assert scheduler.assign("auto") == "CPU"
+    # CPU 也满了之后回到负载最低的 GPU 排队
+    assert scheduler.assign("auto") == "GPU0"
+
+
+def test_training_never_overflows_to_cpu(scheduler):
+    scheduler.assign("auto")
+    scheduler.assign("auto")
+    assert scheduler.place("auto", kind=KIND_TRAIN) == "GPU0"
+
+
+def test_release_frees_device(scheduler):
+    with scheduler.reserve("auto") as device:
+        assert device == "GPU0"
+        assert scheduler.stats()["GPU0"]["infer"] == 1
+    assert scheduler.stats()["GPU0"]["infer"] == 0
+    assert scheduler.place("auto") == "GPU0"
+
+
+def test_explicit_device_is_honoured_even_when_busy(scheduler):
+    scheduler.assign("GPU1")
+    assert scheduler.assign("GPU1") == "GPU1"
+    assert scheduler.stats()["GPU1"]["load"] == 2.0
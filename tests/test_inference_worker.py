@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+
+import pytest
+
+from backend.inference_worker import WorkerError, WorkerPool, WorkerProcess
+from conftest import WORKER_STUB_CMD
+
+
+@pytest.fixture
+def pool(workdir):
+    pool = WorkerPool(models_per_device=1, cmd_template=WORKER_STUB_CMD)
+    yield pool
+    pool.shutdown()
+
+
+def test_stub_worker_round_trip(model_dir, make_wav):
+    audio = make_wav()
+    output = os.path.join("out", "demo.mp4")
+    worker = WorkerProcess(model_dir, "CPU", WORKER_STUB_CMD)
+    worker.start(timeout=30)
+    try:
+        logs = list(worker.stream_infer(audio, output))
+        assert logs[-1] == "[stub] 3/3"
+        assert os.path.isfile(output)
+        assert worker.served == 1
+
+        # 一次请求出错不影响 worker 继续服务
+        with pytest.raises(WorkerError):
+            list(worker.stream_infer("missing.wav", output))
+        assert worker.alive()
+        assert worker.infer(audio, output) == output
+        assert worker.served == 2
+    finally:
+        worker.shutdown()
+    assert not worker.alive()
+
+
+def test_start_times_out_when_worker_never_ready(model_dir):
+    worker = WorkerProcess(model_dir, "CPU", WORKER_STUB_CMD + " --load_delay 30")
+    started = time.monotonic()
+    with pytest.raises(WorkerError):
+        worker.start(timeout=0.5)
+    assert time.monotonic() - started < 10
+    assert not worker.alive()
+
+
+def test_pool_reuses_worker_for_same_model(pool, model_dir, make_wav):
+    audio = make_wav()
+    first = pool.acquire(model_dir, "CPU")
+    pool.release(first)
+    second = pool.acquire(model_dir, "CPU")
+    pool.release(second)
+    assert first is second
+    pool.infer(model_dir, "CPU", audio, "out.mp4")
+    assert pool.stats()["CPU"][0]["served"] == 1
+
+
+def test_pool_waits_for_leased_worker_before_evicting(pool, workdir):
+    model_a = os.path.join("SyncTalk", "model", "a")
+    model_b = os.path.join("SyncTalk", "model", "b")
+    worker_a = pool.acquire(model_a, "CPU")
+    acquired = []
+    thread = threading.Thread(target=lambda: acquired.append(pool.acquire(model_b, "CPU")))
+    thread.start()
+    # 设备上只能常驻一个模型，a 仍在使用中，b 必须等待而不是淘汰它
+    thread.join(1.0)
+    assert not acquired
+    assert worker_a.alive()
+
+    pool.release(worker_a)
+    thread.join(30)
+    assert acquired and acquired[0].model_dir == model_b
+    assert not worker_a.alive()
+    pool.release(acquired[0])
+
+
+def test_pool_replaces_dead_worker(pool, model_dir):
+    worker = pool.acquire(model_dir, "CPU")
+    worker.kill()
+    pool.release(worker)
+    replacement = pool.acquire(model_dir, "CPU")
+    try:
+        assert replacement is not worker
+        assert replacement.alive()
+    finally:
+        pool.release(replacement)
@@ -0,0 +1,79 @@
+import os
+import time
+
+import pytest
+
+from backend.inference_worker import worker_pool
+from backend.job_queue import (
+    JobQueue, JobQueueFull, FINISHED_STATES, JOB_CANCELLED, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED,
+)
+from conftest import WORKER_STUB_CMD
+
+
+def _wait(job, timeout=30):
+    deadline = time.time() + timeout
+    while job.status not in FINISHED_STATES and time.time() < deadline:
+        time.sleep(0.05)
+    return job.status
+
+
+@pytest.fixture
+def jobs(workdir, synctalk_stub):
+    return JobQueue(device_limits={"CPU": 1}, max_pending=1)
+
+
+def test_job_runs_and_repeat_hits_result_cache(jobs, model_dir, make_wav):
+    data = {"model_param": model_dir, "ref_audio": make_wav(tag=1), "gpu_choice": "CPU"}
+    job = jobs.submit(data)
+    assert _wait(job) == JOB_SUCCEEDED, job.error
+    assert os.path.isfile(job.video_path)
+    assert any(line.startswith("stub infer") for line in job.logs)
+    assert jobs.lookup(job.id) is job
+
+    repeat = jobs.submit(data)
+    assert repeat.cached and repeat.status == JOB_SUCCEEDED
+    assert repeat.video_path == job.video_path
+
+
+def test_job_on_warm_worker(jobs, model_dir, make_wav, monkeypatch):
+    monkeypatch.setenv("SYNCTALK_WARM_WORKER", "1")
+    monkeypatch.setenv("SYNCTALK_WORKER_CMD", WORKER_STUB_CMD)
+    try:
+        job = jobs.submit({"model_param": model_dir, "ref_audio": make_wav(tag=2), "gpu_choice": "CPU"})
+        assert _wait(job) == JOB_SUCCEEDED, job.error
+        assert os.path.isfile(job.video_path)
+        assert "[stub] 3/3" in job.logs
+    finally:
+        worker_pool.shutdown()
+
+
+def test_full_queue_rejects_and_drops_record(jobs, model_dir, make_wav, monkeypatch):
+    monkeypatch.setenv("STUB_INFER_DELAY", "2")
+    published_before = {key for key, _ in jobs.records.store.items("video_jobs")}
+
+    def submit(tag):
+        return jobs.submit({"model_param": model_dir, "ref_audio": make_wav(f"a{tag}.wav", tag=tag), "gpu_choice": "CPU"})
+
+    running = submit(10)
+    deadline = time.time() + 10
+    while running.status != JOB_RUNNING and time.time() < deadline:
+        time.sleep(0.02)
+    queued = submit(11)
+    # 一个在运行、一个在排队，第三个被拒绝，且不会留在共享记录里
+    with pytest.raises(JobQueueFull):
+        submit(12)
+    published = {key for key, _ in jobs.records.store.items("video_jobs")} - published_before
+    assert published == {running.id, queued.id}
+
+    assert queued.status == JOB_QUEUED
+    jobs.cancel(queued.id)
+    assert queued.status == JOB_CANCELLED
+    jobs.cancel(running.id)
+    assert _wait(running) == JOB_CANCELLED
+
+
+def test_invalid_inputs_raise_value_error(jobs, model_dir):
+    with pytest.raises(ValueError):
+        jobs.submit({"model_param": model_dir, "ref_audio": "missing.wav", "gpu_choice": "CPU"})
+    with pytest.raises(ValueError):
+        jobs.submit({"model_param": "no-such-model", "ref_audio": "missing.wav", "gpu_choice": "CPU"})
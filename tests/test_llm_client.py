@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+import pytest
+
+from backend import llm_client as llm_module
+from backend.llm_client import ConversationHistory, LLMClient, ResponseCache
+from backend.shared_state import MemoryStore
+
+
+class FakeCompletions:
+    """chat.completions 替身：先按 failures 次数抛错，之后返回固定回复。"""
+
+    def __init__(self, reply="你好！", failures=0):
+        self.reply = reply
+        self.failures = failures
+        self.calls = []
+
+    def create(self, model, messages, stream=False):
+        self.calls.append(messages)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("temporary failure")
+        if stream:
+            return iter(
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+                for part in (self.reply[:1], self.reply[1:])
+            )
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.reply))])
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    monkeypatch.setattr(llm_module, "BACKOFF_BASE", 0)
+    return FakeCompletions()
+
+
+@pytest.fixture
+def client(completions, monkeypatch):
+    client = LLMClient(
+        max_retries=2, cache=ResponseCache(max_size=8, ttl=60),
+        history=ConversationHistory(max_tokens=50, state_store=MemoryStore()),
+    )
+    monkeypatch.setattr(client, "_client", lambda api_key: SimpleNamespace(
+        chat=SimpleNamespace(completions=completions)
+    ))
+    return client
+
+
+def test_chat_retries_transient_failures(client, completions):
+    completions.failures = 2
+    assert client.chat("hi", "key", "model") == "你好！"
+    assert len(completions.calls) == 3
+
+
+def test_chat_gives_up_after_max_retries(client, completions):
+    completions.failures = 5
+    with pytest.raises(ConnectionError):
+        client.chat("hi", "key", "model")
+    assert len(completions.calls) == 3
+
+
+def test_repeated_prompt_is_served_from_cache(client, completions):
+    assert client.chat("hi", "key", "model") == client.chat("hi", "key", "model")
+    assert len(completions.calls) == 1
+    assert client.stats()["cache_hits"] == 1
+
+
+def test_conversation_history_is_sent_with_next_turn(client, completions):
+    client.chat("第一轮", "key", "model", conversation_id="c1")
+    client.chat("第二轮", "key", "model", conversation_id="c1")
+    assert [m["content"] for m in completions.calls[-1]] == ["第一轮", "你好！", "第二轮"]
+
+
+def test_stream_chat_yields_parts_and_fills_cache(client, completions):
+    assert list(client.stream_chat("hi", "key", "model", conversation_id="c2")) == ["你", "好！"]
+    assert list(client.stream_chat("hi", "key", "model")) == ["你好！"]
+    assert len(completions.calls) == 1
+
+
+def test_history_trimmed_to_token_budget():
+    history = ConversationHistory(max_tokens=10, state_store=MemoryStore())
+    for i in range(5):
+        history.append("c", f"问题{i}", f"回答{i}")
+    messages = history.messages("c")
+    assert [m["content"] for m in messages] == ["问题4", "回答4"]
@@ -0,0 +1,69 @@
+import os
+import shutil
+import sys
+import time
+
+import pytest
+
+from backend.job_queue import JobQueueFull
+from backend.progressive_output import (
+    FrameProducer, ProgressiveRenderer, LIVE_CANCELLED, LIVE_FINISHED_STATES, LIVE_STARTING, LIVE_SUCCEEDED,
+    PLAYLIST_NAME,
+)
+from conftest import STREAM_STUB_CMD
+
+SILENT_CMD = f"{sys.executable} -c 'import time; time.sleep(30)'"
+
+
+def _wait(job, timeout=30):
+    deadline = time.time() + timeout
+    while job.status not in LIVE_FINISHED_STATES and time.time() < deadline:
+        time.sleep(0.05)
+    return job.status
+
+
+def test_stub_producer_emits_header_and_frames(model_dir, make_wav):
+    producer = FrameProducer(model_dir, make_wav(), "CPU", STREAM_STUB_CMD).start(timeout=30)
+    assert (producer.width, producer.height, producer.fps) == (32, 24, 10.0)
+    frames = list(producer.frames())
+    assert len(frames) == 10
+    assert all(len(frame) == 32 * 24 * 3 for frame in frames)
+    assert producer.wait() == 0
+
+
+def test_producer_without_header_times_out(model_dir, make_wav):
+    producer = FrameProducer(model_dir, make_wav(), "CPU", SILENT_CMD)
+    started = time.monotonic()
+    with pytest.raises(RuntimeError):
+        producer.start(timeout=0.5)
+    assert time.monotonic() - started < 10
+    assert producer.process.poll() is not None
+
+
+def test_pending_cap_and_cancel_while_waiting_for_header(model_dir, make_wav, monkeypatch):
+    monkeypatch.setenv("SYNCTALK_STREAM_CMD", SILENT_CMD)
+    renderer = ProgressiveRenderer(device_limits={"CPU": 1}, max_pending=1)
+    data = {"model_param": model_dir, "ref_audio": make_wav(), "gpu_choice": "CPU"}
+    job = renderer.start(data)
+    assert job.status == LIVE_STARTING
+    with pytest.raises(JobQueueFull):
+        renderer.start(data)
+
+    assert renderer.lookup(job.id) is job
+    renderer.cancel(job.id)
+    assert _wait(job) == LIVE_CANCELLED
+    # 取消后槽位释放，可以再次提交
+    again = renderer.start(data)
+    renderer.cancel(again.id)
+    assert _wait(again) == LIVE_CANCELLED
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="需要 ffmpeg 切分 HLS 分片")
+def test_progressive_job_writes_hls_playlist(model_dir, make_wav, monkeypatch):
+    monkeypatch.setenv("SYNCTALK_STREAM_CMD", STREAM_STUB_CMD)
+    renderer = ProgressiveRenderer(device_limits={"CPU": 1})
+    job = renderer.start({"model_param": model_dir, "ref_audio": make_wav(seconds=1.0), "gpu_choice": "CPU"})
+    assert _wait(job) == LIVE_SUCCEEDED, job.error
+    assert job.frames == 10
+    assert os.path.isfile(os.path.join(job.dir, PLAYLIST_NAME))
+    assert job.to_dict()["segments"] >= 1
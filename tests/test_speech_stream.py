@@ -0,0 +1,69 @@
+import array
+import math
+import os
+
+import pytest
+
+from backend.shared_state import SQLiteStore
+from backend.speech_stream import CHUNK_NAMESPACE, STREAM_NAMESPACE, SpeechStreamManager
+
+
+def _tone(seconds, amplitude, rate=16000):
+    return array.array('h', [int(amplitude * math.sin(i / 5)) for i in range(int(rate * seconds))]).tobytes()
+
+
+# 两句话：静音 - 说话 - 静音 - 说话 - 静音，按 0.25 秒切块
+AUDIO = _tone(0.5, 10) + _tone(1.2, 8000) + _tone(1.0, 10) + _tone(0.8, 8000) + _tone(1.0, 10)
+CHUNKS = [AUDIO[i:i + 8000] for i in range(0, len(AUDIO), 8000)]
+
+
+@pytest.fixture
+def shared(workdir):
+    return SQLiteStore(os.path.join(workdir, "shared.db"))
+
+
+def _feed(manager, stream_id, chunks):
+    utterances = []
+    for chunk in chunks:
+        stream = manager.get(stream_id)
+        assert stream is not None
+        utterances += manager.feed(stream, chunk)["utterances"]
+    return utterances
+
+
+def test_stream_continues_on_another_worker(shared):
+    worker_a = SpeechStreamManager(store=shared)
+    worker_b = SpeechStreamManager(store=shared)
+    stream_id = worker_a.create(16000).id
+
+    # 第一句话跨越两个 worker：a 收到开头，b 收到结尾
+    reported = _feed(worker_a, stream_id, CHUNKS[:3])
+    reported += _feed(worker_b, stream_id, CHUNKS[3:6])
+    # 回到 a 时它的本地状态已经落后，需要按共享记录重建
+    reported += _feed(worker_a, stream_id, CHUNKS[6:13])
+    reported += worker_b.close(stream_id)["utterances"]
+
+    assert [u["index"] for u in reported] == [0, 1]
+    assert all(u["text"] and u["error"] is None for u in reported)
+    assert shared.get(STREAM_NAMESPACE, stream_id) is None
+    assert shared.items(CHUNK_NAMESPACE) == []
+    assert worker_a.get(stream_id) is None
+
+
+def test_alternating_workers_match_single_worker(shared):
+    single = SpeechStreamManager(store=shared)
+    stream_id = single.create(16000).id
+    expected = _feed(single, stream_id, CHUNKS) + single.close(stream_id)["utterances"]
+
+    workers = [SpeechStreamManager(store=shared), SpeechStreamManager(store=shared)]
+    stream_id = workers[0].create(16000).id
+    reported = []
+    for i, chunk in enumerate(CHUNKS):
+        reported += _feed(workers[i % 2], stream_id, [chunk])
+    reported += workers[1].close(stream_id)["utterances"]
+
+    def spans(utterances):
+        return [(u["index"], u["start"], u["end"]) for u in utterances]
+
+    assert len(expected) == 2
+    assert spans(reported) == spans(expected)
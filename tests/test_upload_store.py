@@ -0,0 +1,89 @@
+import hashlib
+import io
+import os
+import time
+
+import pytest
+
+from backend.shared_state import MemoryStore
+from backend.upload_store import UploadOffsetMismatch, UploadStore
+
+
+@pytest.fixture
+def store(workdir):
+    return UploadStore(root=os.path.join("static", "uploads"), state_store=MemoryStore(), retention=3600)
+
+
+def test_ingest_deduplicates_by_content(store):
+    first = store.ingest(io.BytesIO(b"same audio"), "a.wav")
+    second = store.ingest(io.BytesIO(b"same audio"), "b.wav")
+    other = store.ingest(io.BytesIO(b"other audio"), "a.wav")
+
+    assert first.sha256 == second.sha256 == hashlib.sha256(b"same audio").hexdigest()
+    assert not first.deduplicated and second.deduplicated
+    # 换名上传只多一个文件名，同名不同内容不会互相覆盖
+    assert os.path.dirname(first.path) == os.path.dirname(second.path)
+    assert os.path.samefile(first.path, second.path)
+    assert other.path != first.path
+    assert store.stats()["blobs"] == 2
+
+
+def test_ingest_rejects_unsupported_extension(store):
+    with pytest.raises(ValueError):
+        store.ingest(io.BytesIO(b"x"), "script.sh")
+
+
+def test_chunked_upload_resumes_from_offset(store):
+    data = os.urandom(3000)
+    state = store.begin("clip.mp4", len(data))
+    upload_id = state["upload_id"]
+    assert state["offset"] == 0
+
+    store.append(upload_id, 0, io.BytesIO(data[:1000]))
+    with pytest.raises(UploadOffsetMismatch) as excinfo:
+        store.append(upload_id, 0, io.BytesIO(data[:1000]))
+    assert excinfo.value.expected == 1000
+    with pytest.raises(UploadOffsetMismatch):
+        store.complete(upload_id)
+
+    assert store.status(upload_id)["offset"] == 1000
+    store.append(upload_id, 1000, io.BytesIO(data[1000:]))
+    upload = store.complete(upload_id)
+    assert upload.sha256 == hashlib.sha256(data).hexdigest()
+    with open(upload.path, 'rb') as f:
+        assert f.read() == data
+    assert store.status(upload_id)["complete"]
+
+
+def test_begin_with_known_sha_completes_immediately(store):
+    data = b"training video"
+    store.ingest(io.BytesIO(data), "v.mp4")
+    state = store.begin("again.mp4", len(data), sha256=hashlib.sha256(data).hexdigest())
+    assert state["complete"] and state["result"]["deduplicated"]
+
+
+def test_chunked_upload_rejects_wrong_sha(store):
+    data = b"payload"
+    state = store.begin("v.mp4", len(data), sha256="0" * 64)
+    store.append(state["upload_id"], 0, io.BytesIO(data))
+    with pytest.raises(ValueError):
+        store.complete(state["upload_id"])
+    assert store.status(state["upload_id"]) is None
+
+
+def test_gc_keeps_referenced_and_in_use_content(store):
+    used = store.ingest(io.BytesIO(b"in use"), "used.wav")
+    referenced = store.ingest(io.BytesIO(b"referenced"), "ref.wav")
+    stale = store.ingest(io.BytesIO(b"stale"), "stale.wav")
+    store.register_reference_source(lambda: [referenced.path])
+
+    later = time.time() + 2 * 3600
+    with store.using(used.path):
+        assert store.gc(now=later) == 1
+        assert os.path.exists(used.path)
+    assert os.path.exists(referenced.path)
+    assert not os.path.exists(stale.path)
+
+    # 离开 using 之后没有引用，过期即被清理
+    assert store.gc(now=later) == 1
+    assert not os.path.exists(used.path)
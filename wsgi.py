@@ -0,0 +1,10 @@
+"""生产环境 WSGI 入口：``gunicorn -c gunicorn.conf.py wsgi:app``。
+
+每个 worker 进程各自导入 app，启动自己的任务线程；任务记录、缓存索引和会话数据
+通过 ``backend.shared_state`` 在 worker 之间共享。
+"""
+from app import app, _presynthesize_fixed_phrases
+
+
+# TTS 缓存按内容寻址，多个 worker 同时预合成只会重复写入同一批文件
+_presynthesize_fixed_phrases()